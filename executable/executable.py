@@ -1,3 +1,4 @@
+import contextlib
 import os
 import logging
 
@@ -6,12 +7,14 @@ from argparse import ArgumentParser
 import pandas as pd
 import torch
 
-from signaturesnet import DATA, TRAINED_MODELS
+from signaturesnet import TRAINED_MODELS
 from signaturesnet.modules.signet_module import SigNet
 from signaturesnet.models import Generator
 from signaturesnet.models import Classifier
-from signaturesnet.utilities.io import read_model, tensor_to_csv
+from signaturesnet.utilities.catalog import load_catalog
+from signaturesnet.utilities.io import SigNetResultWriter, read_model, save_signet_bundle, tensor_to_csv
 from signaturesnet.utilities.normalize_data import normalize_data
+from signaturesnet.utilities.result_cache import ResultCache
 
 logging.basicConfig(format='%(asctime)s %(levelname)-8s %(message)s',
                     level=logging.INFO,
@@ -20,7 +23,7 @@ logging.basicConfig(format='%(asctime)s %(levelname)-8s %(message)s',
 def parse_args():
     parser = ArgumentParser()
     parser.add_argument(
-        'task', help=f'Must be one of: [refitter, generator, detector]. Depending on the solution you are interested in.'
+        'task', help=f'Must be one of: [refitter, generator, detector, bundle, server]. Depending on the solution you are interested in.'
     )
 
     parser.add_argument(
@@ -34,7 +37,7 @@ def parse_args():
     )
 
     parser.add_argument(
-        '--output_path', action='store', nargs=1, type=str, required=False, default="signet_output",
+        '--output_path', action='store', nargs=1, type=str, required=False, default=["signet_output"],
         help=f"Name of this inference's results"
     )
 
@@ -43,30 +46,161 @@ def parse_args():
         help=f'Boolean. Whether to compute plots for the output. Default: "False".'
     )
 
+    parser.add_argument(
+        '--plot_format', action='store', nargs=1, type=str, required=False, default=["png"],
+        help=f'[ONLY FOR REFITTER] File format of the plots: "png", "pdf", "svg" or "jpg". Default: "png".'
+    )
+
+    parser.add_argument(
+        '--plot_workers', action='store', nargs=1, type=int, required=False, default=[1],
+        help=f'[ONLY FOR REFITTER] Num of processes rendering the plots in parallel. Default: 1.'
+    )
+
+    parser.add_argument(
+        '--bundle', action='store', nargs=1, type=str, required=False, default=[None],
+        help=f'[ONLY FOR REFITTER AND SERVER] Path to a SigNet bundle (created with the bundle task) to load the models from.'
+    )
+
+    parser.add_argument(
+        '--inference_engine', action='store', nargs=1, type=str, required=False, default=["eager"],
+        help=f'[ONLY FOR REFITTER AND SERVER] "eager" or "torchscript" (compiles the whole inference into a single graph). Default: "eager".'
+    )
+
+    parser.add_argument(
+        '--precision', action='store', nargs=1, type=str, required=False, default=["fp32"],
+        help=f'[ONLY FOR REFITTER AND SERVER] "fp32" or "int8" (quantized Linear layers, faster on CPU). Default: "fp32".'
+    )
+
+    parser.add_argument(
+        '--result_cache', action='store', nargs=1, type=str, required=False, default=[None],
+        help=f'[ONLY FOR REFITTER AND SERVER] SQLite file where to cache the output of each sample, so that identical samples of this or later runs are not refitted again.'
+    )
+
+    parser.add_argument(
+        '--output_format', action='store', nargs=1, type=str, required=False, default=["csv"],
+        help=f'[ONLY FOR REFITTER] "csv" (one file per output), "parquet" or "arrow" (single columnar file signet_results.<format>, needs pyarrow). Default: "csv".'
+    )
+
+    parser.add_argument(
+        '--chunk_size', action='store', nargs=1, type=int, required=False, default=[None],
+        help=f'[ONLY FOR REFITTER] Stream the input: read, refit and write it in chunks of this many samples (bounded memory for large cohorts). Default: whole input at once.'
+    )
+
+    parser.add_argument(
+        '--nworkers', action='store', nargs=1, type=int, required=False, default=[1],
+        help=f'[ONLY FOR REFITTER] Num of processes computing the NNLS guesses. Default: 1.'
+    )
+
+    parser.add_argument(
+        '--pipeline_chunk_size', action='store', nargs=1, type=int, required=False, default=[None],
+        help=f'[ONLY FOR REFITTER] Refit in chunks of this many samples, computing the NNLS of each chunk while the networks process the previous one (use it with --nworkers > 1). Default: whole input at once.'
+    )
+
     parser.add_argument(
         '--n_points', action='store', nargs=1, type=str, required=False, default=[1000],
         help=f'[ONLY FOR GENERATOR] Number of points to be generated.'
     )
 
+    parser.add_argument(
+        '--host', action='store', nargs=1, type=str, required=False, default=["127.0.0.1"],
+        help=f'[ONLY FOR SERVER] Address to listen on. Default: "127.0.0.1".'
+    )
+
+    parser.add_argument(
+        '--port', action='store', nargs=1, type=int, required=False, default=[8000],
+        help=f'[ONLY FOR SERVER] Port to listen on. Default: 8000.'
+    )
+
+    parser.add_argument(
+        '--unix_socket', action='store', nargs=1, type=str, required=False, default=[None],
+        help=f'[ONLY FOR SERVER] Listen on this Unix socket instead of host:port.'
+    )
+
+    parser.add_argument(
+        '--max_batch_size', action='store', nargs=1, type=int, required=False, default=[256],
+        help=f'[ONLY FOR SERVER] Num of samples at which a micro-batch is run without waiting for more requests. Default: 256.'
+    )
+
+    parser.add_argument(
+        '--max_latency_ms', action='store', nargs=1, type=float, required=False, default=[5.],
+        help=f'[ONLY FOR SERVER] Max time a request waits for others to be batched with. Default: 5.'
+    )
+
     
     args = parser.parse_args()
     return args
 
 
+def load_signet(args):
+    result_cache = ResultCache(path=args.result_cache[0]) if args.result_cache[0] is not None else None
+    if args.bundle[0] is not None:
+        signet = SigNet.from_bundle(args.bundle[0],
+                                    opportunities_name_or_path=args.normalization[0],
+                                    inference_engine=args.inference_engine[0],
+                                    precision=args.precision[0],
+                                    result_cache=result_cache)
+    else:
+        signet = SigNet(opportunities_name_or_path=args.normalization[0],
+                        inference_engine=args.inference_engine[0],
+                        precision=args.precision[0],
+                        result_cache=result_cache)
+    return signet
+
+
 def run_refitter(args):
+    if args.chunk_size[0] is not None:
+        return run_streaming_refitter(args)
+
     # Read data
     mutations = pd.read_csv(args.input_data[0], header=0, index_col=0)
 
     # Load & Run signet
-    signet = SigNet(opportunities_name_or_path=args.normalization[0])
-    results = signet(mutation_dataset=mutations)
+    with load_signet(args) as signet:
+        results = signet(mutation_dataset=mutations,
+                         nworkers=args.nworkers[0],
+                         pipeline_chunk_size=args.pipeline_chunk_size[0])
 
     # Store results
-    results.save(path=args.output_path[0])
+    results.save(path=args.output_path[0], format=args.output_format[0])
 
     # Plot figures
     if args.plot_figs:
-        results.plot_results(save=True)
+        results.plot_results(save=True, format=args.plot_format[0], n_workers=args.plot_workers[0])
+
+def run_streaming_refitter(args):
+    # Read, refit & store chunk by chunk
+    output_format = args.output_format[0]
+    with load_signet(args) as signet, contextlib.ExitStack() as stack:
+        if output_format != "csv":
+            writer = stack.enter_context(SigNetResultWriter(
+                os.path.join(args.output_path[0], "signet_results.%s"%output_format), format=output_format))
+        for i, results in enumerate(signet.stream(args.input_data[0],
+                                                  chunk_size=args.chunk_size[0],
+                                                  nworkers=args.nworkers[0],
+                                                  pipeline_chunk_size=args.pipeline_chunk_size[0])):
+            if output_format == "csv":
+                results.save(path=args.output_path[0], append=i > 0)
+            else:
+                writer.write(results)
+            if args.plot_figs:
+                results.plot_results(save=True, format=args.plot_format[0], n_workers=args.plot_workers[0])
+
+def run_server(args):
+    from signaturesnet.modules.signet_server import serve
+    with load_signet(args) as signet:
+        serve(signet,
+              host=args.host[0],
+              port=args.port[0],
+              unix_socket=args.unix_socket[0],
+              max_batch_size=args.max_batch_size[0],
+              max_latency_ms=args.max_latency_ms[0])
+
+
+def run_bundle(args):
+    # Pack the refitter models and signatures into a single file
+    filepath = os.path.join(args.output_path[0], "signet.bundle")
+    logging.info(f"Writing SigNet bundle into {filepath}")
+    save_signet_bundle(filepath)
 
 def run_generator(args):
     # Read model
@@ -94,8 +228,7 @@ def run_detector(args):
     mutation_dataset = pd.read_csv(args.input_data[0], header=0, index_col=0)
     
     logging.info("Preprocessing input data...")
-    mutation_order = pd.read_excel(os.path.join(DATA, "mutation_type_order.xlsx"))
-    mutation_dataset = mutation_dataset[list(mutation_order['Type'])]
+    mutation_dataset = mutation_dataset[load_catalog().mutation_types]
     sample_names = mutation_dataset.index  # NOTE(Oleguer): Should we be using this in the output to notify the order?
     mutation_vec = torch.tensor(mutation_dataset.values, dtype=torch.float, device=device)
 
@@ -120,7 +253,7 @@ if __name__ == "__main__":
     # Parse command-line arguments
     args = parse_args()
 
-    VALID_TASKS = ['refitter', 'generator', 'detector']
+    VALID_TASKS = ['refitter', 'generator', 'detector', 'bundle', 'server']
     assert args.task in VALID_TASKS, f"Task must be one of {VALID_TASKS}. You provided {args.task}"
     print(args.input_data)
 
@@ -133,4 +266,8 @@ if __name__ == "__main__":
     elif args.task == "detector":
         assert args.input_data[0] is not None, "You must provide an input data to run the refitter. --input_data=<your_path>"
         run_detector(args)
+    elif args.task == "bundle":
+        run_bundle(args)
+    elif args.task == "server":
+        run_server(args)
 
@@ -6,7 +6,6 @@ import pandas as pd
 
 from signaturesnet import DATA
 from signaturesnet.modules.signet_module import SigNet
-from signaturesnet.utilities.VCF_to_counts import VCF_to_counts, bed_to_counts
 
 logging.basicConfig(format='%(asctime)s %(levelname)-8s %(message)s',
                     level=logging.INFO,
@@ -34,6 +33,16 @@ def parse_args():
         help=f'Name or path to the reference genome. Needed when input_format is bed or vcf.'
     )
 
+    parser.add_argument(
+        '--window_size', action='store', nargs=1, type=int, required=False, default=[None],
+        help=f'Max num of reference bases read at a time when input_format is bed or vcf (bounds the memory). Default: whole chromosomes.'
+    )
+
+    parser.add_argument(
+        '--nworkers', action='store', nargs=1, type=int, required=False, default=[1],
+        help=f'Num of processes reading the VCF files of the input folder in parallel. Default: 1.'
+    )
+
     parser.add_argument(
         '--normalization', action='store', nargs=1, type=str, required=False, default=[None],
         help=f'The kind of normalization to be applied to the data. Should be either "None" (default), "exome", "genome", "genome_hg38" or a path to a file with the opportunities.'
@@ -70,9 +79,11 @@ if __name__ == "__main__":
     if args.input_format[0] == 'counts':
         mutations = pd.read_csv(args.input_data[0], header=0, index_col=0)
     elif args.input_format[0] == 'vcf':
-        mutations = VCF_to_counts(args.input_data[0],args.reference_genome[0])
+        from signaturesnet.utilities.VCF_to_counts import VCF_to_counts
+        mutations = VCF_to_counts(args.input_data[0],args.reference_genome[0],window_size=args.window_size[0],n_workers=args.nworkers[0])
     elif args.input_format[0] == 'bed':
-        mutations = bed_to_counts(args.input_data[0],args.reference_genome[0])
+        from signaturesnet.utilities.VCF_to_counts import bed_to_counts
+        mutations = bed_to_counts(args.input_data[0],args.reference_genome[0],window_size=args.window_size[0])
 
     # Load & Run signet
     signet = SigNet(opportunities_name_or_path=args.normalization[0])
@@ -28,6 +28,9 @@ setup(name='signaturesnet',
             'tensorboard',
             'wandb',
       ],
+      extras_require={
+            'parquet': ['pyarrow'],
+      },
       package_data={
             'signaturesnet': [
                   'data/data.xlsx',
@@ -1,40 +1,146 @@
 
 from concurrent.futures import ProcessPoolExecutor
-import copy
+from multiprocessing import shared_memory
 import sys
+import threading
+import weakref
 
+import numpy as np
 import pandas as pd
-import scipy
-from scipy.optimize import minimize
 from scipy.optimize import nnls
 import torch
-from tqdm import tqdm
 
 from signaturesnet import DATA
-from signaturesnet.utilities.metrics import get_jensen_shannon
 from signaturesnet.utilities.io import create_dir, read_signatures
+from signaturesnet.utilities.nnls import get_nnls_catalog
+
+# Signature matrix of the NNLS worker processes, attached to the pool's shared memory
+_worker_signatures = None
+_worker_shm = None
+
+
+def _init_nnls_worker(shm_name, shape, dtype):
+    global _worker_signatures, _worker_shm
+    _worker_shm = shared_memory.SharedMemory(name=shm_name)
+    _worker_signatures = np.ndarray(shape, dtype=dtype, buffer=_worker_shm.buf)
+
+
+def _nnls_rows(signatures, input_batch, maxiter):
+    return np.stack([nnls(signatures, row, maxiter=maxiter)[0] for row in input_batch])
+
+
+def _nnls_worker_chunk(input_batch, maxiter):
+    return _nnls_rows(_worker_signatures, input_batch, maxiter)
+
+
+def _release_pool(executor, shm):
+    executor.shutdown(wait=True)
+    shm.close()
+    shm.unlink()
 
 
 class Baseline:
 
-    def __init__(self, signatures):
+    ENGINES = ["scipy", "batched"]
+
+    def __init__(self, signatures, engine="scipy"):
+        """NNLS decomposition of mutation vectors into the given signatures
+
+        Args:
+            signatures (torch.Tensor(96, num_sigs)): Signature matrix
+            engine (str, optional): "scipy" solves one sample at a time with scipy.optimize.nnls
+                in a process pool, "batched" solves the whole batch with the vectorized
+                active-set solver of utilities.nnls (same solutions up to ~1e-6). Defaults to "scipy".
+                Warm-started solves (init) always use the batched solver, scipy cannot be warm-started.
+        """
+        assert engine in self.ENGINES, f"NNLS engine must be one of {self.ENGINES}. You provided {engine}"
         self.signatures = signatures.cpu().detach().numpy()
         self.__weight_len = self.signatures.shape[1]
-
-    def get_weights(self, normalized_mutations):
+        self.engine = engine
+        # Gram matrix of the catalog, computed once and shared by every Baseline using it
+        self.catalog = get_nnls_catalog(self.signatures)
+        # Process pools of the scipy engine (one per n_workers), created on first use and kept alive until close()
+        self._pools = {}
+        self._pools_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Shut down the NNLS worker pools and release their shared memory (if any)
+
+        Must not be called while other threads are running get_weights_batch.
+        """
+        with self._pools_lock:
+            pools, self._pools = self._pools, {}
+        for _, finalizer in pools.values():
+            finalizer()
+
+    def _get_executor(self, n_workers):
+        """Persistent pool whose workers read the signatures from shared memory
+
+        Pools are shared by all threads using this Baseline (ProcessPoolExecutor accepts concurrent
+        submissions), so concurrent calls with different n_workers each get their own pool
+        instead of shutting down a pool another thread is using.
+        """
+        with self._pools_lock:
+            if n_workers not in self._pools:
+                shm = shared_memory.SharedMemory(create=True, size=self.signatures.nbytes)
+                np.ndarray(self.signatures.shape, dtype=self.signatures.dtype, buffer=shm.buf)[:] = self.signatures
+                executor = ProcessPoolExecutor(max_workers=n_workers,
+                                               initializer=_init_nnls_worker,
+                                               initargs=(shm.name, self.signatures.shape, self.signatures.dtype))
+                self._pools[n_workers] = (executor, weakref.finalize(self, _release_pool, executor, shm))
+            return self._pools[n_workers][0]
+
+    def get_weights(self, normalized_mutations, init=None):
+        if init is not None:
+            h = self.catalog.solve(normalized_mutations, maxiter=5*self.__weight_len, init=init)[0]
+            return torch.from_numpy(h).float()
         h, rnorm = nnls(self.signatures, normalized_mutations,
                         maxiter=5*self.__weight_len)
         return torch.from_numpy(h).float()
 
-    def get_weights_batch(self, input_batch, n_workers=8):
-        result = []
-        input_as_list = input_batch.tolist()
-        with ProcessPoolExecutor(max_workers=n_workers) as executor:
-            for r in executor.map(self.get_weights, input_as_list):
-                result.append(copy.deepcopy(r))
-                del r
-        guessed_labels = torch.stack(result)
-        return guessed_labels
+    def get_weights_batch(self, input_batch, n_workers=8, init=None, chunk_size=None):
+        """NNLS weights of a batch of normalized mutation vectors
+
+        The scipy engine solves in-process when n_workers <= 1. Otherwise the batch is split in
+        chunks which are sent to a pool of n_workers processes. The pool is kept alive between
+        calls (release it with close() or by using the Baseline as a context manager).
+
+        Args:
+            input_batch (torch.Tensor(batch_size, 96)): Normalized mutation vectors
+            n_workers (int, optional): Num of processes of the scipy engine. Defaults to 8.
+            init (torch.Tensor(batch_size, num_sigs) or torch.Tensor(num_sigs), optional): Warm start.
+                Previous weights of the same samples or a cohort-level prior, its non-zero
+                signatures are used as initial active set. Defaults to None.
+            chunk_size (int, optional): Num of samples per pool task. Defaults to splitting the
+                batch into 4 chunks per worker.
+        """
+        if self.engine == "batched" or init is not None:
+            if isinstance(init, torch.Tensor):
+                init = init.cpu().detach().numpy()
+            weights = self.catalog.solve(input_batch.cpu().detach().numpy(),
+                                         maxiter=5*self.__weight_len,
+                                         init=init)
+            return torch.from_numpy(weights).float()
+
+        input_batch = input_batch.cpu().detach().numpy()
+        maxiter = 5*self.__weight_len
+        if len(input_batch) == 0:
+            return torch.zeros((0, self.__weight_len))
+        if n_workers <= 1:
+            return torch.from_numpy(_nnls_rows(self.signatures, input_batch, maxiter)).float()
+
+        if chunk_size is None:
+            chunk_size = -(-len(input_batch)//(4*n_workers))
+        chunks = [input_batch[i:i + chunk_size] for i in range(0, len(input_batch), chunk_size)]
+        executor = self._get_executor(n_workers)
+        result = list(executor.map(_nnls_worker_chunk, chunks, [maxiter]*len(chunks)))
+        return torch.from_numpy(np.concatenate(result)).float()
 
 
 def create_baseline_dataset(input_file, output_file, signatures_path, which_baseline="nnls"):
@@ -46,7 +46,7 @@ class Classifier(nn.Module):
         mutation_dist = self.activation(self.layer2_1(mutation_dist))
 
         # Number of mutations head
-        num_mut = nn.Sigmoid()(
+        num_mut = torch.sigmoid(
             (num_mut-self.sigmoid_params[0])/self.sigmoid_params[1])
         num_mut = self.activation(self.layer1_2(num_mut))
         num_mut = self.activation(self.layer2_2(num_mut))
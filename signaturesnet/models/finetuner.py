@@ -22,12 +22,12 @@ class FineTuner(nn.Module):
     def forward(self, *args, **kwargs):
         raise NotImplementedError
 
-    def _apply_cutoff(self, comb, cutoff):
+    def _apply_cutoff(self, comb, cutoff: float):
         mask = (comb > cutoff).type(torch.int).float()
         comb = comb*mask
         comb = torch.cat((comb, torch.ones_like(torch.sum(
-        comb, axis=1).reshape((-1, 1)))-torch.sum(
-        comb, axis=1).reshape((-1, 1))), axis=1)
+        comb, dim=1).reshape((-1, 1)))-torch.sum(
+        comb, dim=1).reshape((-1, 1))), dim=1)
         return comb
 
 class FineTunerLowNumMut(FineTuner):
@@ -77,15 +77,15 @@ class FineTunerLowNumMut(FineTuner):
     def forward(self,
                 mutation_dist,
                 num_mut,
-                cutoff):
+                cutoff: float):
         # Input head
         mutation_dist = self.activation(self.layer_mutvec_1(mutation_dist))
         mutation_dist = self.activation(self.layer_mutvec_2(mutation_dist))
 
         # Number of mutations head
-        num_mut_low = nn.Sigmoid()((num_mut - self.sigmoid_params[0][0]) / self.sigmoid_params[0][1])
-        num_mut_mid = nn.Sigmoid()((num_mut - self.sigmoid_params[1][0]) / self.sigmoid_params[1][1])
-        num_mut_large = nn.Sigmoid()((num_mut - self.sigmoid_params[2][0]) / self.sigmoid_params[2][1])
+        num_mut_low = torch.sigmoid((num_mut - self.sigmoid_params[0][0]) / self.sigmoid_params[0][1])
+        num_mut_mid = torch.sigmoid((num_mut - self.sigmoid_params[1][0]) / self.sigmoid_params[1][1])
+        num_mut_large = torch.sigmoid((num_mut - self.sigmoid_params[2][0]) / self.sigmoid_params[2][1])
         num_mut_low = self.activation(self.layer_numut_low(num_mut_low))
         num_mut_mid = self.activation(self.layer_numut_mid(num_mut_mid))
         num_mut_large = self.activation(self.layer_numut_large(num_mut_large))
@@ -162,7 +162,7 @@ class FineTunerLargeNumMut(FineTuner):
                 mutation_dist,
                 baseline_guess,
                 num_mut,
-                cutoff):
+                cutoff: float):
         # Input head
         mutation_dist = self.activation(self.layer1_2(mutation_dist))
         # mutation_dist = self.activation(self.layer2_2(mutation_dist))
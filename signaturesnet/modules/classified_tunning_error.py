@@ -1,6 +1,8 @@
 import logging
-import numpy as np
-import torch 
+import torch
+
+from signaturesnet.modules.routing import classification_masks, route_indices, scatter_rows
+from signaturesnet.utilities.instrumentation import stage
 
 class ClassifiedFinetunerErrorfinder:
 
@@ -9,6 +11,7 @@ class ClassifiedFinetunerErrorfinder:
                  finetuner,
                  errorfinder,
                  classification_cutoff=0.5,
+                 max_num_mut=5e5,
                  device="cpu"):
         """Instantiate a ClassifiedFinetuner
 
@@ -17,37 +20,45 @@ class ClassifiedFinetunerErrorfinder:
             realistic_finetuner (Finetuner or CombinedFinetuner): Model which improves baseline guess for random data
             random_finetuner (Finetuner or CombinedFinetuner): Model which improves baseline guess for random data
             classification_cutoff (float, optional): Cuttoff at which we decide something is realistic. Defaults to 0.5.
+            max_num_mut (float, optional): Samples with more mutations only get the NNLS guess. Defaults to 5e5.
             device (str, optional): Device to use (cuda or cpu). Defaults to "cpu".
         """
 
         self.classification_cutoff = classification_cutoff
+        self.max_num_mut = max_num_mut
         self.device = device
 
         self.classifier = classifier
         self.finetuner = finetuner
         self.errorfinder = errorfinder
 
-    def __separate_classification(self, classification, mutation_dist, baseline_guess, num_mut):
-        ind = torch.tensor(range(classification.size()[0]))
-        ind_order = torch.tensor(np.concatenate((ind[torch.flatten((classification <= self.classification_cutoff) | (torch.transpose(num_mut > 5e5,0,1)))], ind[torch.flatten((classification > self.classification_cutoff) & (torch.transpose(num_mut < 5e5,0,1)))]))).reshape(-1, 1).to(torch.float).to(self.device)
-        
-        input_batch_random = mutation_dist[torch.flatten((classification <= self.classification_cutoff) | (torch.transpose(num_mut > 5e5,0,1))), ]  # Random + samples with large num mut (we will only do NNLS for them)
-        input_batch_realistic = mutation_dist[torch.flatten((classification > self.classification_cutoff) & (torch.transpose(num_mut < 5e5,0,1))), ]
-        num_mut_realistic = num_mut[torch.flatten((classification > self.classification_cutoff) & (torch.transpose(num_mut < 5e5,0,1))), ]
-        classification_realistic = classification[torch.flatten((classification > self.classification_cutoff) & (torch.transpose(num_mut < 5e5,0,1))), ]
-
-        baseline_guess_random = baseline_guess[torch.flatten((classification <= self.classification_cutoff) | (torch.transpose(num_mut > 5e5,0,1))), ]
-        baseline_guess_realistic = baseline_guess[torch.flatten((classification > self.classification_cutoff) & (torch.transpose(num_mut < 5e5,0,1))), ]
+    def classify(self, mutation_dist, num_mut):
+        """Classifier output (torch.Tensor(batch_size)) of a batch
+        """
+        return self.classifier(mutation_dist=mutation_dist,
+                               num_mut=num_mut).view(-1)
 
-        baseline_guess_random = baseline_guess_random/torch.sum(baseline_guess_random, dim=1).reshape(-1,1)
-        
-        return input_batch_realistic, input_batch_random, baseline_guess_random, baseline_guess_realistic, num_mut_realistic, classification_realistic, ind_order
+    def needs_baseline(self, classification, num_mut):
+        """Mask of the samples whose output depends on the NNLS guess: the ones which are not sent to
+        the finetuner (random or too many mutations) and the ones the finetuner needs it for.
+        """
+        realistic, random = classification_masks(classification, num_mut, self.classification_cutoff, self.max_num_mut)
+        if hasattr(self.finetuner, "needs_baseline"):
+            realistic = realistic & self.finetuner.needs_baseline(num_mut)
+        return random | realistic
+
+    def __lazy_baseline_guess(self, get_baseline_guess, classification, num_mut):
+        """Compute the NNLS guess only for the samples which use it (see needs_baseline).
+        The rest of rows are left at 0.
+        """
+        rows = self.needs_baseline(classification, num_mut)
 
-    def __join_and_sort(self, realistic, random, ind_order):
-        joined = torch.cat((random, realistic), dim=0)
-        joined = torch.cat((joined, ind_order), dim=1)
-        joined = joined[joined[:, -1].sort()[1]]
-        return joined[:, :-1]
+        baseline_guess_rows = get_baseline_guess(rows)
+        baseline_guess = torch.zeros((classification.size()[0], baseline_guess_rows.size()[1]),
+                                     dtype=baseline_guess_rows.dtype)
+        baseline_guess[rows] = baseline_guess_rows
+        logging.info("NNLS computed for %i/%i samples"%(baseline_guess_rows.size()[0], classification.size()[0]))
+        return baseline_guess
 
     def _apply_cutoff(self, comb, cutoff):
         mask = (comb > cutoff).type(torch.int).float()
@@ -61,36 +72,69 @@ class ClassifiedFinetunerErrorfinder:
                  mutation_dist,
                  baseline_guess,
                  num_mut,
-                 cutoff):
+                 cutoff,
+                 instrumentation=None,
+                 classification=None):
+        """Classify, finetune and estimate the errors of a batch
 
-        logging.info("Detecting out-of-train-distribution points...")
-        classification = self.classifier(mutation_dist=mutation_dist,
-                                         num_mut=num_mut).view(-1)
-        logging.info("Detecting out-of-train-distribution points... DONE")
-        
-        mutation_dist_realistic, mutation_dist_random, baseline_guess_random, baseline_guess_realistic, num_mut_realistic, classification_realistic, ind_order = self.__separate_classification(classification, mutation_dist, baseline_guess, num_mut)
+        Args:
+            mutation_dist (torch.Tensor(batch_size, 96)): Normalized mutation vectors
+            baseline_guess (torch.Tensor(batch_size, 72) or callable): NNLS guess. It can also be a function
+                mapping a boolean mask of rows to their NNLS guess, which is then only evaluated for the
+                samples that use it (classification and routing are computed first).
+            num_mut (torch.Tensor(batch_size, 1)): Number of mutations of each sample
+            cutoff (float): Weights below it are sent to 0 (and added to the unknown)
+            instrumentation (Instrumentation, optional): Where to record the time, memory and samples of
+                each stage and route
+            classification (torch.Tensor(batch_size), optional): Output of classify, if already computed
+        """
+        batch_size = mutation_dist.size()[0]
 
-        logging.info("Finetuning NNLS guesses...")
-        finetuner_guess_realistic = self.finetuner(mutation_dist=mutation_dist_realistic,
-                                         baseline_guess = baseline_guess_realistic,
-                                         num_mut=num_mut_realistic,
-                                         cutoff_0=cutoff)
+        if classification is None:
+            logging.info("Detecting out-of-train-distribution points...")
+            with stage(instrumentation, "classification", batch_size):
+                classification = self.classify(mutation_dist, num_mut)
+            logging.info("Detecting out-of-train-distribution points... DONE")
+
+        if callable(baseline_guess):
+            baseline_guess = self.__lazy_baseline_guess(baseline_guess, classification, num_mut)
 
-        baseline_guess_random = self._apply_cutoff(baseline_guess_random, cutoff)
+        realistic, random = classification_masks(classification, num_mut, self.classification_cutoff, self.max_num_mut)
+        ind_realistic, ind_random = route_indices([realistic, random])
+        if instrumentation is not None:
+            instrumentation.count("realistic", ind_realistic.size(0))
+            instrumentation.count("random", ind_random.size(0))
 
-        finetuner_guess = self.__join_and_sort(finetuner_guess_realistic, baseline_guess_random, ind_order)
+        logging.info("Finetuning NNLS guesses...")
+        num_mut_realistic = num_mut[ind_realistic]
+        finetuner_guess_realistic = self.finetuner(mutation_dist=mutation_dist[ind_realistic],
+                                                   baseline_guess=baseline_guess[ind_realistic],
+                                                   num_mut=num_mut_realistic,
+                                                   cutoff_0=cutoff,
+                                                   instrumentation=instrumentation)
+
+        with stage(instrumentation, "random_guess", ind_random.size(0)):
+            baseline_guess_random = baseline_guess[ind_random]
+            baseline_guess_random = baseline_guess_random/torch.sum(baseline_guess_random, dim=1).reshape(-1,1)
+            baseline_guess_random = self._apply_cutoff(baseline_guess_random, cutoff)
         logging.info("Finetuning NNLS guesses... DONE")
 
         logging.info("Estimating errorbars...")
-        upper, lower = self.errorfinder(weights=finetuner_guess_realistic[:,:-1],
-                                                num_mutations=num_mut_realistic,
-                                                classification=classification_realistic.reshape(-1, 1))
-        upper = self.__join_and_sort(upper, torch.full_like(baseline_guess_random[:,:-1], float('nan')), ind_order)
-        lower = self.__join_and_sort(lower, torch.full_like(baseline_guess_random[:,:-1], float('nan')), ind_order)
+        with stage(instrumentation, "errorfinder", ind_realistic.size(0)):
+            upper, lower = self.errorfinder(weights=finetuner_guess_realistic[:,:-1],
+                                            num_mutations=num_mut_realistic,
+                                            classification=classification[ind_realistic].reshape(-1, 1))
         logging.info("Estimating errorbars... DONE")
 
+        with stage(instrumentation, "reassembly", batch_size):
+            finetuner_guess = scatter_rows(batch_size=batch_size,
+                                           indices=[ind_realistic, ind_random],
+                                           outputs=[finetuner_guess_realistic, baseline_guess_random])
+            upper = scatter_rows(batch_size=batch_size, indices=[ind_realistic], outputs=[upper])
+            lower = scatter_rows(batch_size=batch_size, indices=[ind_realistic], outputs=[lower])
+
         result = {"finetuner_guess": finetuner_guess,
                   "error_upper": upper,
                   "error_lower": lower,
                   "classification": classification}
-        return result
\ No newline at end of file
+        return result
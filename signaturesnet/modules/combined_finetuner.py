@@ -1,10 +1,11 @@
 import os
 import sys
 
-import numpy as np
 import pandas as pd
 import torch
 
+from signaturesnet.modules.routing import route_indices, scatter_rows
+from signaturesnet.utilities.instrumentation import stage
 from signaturesnet.utilities.io import read_model
 
 class CombinedFinetuner:
@@ -13,49 +14,55 @@ class CombinedFinetuner:
                  large_mum_mut_dir,
                  cuttoff = 1e3,
                  device="cpu"):
+        """Finetuner which sends samples with <= cuttoff mutations to the low num mut model and the rest to the large one
 
+        Args:
+            low_mum_mut_dir (str or FineTunerLowNumMut): Folder of the trained low num mut finetuner (or the model itself)
+            large_mum_mut_dir (str or FineTunerLargeNumMut): Folder of the trained large num mut finetuner (or the model itself)
+        """
         # Instantiate finetuner 1 and read params
-        self.finetuner_low = read_model(low_mum_mut_dir, device=device)
-        self.finetuner_large = read_model(large_mum_mut_dir, device=device)
+        self.finetuner_low = low_mum_mut_dir if isinstance(low_mum_mut_dir, torch.nn.Module)\
+            else read_model(low_mum_mut_dir, device=device)
+        self.finetuner_large = large_mum_mut_dir if isinstance(large_mum_mut_dir, torch.nn.Module)\
+            else read_model(large_mum_mut_dir, device=device)
         self.cutoff = cuttoff
         self.device = device
 
-    def __join_and_sort(self, low, large, ind_order):
-        joined = torch.cat((low, large), dim=0)
-        joined = torch.cat((joined, ind_order), dim=1)
-        joined = joined[joined[:, -1].sort()[1]]
-        return joined[:, :-1]
-    
+    def needs_baseline(self, num_mut):
+        """Mask of the samples whose guess depends on the NNLS baseline (only the large num mut finetuner uses it)
+        """
+        return num_mut.view(-1) > self.cutoff
+
     def __call__(self,
                  mutation_dist,
                  baseline_guess,
                  num_mut,
-                 cutoff_0):
+                 cutoff_0,
+                 instrumentation=None):
         """Get weights of each signature in lexicographic wrt 1-mer
+
+        Args:
+            instrumentation (Instrumentation, optional): Where to record the time and samples of each finetuner
         """
-        num_mut = num_mut.view(-1)
-        ind = torch.tensor(range(mutation_dist.size()[0]))
-        ind_order = torch.tensor(np.concatenate((ind[num_mut <= self.cutoff], ind[num_mut > self.cutoff]))).reshape(-1, 1).to(torch.float).to(self.device)
-        
-        input_batch_low = mutation_dist[num_mut <= self.cutoff, ]
-        input_batch_large = mutation_dist[num_mut > self.cutoff, ]
+        num_mut = num_mut.view(-1, 1)
+        ind_low, ind_large = route_indices([num_mut <= self.cutoff, num_mut > self.cutoff])
+        if instrumentation is not None:
+            instrumentation.count("finetuner_low", ind_low.size(0))
+            instrumentation.count("finetuner_large", ind_large.size(0))
 
-        baseline_guess_low = baseline_guess[num_mut <= self.cutoff, ]
-        baseline_guess_large = baseline_guess[num_mut > self.cutoff, ]
-        
-        num_mut_low = num_mut[num_mut <= self.cutoff, ].reshape(-1, 1)
-        num_mut_large = num_mut[num_mut > self.cutoff, ].reshape(-1, 1)
-        
         with torch.no_grad():
-            guess_low = self.finetuner_low(
-                input_batch_low, num_mut_low, cutoff_0)
+            with stage(instrumentation, "finetuner_low", ind_low.size(0)):
+                guess_low = self.finetuner_low(
+                    mutation_dist[ind_low], num_mut[ind_low], cutoff_0)
+
+            with stage(instrumentation, "finetuner_large", ind_large.size(0)):
+                guess_large = self.finetuner_large(
+                    mutation_dist[ind_large], baseline_guess[ind_large], num_mut[ind_large], cutoff_0)
 
-            guess_large = self.finetuner_large(
-                input_batch_large, baseline_guess_large, num_mut_large, cutoff_0)
-            
-            finetuner_guess = self.__join_and_sort(low=guess_low,
-                                                   large=guess_large,
-                                                   ind_order=ind_order)
+            with stage(instrumentation, "reassembly"):
+                finetuner_guess = scatter_rows(batch_size=mutation_dist.size()[0],
+                                               indices=[ind_low, ind_large],
+                                               outputs=[guess_low, guess_large])
         return finetuner_guess
 
 
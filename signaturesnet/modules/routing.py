@@ -0,0 +1,58 @@
+from typing import List, Tuple
+
+import torch
+
+
+def route_indices(masks: List[torch.Tensor]) -> List[torch.Tensor]:
+    """Split a batch into groups (e.g. one per expert model) given one boolean mask per group
+
+    Args:
+        masks (list of torch.Tensor(batch_size)): Boolean mask of the samples of each group
+
+    Returns:
+        list of torch.Tensor: int64 indices of the samples of each group, in increasing order
+    """
+    return [torch.nonzero(mask.view(-1)).view(-1) for mask in masks]
+
+
+def scatter_rows(batch_size: int,
+                 indices: List[torch.Tensor],
+                 outputs: List[torch.Tensor],
+                 fill_value: float = float('nan')) -> torch.Tensor:
+    """Write the outputs of each group back into the rows the group was routed from
+
+    Args:
+        batch_size (int): Number of samples of the whole batch
+        indices (list of torch.Tensor): Indices of each group (see route_indices)
+        outputs (list of torch.Tensor(group_size, num_cols)): Output of each group, same order as indices
+        fill_value (float, optional): Value of the rows not covered by any group. Defaults to nan.
+
+    Returns:
+        torch.Tensor(batch_size, num_cols)
+    """
+    result = torch.full((batch_size, outputs[0].size(1)), fill_value,
+                        dtype=outputs[0].dtype, device=outputs[0].device)
+    for ind, output in zip(indices, outputs):
+        result[ind] = output
+    return result
+
+
+def classification_masks(classification: torch.Tensor,
+                         num_mut: torch.Tensor,
+                         classification_cutoff: float,
+                         max_num_mut: float) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Masks of the samples sent to the finetuner (realistic) and of the ones which only get the NNLS guess
+    (random, or too many mutations)
+
+    Args:
+        classification (torch.Tensor(batch_size)): Classifier output
+        num_mut (torch.Tensor(batch_size, 1)): Number of mutations of each sample
+
+    Returns:
+        realistic, random (torch.Tensor(batch_size) of bool)
+    """
+    num_mut = num_mut.view(-1)
+    classification = classification.view(-1)
+    realistic = (classification > classification_cutoff) & (num_mut < max_num_mut)
+    random = (classification <= classification_cutoff) | (num_mut > max_num_mut)
+    return realistic, random
@@ -0,0 +1,195 @@
+import warnings
+from typing import Tuple
+
+import torch
+import torch.nn as nn
+
+from signaturesnet.modules.routing import classification_masks, route_indices, scatter_rows
+from signaturesnet.utilities.instrumentation import stage
+
+
+class SigNetGraph(nn.Module):
+
+    def __init__(self,
+                 classifier,
+                 finetuner_low,
+                 finetuner_large,
+                 errorfinder,
+                 classification_cutoff=0.5,
+                 num_mut_cutoff=1e3,
+                 max_num_mut=5e5):
+        """Whole SigNet Refitter inference (classifier -> routing -> finetuners -> errorfinder -> reassembly)
+        as a single module that can be compiled with TorchScript (see script_signet_graph).
+        Equivalent to ClassifiedFinetunerErrorfinder with a CombinedFinetuner.
+
+        Args:
+            classifier (Classifier): Model to discriminate between realistic and random data
+            finetuner_low (FineTunerLowNumMut): Finetuner of realistic samples with <= num_mut_cutoff mutations
+            finetuner_large (FineTunerLargeNumMut): Finetuner of realistic samples with > num_mut_cutoff mutations
+            errorfinder (ErrorFinder): Model estimating the error intervals of the finetuned guesses
+            classification_cutoff (float, optional): Cuttoff at which we decide something is realistic. Defaults to 0.5.
+            num_mut_cutoff (float, optional): Num of mutations separating both finetuners. Defaults to 1e3.
+            max_num_mut (float, optional): Samples with more mutations only get the NNLS guess. Defaults to 5e5.
+        """
+        super(SigNetGraph, self).__init__()
+        self.classifier = classifier
+        self.finetuner_low = finetuner_low
+        self.finetuner_large = finetuner_large
+        self.errorfinder = errorfinder
+        self.classification_cutoff = float(classification_cutoff)
+        self.num_mut_cutoff = float(num_mut_cutoff)
+        self.max_num_mut = float(max_num_mut)
+
+    @torch.jit.export
+    def classify(self, mutation_dist: torch.Tensor, num_mut: torch.Tensor) -> torch.Tensor:
+        return self.classifier(mutation_dist, num_mut).view(-1)
+
+    @torch.jit.export
+    def needs_baseline(self, classification: torch.Tensor, num_mut: torch.Tensor) -> torch.Tensor:
+        """Mask of the samples whose output depends on the NNLS guess
+        """
+        realistic, random = classification_masks(classification, num_mut, self.classification_cutoff, self.max_num_mut)
+        return random | (realistic & (num_mut.view(-1) > self.num_mut_cutoff))
+
+    def _apply_cutoff(self, comb: torch.Tensor, cutoff: float) -> torch.Tensor:
+        comb = comb*(comb > cutoff).float()
+        return torch.cat((comb, 1 - torch.sum(comb, dim=1, keepdim=True)), dim=1)
+
+    def forward(self,
+                mutation_dist: torch.Tensor,
+                baseline_guess: torch.Tensor,
+                num_mut: torch.Tensor,
+                classification: torch.Tensor,
+                cutoff: float) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """Finetune the guesses and estimate their errors
+
+        Args:
+            mutation_dist (torch.Tensor(batch_size, 96)): Normalized mutation vectors
+            baseline_guess (torch.Tensor(batch_size, 72)): NNLS guess (only read where needs_baseline)
+            num_mut (torch.Tensor(batch_size, 1)): Number of mutations of each sample
+            classification (torch.Tensor(batch_size)): Output of classify
+            cutoff (float): Weights below it are sent to 0 (and added to the unknown)
+
+        Returns:
+            weights (torch.Tensor(batch_size, 73)), upper, lower (torch.Tensor(batch_size, 72))
+        """
+        realistic, random = classification_masks(classification, num_mut, self.classification_cutoff, self.max_num_mut)
+        low = num_mut.view(-1) <= self.num_mut_cutoff
+        indices = route_indices([realistic & low, realistic & ~low, random])
+        ind_low, ind_large, ind_random = indices[0], indices[1], indices[2]
+        ind_realistic = route_indices([realistic])[0]
+        batch_size = mutation_dist.size(0)
+
+        # Realistic: finetuners
+        guess_low = self.finetuner_low(mutation_dist[ind_low], num_mut[ind_low], cutoff)
+        guess_large = self.finetuner_large(mutation_dist[ind_large], baseline_guess[ind_large],
+                                           num_mut[ind_large], cutoff)
+
+        # Random (or too many mutations): normalized NNLS guess
+        guess_random = baseline_guess[ind_random]
+        guess_random = guess_random/torch.sum(guess_random, dim=1).reshape(-1, 1)
+        guess_random = self._apply_cutoff(guess_random, cutoff)
+
+        weights = scatter_rows(batch_size, [ind_low, ind_large, ind_random], [guess_low, guess_large, guess_random])
+
+        # Realistic: error intervals
+        upper, lower = self.errorfinder(weights[ind_realistic][:, :-1],
+                                        num_mut[ind_realistic],
+                                        classification[ind_realistic].reshape(-1, 1))
+        upper = scatter_rows(batch_size, [ind_realistic], [upper])
+        lower = scatter_rows(batch_size, [ind_realistic], [lower])
+        return weights, upper, lower
+
+
+def script_signet_graph(classifier, finetuner_low, finetuner_large, errorfinder, path=None, **kwargs):
+    """Compile the SigNetGraph of the given (trained, eval mode) models with TorchScript
+
+    Args:
+        path (str, optional): If given, the scripted module is also saved there (load it with torch.jit.load).
+        kwargs: Other SigNetGraph arguments.
+
+    Returns:
+        torch.jit.ScriptModule
+    """
+    graph = SigNetGraph(classifier=classifier,
+                        finetuner_low=finetuner_low,
+                        finetuner_large=finetuner_large,
+                        errorfinder=errorfinder,
+                        **kwargs).eval()
+    with warnings.catch_warnings():
+        # TorchScript is deprecated in recent torch versions but it is still the only way of
+        # compiling the data-dependent routing into a single serializable module
+        warnings.simplefilter("ignore", category=FutureWarning)
+        scripted = torch.jit.script(graph)
+    if path is not None:
+        save_signet_graph(scripted, path)
+    return scripted
+
+
+def save_signet_graph(scripted, path):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=FutureWarning)
+        torch.jit.save(scripted, path)
+
+
+def load_signet_graph(path, device="cpu"):
+    """Load a graph saved with script_signet_graph (or SigNet.export_graph)
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=FutureWarning)
+        return torch.jit.load(path, map_location=device).eval()
+
+
+class ScriptedFinetunerErrorfinder:
+
+    def __init__(self, graph):
+        """Runs a (scripted) SigNetGraph with the interface of ClassifiedFinetunerErrorfinder
+
+        Args:
+            graph (SigNetGraph or torch.jit.ScriptModule): Output of script_signet_graph or torch.jit.load
+        """
+        self.graph = graph
+
+    def classify(self, mutation_dist, num_mut):
+        return self.graph.classify(mutation_dist, num_mut)
+
+    def needs_baseline(self, classification, num_mut):
+        return self.graph.needs_baseline(classification, num_mut)
+
+    def __call__(self,
+                 mutation_dist,
+                 baseline_guess,
+                 num_mut,
+                 cutoff,
+                 instrumentation=None,
+                 classification=None):
+        batch_size = mutation_dist.size(0)
+        if classification is None:
+            with stage(instrumentation, "classification", batch_size):
+                classification = self.classify(mutation_dist, num_mut)
+        if callable(baseline_guess):
+            rows = self.needs_baseline(classification, num_mut)
+            baseline_guess_rows = baseline_guess(rows)
+            baseline_guess = torch.zeros((classification.size()[0], baseline_guess_rows.size()[1]),
+                                         dtype=baseline_guess_rows.dtype)
+            baseline_guess[rows] = baseline_guess_rows
+        if instrumentation is not None:
+            self._count_routes(instrumentation, classification, num_mut)
+
+        # Finetuners, errorfinder and reassembly run fused in the graph
+        with stage(instrumentation, "graph", batch_size):
+            weights, upper, lower = self.graph(mutation_dist, baseline_guess, num_mut, classification, float(cutoff))
+        result = {"finetuner_guess": weights,
+                  "error_upper": upper,
+                  "error_lower": lower,
+                  "classification": classification}
+        return result
+
+    def _count_routes(self, instrumentation, classification, num_mut):
+        realistic, random = classification_masks(classification, num_mut,
+                                                 self.graph.classification_cutoff, self.graph.max_num_mut)
+        low = num_mut.view(-1) <= self.graph.num_mut_cutoff
+        instrumentation.count("realistic", int(realistic.sum()))
+        instrumentation.count("random", int(random.sum()))
+        instrumentation.count("finetuner_low", int((realistic & low).sum()))
+        instrumentation.count("finetuner_large", int((realistic & ~low).sum()))
@@ -1,6 +1,10 @@
+import contextlib
 import os
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import pathlib
+import threading
+import time
 
 import pandas as pd
 import numpy as np
@@ -8,12 +12,54 @@ import torch
 
 from signaturesnet import DATA, TRAINED_MODELS
 from signaturesnet.utilities.normalize_data import normalize_data
-from signaturesnet.utilities.io import read_model, read_signatures
+from signaturesnet.utilities.catalog import load_catalog
+from signaturesnet.utilities.io import SIGNET_RESULT_FORMATS, SigNetResultWriter, read_model, read_signet_bundle, write_result_csvs
 from signaturesnet.models import Baseline
 from signaturesnet.modules import CombinedFinetuner, ClassifiedFinetunerErrorfinder
-from signaturesnet.utilities.plotting import plot_weights
+from signaturesnet.modules.signet_graph import ScriptedFinetunerErrorfinder, save_signet_graph, script_signet_graph
+from signaturesnet.utilities.instrumentation import Instrumentation, stage
+from signaturesnet.utilities.quantization import PRECISIONS, quantize_model
+from signaturesnet.utilities.result_cache import model_version
+
+_torch_threads_lock = threading.Lock()
+_torch_threads_calls = 0
+_torch_threads_default = None
+
+
+@contextlib.contextmanager
+def _torch_num_threads(num_threads):
+    """Use num_threads torch intra-op threads while the block runs (None: leave them as they are)
+
+    The torch thread count is process-wide: while several calls overlap, the last requested value is used,
+    and the original one is restored when all of them have finished.
+    """
+    global _torch_threads_calls, _torch_threads_default
+    if num_threads is None:
+        yield
+        return
+    with _torch_threads_lock:
+        if _torch_threads_calls == 0:
+            _torch_threads_default = torch.get_num_threads()
+        _torch_threads_calls += 1
+        torch.set_num_threads(num_threads)
+    try:
+        yield
+    finally:
+        with _torch_threads_lock:
+            _torch_threads_calls -= 1
+            if _torch_threads_calls == 0:
+                torch.set_num_threads(_torch_threads_default)
+
 
 class SigNet:
+    """SigNet Refitter: NNLS + detector + finetuners + errorfinder
+
+    Threading: once loaded, a SigNet can be shared by many threads. __call__ keeps all intermediate state
+    local to the call and the networks are only read (eval mode, no_grad), so concurrent calls give the
+    same results as running them one after another. Use num_threads to avoid oversubscribing the cores
+    with torch intra-op threads (e.g. num_threads=1 with as many caller threads as cores).
+    Loading, close() and modifying the attributes are not thread-safe: do them before/after sharing the instance.
+    """
 
     def __init__(self,
                  classifier=os.path.join(TRAINED_MODELS, "detector"),
@@ -22,87 +68,422 @@ class SigNet:
                  errorfinder=os.path.join(TRAINED_MODELS, "errorfinder"),
                  opportunities_name_or_path=None,
                  signatures_path=os.path.join(DATA, "data.xlsx"),
-                 mutation_type_order=os.path.join(DATA, "mutation_type_order.xlsx")):
+                 mutation_type_order=os.path.join(DATA, "mutation_type_order.xlsx"),
+                 nnls_engine="scipy",
+                 inference_engine="eager",
+                 precision="fp32",
+                 result_cache=None):
+        """Load the SigNet Refitter models
 
-        signatures = read_signatures(file=signatures_path,
-                                     mutation_type_order=mutation_type_order)
-        self.signatures = signatures # TODO(oleguer): Remove, this is only for debugging
-        self.baseline = Baseline(signatures)
-        finetuner = CombinedFinetuner(low_mum_mut_dir=finetuner_realistic_low,
-                                      large_mum_mut_dir=finetuner_realistic_large)
+        Args:
+            nnls_engine (str): NNLS solver, "scipy" or "batched" (see Baseline). Default: "scipy"
+            inference_engine (str): "eager" runs the networks module by module, "torchscript" compiles the
+                whole classifier -> finetuners -> errorfinder inference into a single graph at load time
+                (see modules.signet_graph). Default: "eager"
+            precision (str): "fp32" or "int8". "int8" quantizes the Linear layers of all networks at load
+                time (dynamic quantization, CPU only, see utilities.quantization). Default: "fp32"
+            result_cache (ResultCache, optional): Cache of per-sample outputs (see utilities.result_cache). Samples
+                found in it skip NNLS and all networks. Entries are keyed by their normalized mutation vector,
+                num of mutations, normalization, cutoff and model_version. Default: None (no cache)
+        """
 
-        classifier = read_model(classifier)
-        errorfinder = read_model(errorfinder)
+        catalog = load_catalog(file=signatures_path,
+                               mutation_type_order=mutation_type_order)
+        self._setup(classifier=read_model(classifier),
+                    finetuner_low=read_model(finetuner_realistic_low),
+                    finetuner_large=read_model(finetuner_realistic_large),
+                    errorfinder=read_model(errorfinder),
+                    catalog=catalog,
+                    opportunities_name_or_path=opportunities_name_or_path,
+                    nnls_engine=nnls_engine,
+                    inference_engine=inference_engine,
+                    precision=precision,
+                    result_cache=result_cache)
+
+    @classmethod
+    def from_bundle(cls,
+                    path,
+                    opportunities_name_or_path=None,
+                    nnls_engine="scipy",
+                    inference_engine="eager",
+                    precision="fp32",
+                    mmap=True,
+                    result_cache=None):
+        """Load SigNet from a single bundle file (see utilities.io.save_signet_bundle)
+
+        Args:
+            path (str): Bundle file
+            mmap (bool): Map the weights from the file instead of reading them, so that all SigNet
+                processes of a node share the same physical pages (not with precision="int8", which
+                repacks the weights). Default: True
+        """
+        models, catalog = read_signet_bundle(path, mmap=mmap)
+        signet = cls.__new__(cls)
+        signet._setup(classifier=models["detector"],
+                      finetuner_low=models["finetuner_low"],
+                      finetuner_large=models["finetuner_large"],
+                      errorfinder=models["errorfinder"],
+                      catalog=catalog,
+                      opportunities_name_or_path=opportunities_name_or_path,
+                      nnls_engine=nnls_engine,
+                      inference_engine=inference_engine,
+                      precision=precision,
+                      result_cache=result_cache)
+        return signet
+
+    def _setup(self,
+               classifier,
+               finetuner_low,
+               finetuner_large,
+               errorfinder,
+               catalog,
+               opportunities_name_or_path,
+               nnls_engine,
+               inference_engine,
+               precision,
+               result_cache):
+        assert inference_engine in ["eager", "torchscript"], \
+            f"Inference engine must be one of ['eager', 'torchscript']. You provided {inference_engine}"
+        assert precision in PRECISIONS, f"Precision must be one of {PRECISIONS}. You provided {precision}"
+        self.result_cache = result_cache
+        self.model_version = None
+        if result_cache is not None:
+            self.model_version = model_version([classifier, finetuner_low, finetuner_large, errorfinder],
+                                               catalog.signatures,
+                                               nnls_engine=nnls_engine,
+                                               inference_engine=inference_engine,
+                                               precision=precision)
+        classifier, finetuner_low, finetuner_large, errorfinder = [
+            quantize_model(model, precision) for model in (classifier, finetuner_low, finetuner_large, errorfinder)]
+        signatures = catalog.signatures
+        self.sig_names = catalog.sig_names
+        self.mutation_types = catalog.mutation_types
+        self.signatures = signatures # TODO(oleguer): Remove, this is only for debugging
+        self.baseline = Baseline(signatures, engine=nnls_engine)
+        finetuner = CombinedFinetuner(low_mum_mut_dir=finetuner_low,
+                                      large_mum_mut_dir=finetuner_large)
 
         self.finetuner_errorfinder = ClassifiedFinetunerErrorfinder(classifier=classifier,
                                                                     finetuner=finetuner,
                                                                     errorfinder=errorfinder)
+        if inference_engine == "torchscript":
+            self.finetuner_errorfinder = ScriptedFinetunerErrorfinder(self.export_graph())
         self.opportunities_name_or_path = opportunities_name_or_path\
             if opportunities_name_or_path != 'None' else None
         logging.info("SigNet loaded!")
 
+    def export_graph(self, path=None):
+        """Compile the classifier -> finetuners -> errorfinder inference into a single TorchScript module
+
+        Args:
+            path (str, optional): File where to save it (load it with torch.jit.load)
+
+        Returns:
+            torch.jit.ScriptModule, see modules.signet_graph.SigNetGraph (reload it with load_signet_graph)
+        """
+        models = self.finetuner_errorfinder
+        if isinstance(models, ScriptedFinetunerErrorfinder):
+            if path is not None:
+                save_signet_graph(models.graph, path)
+            return models.graph
+        return script_signet_graph(classifier=models.classifier,
+                                   finetuner_low=models.finetuner.finetuner_low,
+                                   finetuner_large=models.finetuner.finetuner_large,
+                                   errorfinder=models.errorfinder,
+                                   path=path,
+                                   classification_cutoff=models.classification_cutoff,
+                                   num_mut_cutoff=models.finetuner.cutoff)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Release the NNLS worker pool kept alive between calls (when nworkers > 1)
+        """
+        self.baseline.close()
+
     def __call__(self,
                  mutation_dataset,
                  numpy=True,
                  only_NNLS=False,
                  nworkers=1,
-                 cutoff = 0.01):
+                 cutoff = 0.01,
+                 nnls_init=None,
+                 lazy_nnls=True,
+                 num_threads=None,
+                 sparse=False,
+                 instrument=False,
+                 instrumentation_callback=None,
+                 pipeline_chunk_size=None):
         """Get weights of each signature in lexicographic wrt 1-mer
 
         Args:
             mutation_dataset (pd.DataFrame(batch_size, 96)): Batch of mutation vectors to decompose
             numpy (bool): Whether to convert the outputs into numpy arrays (otherwise it'd be torch.Tensor). Default: True
-            nworkers (int): Num of threads to run the
+            nworkers (int): Num of processes to run the NNLS. When > 1 the worker pool is kept alive between calls until close().
+            nnls_init (torch.Tensor(batch_size, 72) or torch.Tensor(72)): Optional NNLS warm start, e.g. the
+                weights of a previous run of the same samples or a cohort-level prior. Default: None
+            lazy_nnls (bool): Run the detector and the num mut routing first and only compute NNLS for the samples
+                that use it (the low num mut finetuner does not). Same outputs as computing it for all. Default: True
+            num_threads (int): Num of torch intra-op threads during this call (process-wide setting, see SigNet).
+                Default: None (keep the current torch setting)
+            sparse (bool): Return the weights, bounds and normalized input as sparse matrices (see SigNetResult).
+                Default: False
+            instrument (bool): Record the time, memory and num of samples of each stage (normalization, nnls,
+                classification, finetuner_low, finetuner_large, random_guess, errorfinder, reassembly, output,
+                and cache_lookup, cache_store with a result cache) and the samples sent to each route (and cache
+                hits) into result.instrumentation (see utilities.instrumentation.Instrumentation). Default: False
+            instrumentation_callback (callable, optional): Called with the Instrumentation once the call is done
+                (e.g. to forward instrumentation.as_dict() to a metrics system). Implies instrument=True.
+            pipeline_chunk_size (int, optional): Split larger batches into chunks of this many samples and
+                overlap the NNLS of each chunk with the networks of the previous one (best with nworkers > 1,
+                so that the NNLS pool and torch use different cores). Same outputs (up to float rounding of the
+                smaller matrix products), in the same order.
+                Default: None (whole batch at once)
 
         Returns:
             results (dict)
         """
-        with torch.no_grad():
-            # Sort input data columns
-            mutation_order = pd.read_excel(os.path.join(DATA, "mutation_type_order.xlsx"))
-            mutation_dataset = mutation_dataset[list(mutation_order['Type'])]
-            sample_names = mutation_dataset.index
+        instrumentation = Instrumentation() if (instrument or instrumentation_callback is not None) else None
+        with torch.no_grad(), _torch_num_threads(num_threads):
+            with stage(instrumentation, "normalization", mutation_dataset.shape[0]):
+                # Sort input data columns
+                mutation_dataset = mutation_dataset[self.mutation_types]
+                sample_names = mutation_dataset.index
 
-            mutation_vec = torch.tensor(mutation_dataset.values.astype(np.float32), dtype=torch.float, device='cpu')
-            num_mutations = torch.sum(mutation_vec, dim=1)
+                mutation_vec = torch.tensor(mutation_dataset.values.astype(np.float32), dtype=torch.float, device='cpu')
+                num_mutations = torch.sum(mutation_vec, dim=1)
 
-            # Normalize input data
-            if self.opportunities_name_or_path is not None:
-                mutation_vec = normalize_data(mutation_vec, self.opportunities_name_or_path)
+                # Normalize input data
+                if self.opportunities_name_or_path is not None:
+                    mutation_vec = normalize_data(mutation_vec, self.opportunities_name_or_path)
 
-            sums = torch.sum(mutation_vec, dim=1).reshape(-1, 1)
-            normalized_mutation_vec = mutation_vec / sums
+                sums = torch.sum(mutation_vec, dim=1).reshape(-1, 1)
+                normalized_mutation_vec = mutation_vec / sums
   
-            # Run NNLS
-            logging.info("Obtaining NNLS guesses...")
-            self.baseline_guess = self.baseline.get_weights_batch(input_batch=normalized_mutation_vec, 
-                                                                  n_workers=nworkers)
-            logging.info("Obtaining NNLS guesses... DONE")
+            if nnls_init is not None:
+                nnls_init = torch.as_tensor(nnls_init, dtype=torch.float)
+
+            refit_kwargs = dict(only_NNLS=only_NNLS, nworkers=nworkers, cutoff=cutoff, nnls_init=nnls_init,
+                                lazy_nnls=lazy_nnls, instrumentation=instrumentation,
+                                pipeline_chunk_size=pipeline_chunk_size)
+            if self.result_cache is not None and nnls_init is None:
+                weights, lower, upper, classification = self._cached_refit(normalized_mutation_vec, num_mutations,
+                                                                           **refit_kwargs)
+            else:
+                weights, lower, upper, classification = self._refit(normalized_mutation_vec, num_mutations,
+                                                                    **refit_kwargs)
 
-            if only_NNLS:
+            with stage(instrumentation, "output", mutation_dataset.shape[0]):
                 result = SigNetResult(mutation_dataset,
-                                  weights=self.baseline_guess,
-                                  lower=torch.full((mutation_dataset.shape[0],72), float('nan')),
-                                  upper=torch.full((mutation_dataset.shape[0],72), float('nan')),
-                                  classification=torch.full((mutation_dataset.shape[0],1), float('nan')),
-                                  normalized_input=normalized_mutation_vec)
-                return result
-
-            # Finetune guess and aproximate errors
-            signet_res = self.finetuner_errorfinder(mutation_dist=normalized_mutation_vec,
-                                                    baseline_guess=self.baseline_guess,
-                                                    num_mut=num_mutations.reshape(-1, 1),
-                                                    cutoff=cutoff)
-            result = SigNetResult(mutation_dataset,
-                                  weights=signet_res["finetuner_guess"],
-                                  lower=signet_res["error_lower"],
-                                  upper=signet_res["error_upper"],
-                                  classification=signet_res["classification"],
-                                  normalized_input=normalized_mutation_vec)
-            
-            logging.info("Success: SigNet result obtained!")
+                                      weights=weights,
+                                      lower=lower,
+                                      upper=upper,
+                                      classification=classification,
+                                      normalized_input=normalized_mutation_vec,
+                                      sig_names=self.sig_names,
+                                      sparse=sparse,
+                                      instrumentation=instrumentation)
+            if not only_NNLS:
+                logging.info("Success: SigNet result obtained!")
+        if instrumentation is not None:
+            instrumentation.finish()
+        if instrumentation_callback is not None:
+            instrumentation_callback(instrumentation)
         return result
 
+    def _baseline_guess(self, normalized_mutation_vec, nnls_init, rows, nworkers, instrumentation):
+        """NNLS guess of the given rows (boolean mask, or None for all of them)
+        """
+        logging.info("Obtaining NNLS guesses...")
+        input_batch = normalized_mutation_vec if rows is None else normalized_mutation_vec[rows]
+        init = nnls_init if (rows is None or nnls_init is None or nnls_init.dim() == 1) else nnls_init[rows]
+        if instrumentation is not None:
+            instrumentation.count("nnls", input_batch.size(0))
+        with stage(instrumentation, "nnls", input_batch.size(0)):
+            baseline_guess = self.baseline.get_weights_batch(input_batch=input_batch,
+                                                             n_workers=nworkers,
+                                                             init=init)
+        logging.info("Obtaining NNLS guesses... DONE")
+        return baseline_guess
+
+    def _refit(self, normalized_mutation_vec, num_mutations, only_NNLS, nworkers, cutoff, nnls_init, lazy_nnls,
+               instrumentation, pipeline_chunk_size=None):
+        """NNLS + networks of a batch (see __call__)
+
+        Returns:
+            weights, lower, upper, classification (torch.Tensor)
+        """
+        def get_baseline_guess(rows=None):
+            return self._baseline_guess(normalized_mutation_vec, nnls_init, rows, nworkers, instrumentation)
+
+        batch_size = normalized_mutation_vec.size(0)
+        if pipeline_chunk_size is not None and batch_size > pipeline_chunk_size and not only_NNLS:
+            return self._pipelined_refit(normalized_mutation_vec, num_mutations, nworkers=nworkers, cutoff=cutoff,
+                                         nnls_init=nnls_init, instrumentation=instrumentation,
+                                         chunk_size=pipeline_chunk_size)
+        if only_NNLS:
+            return (get_baseline_guess(),
+                    torch.full((batch_size,72), float('nan')),
+                    torch.full((batch_size,72), float('nan')),
+                    torch.full((batch_size,1), float('nan')))
+
+        # Run NNLS (lazily: only for the samples which consume it once they are routed)
+        if lazy_nnls:
+            baseline_guess = get_baseline_guess
+        else:
+            baseline_guess = get_baseline_guess()
+
+        # Finetune guess and aproximate errors
+        signet_res = self.finetuner_errorfinder(mutation_dist=normalized_mutation_vec,
+                                                baseline_guess=baseline_guess,
+                                                num_mut=num_mutations.reshape(-1, 1),
+                                                cutoff=cutoff,
+                                                instrumentation=instrumentation)
+        return (signet_res["finetuner_guess"],
+                signet_res["error_lower"],
+                signet_res["error_upper"],
+                signet_res["classification"])
+
+    def _pipelined_refit(self, normalized_mutation_vec, num_mutations, nworkers, cutoff, nnls_init, instrumentation,
+                         chunk_size):
+        """_refit in chunks of chunk_size samples, where the NNLS of each chunk (on a background thread, which
+        hands it to the worker pool when nworkers > 1) runs while the networks process the previous chunk.
+        NNLS is only computed for the samples which use it, as with lazy_nnls.
+        """
+        models = self.finetuner_errorfinder
+        num_mut = num_mutations.reshape(-1, 1)
+        outputs = []
+        pending = None
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="signet-nnls") as executor:
+            for start in range(0, normalized_mutation_vec.size(0), chunk_size):
+                rows = slice(start, start + chunk_size)
+                chunk, chunk_num_mut = normalized_mutation_vec[rows], num_mut[rows]
+                init = nnls_init if (nnls_init is None or nnls_init.dim() == 1) else nnls_init[rows]
+                with stage(instrumentation, "classification", chunk.size(0)):
+                    classification = models.classify(chunk, chunk_num_mut)
+                future = executor.submit(self._baseline_guess, chunk, init,
+                                         models.needs_baseline(classification, chunk_num_mut),
+                                         nworkers, instrumentation)
+                if pending is not None:
+                    outputs.append(self._finish_chunk(*pending, cutoff=cutoff, instrumentation=instrumentation))
+                pending = (chunk, chunk_num_mut, classification, future)
+            outputs.append(self._finish_chunk(*pending, cutoff=cutoff, instrumentation=instrumentation))
+        logging.info("Pipelined refit: %i chunks of %i samples" % (len(outputs), chunk_size))
+        return tuple(torch.cat(output, dim=0) for output in zip(*outputs))
+
+    def _finish_chunk(self, chunk, num_mut, classification, baseline_future, cutoff, instrumentation):
+        signet_res = self.finetuner_errorfinder(mutation_dist=chunk,
+                                                baseline_guess=lambda rows: baseline_future.result(),
+                                                num_mut=num_mut,
+                                                cutoff=cutoff,
+                                                instrumentation=instrumentation,
+                                                classification=classification)
+        return (signet_res["finetuner_guess"],
+                signet_res["error_lower"],
+                signet_res["error_upper"],
+                signet_res["classification"])
+
+    def _cached_refit(self, normalized_mutation_vec, num_mutations, only_NNLS, cutoff, instrumentation, **kwargs):
+        """_refit of the samples which are not in self.result_cache (each distinct one only once), the rest
+        are read from the cache
+        """
+        batch_size = normalized_mutation_vec.size(0)
+        with stage(instrumentation, "cache_lookup", batch_size):
+            context = "%s|%s|%r|%s" % (self.model_version, self.opportunities_name_or_path, float(cutoff), only_NNLS)
+            keys = self.result_cache.keys(normalized_mutation_vec, num_mutations, context)
+            disk_hits = self.result_cache.disk_hits
+            found, cached = self.result_cache.get(keys)
+            disk_hits = self.result_cache.disk_hits - disk_hits
+
+            # Distinct samples to refit
+            missing = {}
+            for i in np.flatnonzero(~found):
+                missing.setdefault(keys[i], []).append(i)
+        if instrumentation is not None:
+            instrumentation.count("cache_memory_hits", int(found.sum()) - disk_hits)
+            instrumentation.count("cache_disk_hits", disk_hits)
+            instrumentation.count("cache_misses", batch_size - int(found.sum()))
+        logging.info("Result cache: %i/%i samples found, %i to refit" % (found.sum(), batch_size, len(missing)))
+
+        num_sigs = len(self.sig_names)
+        widths = [num_sigs + (0 if only_NNLS else 1), num_sigs, num_sigs, 1]
+        values = np.empty((batch_size, sum(widths)), dtype=np.float32)
+        if found.any():
+            values[found] = np.stack(cached)
+        if missing:
+            rows = [indices[0] for indices in missing.values()]
+            outputs = self._refit(normalized_mutation_vec[rows], num_mutations[rows], only_NNLS=only_NNLS,
+                                  cutoff=cutoff, instrumentation=instrumentation, **kwargs)
+            computed = np.concatenate([output.reshape(len(rows), -1).numpy() for output in outputs], axis=1)
+            with stage(instrumentation, "cache_store", len(rows)):
+                for row, indices in zip(computed, missing.values()):
+                    values[indices] = row
+                self.result_cache.put(list(missing.keys()), computed)
+
+        weights, lower, upper, classification = [output.contiguous() for output in
+                                                 torch.split(torch.from_numpy(values), widths, dim=1)]
+        return weights, lower, upper, classification if only_NNLS else classification.reshape(-1)
+
+    def stream(self,
+               reader,
+               chunk_size=10000,
+               **kwargs):
+        """Refit a cohort chunk by chunk, so that only one chunk is in memory at a time
+
+        Args:
+            reader (str, pd.DataFrame or iterable of pd.DataFrame): Path to a csv like the ones read by the refitter
+                (samples as rows, header, index in the first column), a DataFrame, or any iterable of DataFrames
+                (e.g. pd.read_csv(..., chunksize=n)), which are then used as chunks.
+            chunk_size (int): Num of samples per chunk when reader is a path or a DataFrame. Default: 10000
+            kwargs: Other arguments of __call__ (nworkers, cutoff, ...)
+
+        Yields:
+            SigNetResult of each chunk, in input order. Save them with result.save(path, append=True)
+            (append=False for the first one) to write the whole cohort incrementally. The outputs match a single
+            call on the whole input up to float32 rounding (about 1e-7), since reductions run over different
+            batch shapes.
+        """
+        if isinstance(reader, (str, os.PathLike)):
+            reader = pd.read_csv(reader, header=0, index_col=0, chunksize=chunk_size)
+        elif isinstance(reader, pd.DataFrame):
+            dataset = reader
+            reader = (dataset.iloc[i:i + chunk_size] for i in range(0, dataset.shape[0], chunk_size))
+
+        n_samples = 0
+        for chunk in reader:
+            if chunk.shape[0] == 0:
+                continue
+            yield self(chunk, **kwargs)
+            n_samples += chunk.shape[0]
+            logging.info("Streaming refit: %i samples done"%n_samples)
+
+def _to_csr(values):
+    import scipy.sparse
+    if scipy.sparse.issparse(values):
+        return values
+    if isinstance(values, torch.Tensor):
+        values = values.detach().cpu().numpy()
+    return scipy.sparse.csr_matrix(values.reshape(values.shape[0], -1), dtype=np.float32)
+
+
+def _compact(values):
+    """CSR version of a dense output if it takes less memory, the dense tensor otherwise
+    """
+    csr = _to_csr(values)
+    sparse_bytes = csr.data.nbytes + csr.indices.nbytes + csr.indptr.nbytes
+    return csr if sparse_bytes < 4*csr.shape[0]*csr.shape[1] else values
+
+
+def _dense_rows(values, rows):
+    if isinstance(values, torch.Tensor):
+        return values[rows]
+    return torch.from_numpy(values[rows].toarray())
+
+
 class SigNetResult:
 
     def __init__(self,
@@ -111,24 +492,83 @@ class SigNetResult:
                  lower,
                  upper,
                  classification,
-                 normalized_input):
+                 normalized_input,
+                 sig_names=None,
+                 sparse=False,
+                 instrumentation=None):
+        """Outputs of SigNet
+
+        Args:
+            sparse (bool): Keep weights, bounds and normalized input as scipy.sparse.csr_matrix (float32) instead
+                of dense tensors. Weights below the cutoff are exactly 0, so this usually takes a fraction of the
+                memory. Each of them is only converted when the CSR matrix is smaller than the dense one
+                (e.g. upper bounds are rarely 0, and NaN bounds of random samples are stored explicitly). Default: False
+            instrumentation (Instrumentation, optional): Per-stage timings and memory of the call which
+                produced the result (SigNet(..., instrument=True)), None otherwise
+        """
         self.mutation_dataset = mutation_dataset
+        self.sparse = sparse
+        if sparse:
+            weights, lower, upper, normalized_input = [_compact(values) for values in (weights, lower, upper, normalized_input)]
         self.weights = weights
         self.lower = lower
         self.upper = upper
         self.classification = classification
         self.normalized_input = normalized_input
-        self.sig_names = list(pd.read_excel(os.path.join(DATA, "data.xlsx")).columns)[1:]
+        self.sig_names = sig_names if sig_names is not None else load_catalog().sig_names
+        self.instrumentation = instrumentation
+
+    def dense(self, rows=None):
+        """Dense (torch.Tensor) SigNetResult of the given rows (slice or array of positions, all by default)
+        """
+        if rows is None:
+            if not self.sparse:
+                return self
+            rows = slice(None)
+        return SigNetResult(self.mutation_dataset.iloc[rows],
+                            weights=_dense_rows(self.weights, rows),
+                            lower=_dense_rows(self.lower, rows),
+                            upper=_dense_rows(self.upper, rows),
+                            classification=self.classification[rows],
+                            normalized_input=_dense_rows(self.normalized_input, rows),
+                            sig_names=self.sig_names)
+
+    def blocks(self, block_size=10000):
+        """Iterate over the result in dense SigNetResults of at most block_size samples (the result itself if
+        it is not sparse), to write or plot sparse results without densifying all of them at once
+        """
+        if not self.sparse:
+            yield self
+            return
+        for start in range(0, self.weights.shape[0], block_size):
+            yield self.dense(slice(start, start + block_size))
+
+    def memory_usage(self):
+        """Bytes taken by weights, bounds, classification and normalized input
+        """
+        def nbytes(values):
+            if isinstance(values, torch.Tensor):
+                return values.element_size()*values.nelement()
+            return values.data.nbytes + values.indices.nbytes + values.indptr.nbytes
+        return sum(nbytes(values) for values in (self.weights, self.lower, self.upper,
+                                                  self.classification, self.normalized_input))
 
     def get_output(self, format="numpy"):
         """ 
-        Obtain the predicted outputs in one of these formats: ["numpy", "pandas", "tensor"]
+        Obtain the predicted outputs in one of these formats: ["numpy", "pandas", "tensor", "sparse"]
         Args:
-            format: one of: "numpy", "pandas", "tensor"
+            format: one of: "numpy", "pandas", "tensor", "sparse" (scipy.sparse.csr_matrix weights, bounds and
+                normalized input, numpy classification). Sparse results are densified for the other formats.
         Returns:
             weights, lower bound, upper bound, classification, normalized_input in the given format.
         """
-        assert format in ["numpy", "pandas", "tensor"]
+        assert format in ["numpy", "pandas", "tensor", "sparse"]
+        if format == "sparse":
+            weights, lower, upper, normalized_input = [
+                _to_csr(values) for values in (self.weights, self.lower, self.upper, self.normalized_input)]
+            return weights, lower, upper, self.classification.detach().numpy(), normalized_input
+        if self.sparse:
+            return self.dense().get_output(format=format)
         if format == "numpy":
             weights = self.weights.detach().numpy()
             lower = self.lower.detach().numpy()
@@ -146,59 +586,98 @@ class SigNetResult:
         return weights, lower, upper, classification, normalized_input
 
     def save(self, 
-             path='Output'):
+             path='Output',
+             append=False,
+             format="csv"):
         """ 
         Save outputs into a file.
         Args:
             path (str): path to the directory where the files will be written.
+            append (bool): add the rows at the end of existing files (without header) instead of
+                overwriting them, e.g. to write the results of SigNet.stream chunk by chunk. Default: False
+            format (str): "csv" writes one file per output (and a copy of the input counts), "parquet" or
+                "arrow" write a single columnar file signet_results.<format> (see utilities.io.SigNetResultWriter,
+                which is also the way to append columnar outputs). Default: "csv"
         """
+        assert format in SIGNET_RESULT_FORMATS, f"Output format must be one of {SIGNET_RESULT_FORMATS}. You provided {format}"
+        if format != "csv":
+            assert not append, "Columnar outputs are appended through utilities.io.SigNetResultWriter"
+            logging.info("Writting results: %s..."%path)
+            with SigNetResultWriter(os.path.join(path, "signet_results.%s"%format), format=format) as writer:
+                writer.write(self)
+            logging.info("Writting results: %s... DONE"%path)
+            return
+        if self.sparse:
+            for i, block in enumerate(self.blocks()):
+                block.save(path=path, append=append or i > 0)
+            return
         logging.info("Writting results: %s..."%path)
-        pathlib.Path(path).mkdir(parents=True, exist_ok=True)
-        weights, lower, upper, classification, _ = self.get_output(format="pandas")
-
-        try:
-            weights.columns = self.sig_names + ['Unknown']
-            weights.index = self.mutation_dataset.index
-            weights.to_csv(path + "/weight_guesses.csv", header=True, index=True)
-        except:
-            weights.columns = self.sig_names
-            weights.index = self.mutation_dataset.index
-            weights.to_csv(path + "/weight_guesses.csv", header=True, index=True)
-
-        lower.columns = self.sig_names
-        lower.index = self.mutation_dataset.index
-        lower.to_csv(path + "/lower_bound_guesses.csv", header=True, index=True)
-    
-        upper.columns = self.sig_names
-        upper.index = self.mutation_dataset.index
-        upper.to_csv(path + "/upper_bound_guesses.csv", header=True, index=True)
-    
-        classification.columns = ['Classification']
-        classification.index = self.mutation_dataset.index
-        classification.to_csv(path + "/classification_guesses.csv", header=True, index=True)
-
-        self.mutation_dataset.to_csv(path + "/mutation_counts_input.csv", header=True, index=True)
+
+        write_result_csvs(weights=self.weights,
+                          lower_bound=self.lower,
+                          upper_bound=self.upper,
+                          classification=self.classification,
+                          sample_names=self.mutation_dataset.index,
+                          output_path=path,
+                          sig_names=self.sig_names,
+                          append=append)
+        self.mutation_dataset.to_csv(path + "/mutation_counts_input.csv", header=not append, index=True,
+                                     mode="a" if append else "w")
         logging.info("Writting results: %s... DONE"%path)
 
     def plot_results(self, 
                      compute = 'True',
                      save = True,
-                     path = 'Output/plots'):
+                     path = 'Output/plots',
+                     samples = None,
+                     format = "png",
+                     n_workers = 1):
         """ 
         Shows and saves (if applicable) the plots of the signature decompositions.
         Args:
             path (str): path to the directory where the plots will be saved.
             save (bool): whether to save the plot into a file or not.
+            samples (list, optional): names of the samples to plot. Default: all of them.
+            format (str): file format of the saved plots, one of utilities.result_plotting.PLOT_FORMATS. Default: "png"
+            n_workers (int): num of processes rendering the saved plots (headless, reusing one figure per
+                process, see utilities.result_plotting). Default: 1
+        Returns:
+            plots per second (when saving)
         """
         if compute == 'True':
             logging.info("Plotting results: %s..."%path)
+            result = self
+            if samples is not None:
+                rows = self.mutation_dataset.index.get_indexer(samples)
+                assert (rows >= 0).all(), "Unknown samples: %s"%list(np.array(samples)[rows < 0])
+                result = self.dense(rows)
+
+            if not save:
+                from signaturesnet.utilities.plotting import plot_weights
+                for block in result.blocks():
+                    weights, lower, upper, _, _ = block.get_output(format="numpy")
+                    for i in range(weights.shape[0]):
+                        plot_weights(guessed_labels=weights[i,:72], 
+                                    pred_upper=upper[i,:], 
+                                    pred_lower=lower[i,:], 
+                                    sigs_names=self.sig_names, 
+                                    save=False)
+                logging.info("Plotting results: %s... DONE"%path)
+                return
+
+            from signaturesnet.utilities.result_plotting import plot_weights_batch
             pathlib.Path(path).mkdir(parents=True, exist_ok=True)
-            samples = list(self.mutation_dataset.index)
-            for i in range(self.weights.shape[0]):
-                plot_weights(guessed_labels=self.weights[i,:72], 
-                            pred_upper=self.upper[i,:], 
-                            pred_lower=self.lower[i,:], 
-                            sigs_names=self.sig_names, 
-                            save=save, 
-                            plot_path=path + "/plot_%s.png"%samples[i])
-            logging.info("Plotting results: %s... DONE"%path)
\ No newline at end of file
+            start = time.time()
+            for block in result.blocks():
+                weights, lower, upper, _, _ = block.get_output(format="numpy")
+                plot_weights_batch(weights=weights[:, :len(self.sig_names)],
+                                   upper=upper,
+                                   lower=lower,
+                                   sample_names=list(block.mutation_dataset.index),
+                                   sig_names=self.sig_names,
+                                   path=path,
+                                   format=format,
+                                   n_workers=n_workers)
+            elapsed = time.time() - start
+            logging.info("Plotting results: %s... DONE"%path)
+            return result.weights.shape[0]/elapsed if elapsed > 0 else float('inf')
@@ -0,0 +1,340 @@
+import asyncio
+import collections
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+import numpy as np
+import pandas as pd
+
+
+class ServerStats:
+
+    def __init__(self, window=1000):
+        """Running statistics of a SigNetServer
+
+        Args:
+            window (int): Num of most recent batches/requests used for the latency and batch size summaries
+        """
+        self.started = time.time()
+        self.queue_depth = 0        # Samples waiting to be batched
+        self.requests = 0
+        self.samples = 0
+        self.batches = 0
+        self.errors = 0
+        self.batch_sizes = collections.deque(maxlen=window)
+        self.latencies = collections.defaultdict(lambda: collections.deque(maxlen=window))
+
+    def add_latency(self, stage, seconds):
+        self.latencies[stage].append(seconds)
+
+    def summary(self):
+        def describe(values):
+            values = np.array(values, dtype=float)
+            if len(values) == 0:
+                return {}
+            return {"mean": float(values.mean()),
+                    "p50": float(np.percentile(values, 50)),
+                    "p95": float(np.percentile(values, 95)),
+                    "max": float(values.max())}
+        return {"uptime_s": time.time() - self.started,
+                "queue_depth": self.queue_depth,
+                "requests": self.requests,
+                "samples": self.samples,
+                "batches": self.batches,
+                "errors": self.errors,
+                "batch_size": describe(self.batch_sizes),
+                "latency_s": {stage: describe(values) for stage, values in self.latencies.items()}}
+
+
+class MicroBatcher:
+
+    def __init__(self, signet, max_batch_size=256, max_latency=0.005, cutoff=0.01, nworkers=1, stats=None):
+        """Coalesce concurrent SigNet requests into micro-batches
+
+        The first request of a batch waits at most max_latency seconds for others to join it
+        (or until max_batch_size samples are gathered). Batches are run one at a time on a single
+        inference thread, so the event loop keeps accepting requests meanwhile.
+
+        Args:
+            signet (SigNet): Loaded SigNet
+            max_batch_size (int): Num of samples at which a batch is sent without waiting. Default: 256
+            max_latency (float): Max seconds a request waits for others to batch with. Default: 0.005
+            cutoff (float): Weights cutoff passed to SigNet. Default: 0.01
+            nworkers (int): NNLS workers passed to SigNet. Default: 1
+            stats (ServerStats, optional): Where to record the batching statistics
+        """
+        self.signet = signet
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.cutoff = cutoff
+        self.nworkers = nworkers
+        self.stats = stats if stats is not None else ServerStats()
+        self._queue = None
+        self._task = None
+        self._executor = None
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="signet-inference")
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def submit(self, counts):
+        """Queue a batch of mutation counts and wait for its results
+
+        Args:
+            counts (np.array(n, 96)): Mutation counts in signet.mutation_types order
+
+        Returns:
+            dict with "weights", "lower", "upper" and "classification" np.arrays (one row per sample)
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.stats.queue_depth += counts.shape[0]
+        self._queue.put_nowait((counts, time.perf_counter(), future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            size = batch[0][0].shape[0]
+            deadline = loop.time() + self.max_latency
+            while size < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                size += item[0].shape[0]
+            await self._process(batch, size)
+
+    async def _process(self, batch, size):
+        start = time.perf_counter()
+        self.stats.queue_depth -= size
+        for _, arrival, _ in batch:
+            self.stats.add_latency("queue", start - arrival)
+        self.stats.batches += 1
+        self.stats.batch_sizes.append(size)
+
+        counts = np.concatenate([item[0] for item in batch], axis=0)
+        try:
+            outputs = await asyncio.get_running_loop().run_in_executor(self._executor, self._infer, counts)
+        except Exception as e:
+            logging.exception("SigNet server batch failed")
+            self.stats.errors += 1
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.stats.add_latency("inference", time.perf_counter() - start)
+
+        offset = 0
+        for item_counts, _, future in batch:
+            rows = slice(offset, offset + item_counts.shape[0])
+            offset += item_counts.shape[0]
+            if not future.done():
+                future.set_result({key: value[rows] for key, value in outputs.items()})
+
+    def _infer(self, counts):
+        mutation_dataset = pd.DataFrame(counts, columns=self.signet.mutation_types)
+        result = self.signet(mutation_dataset, nworkers=self.nworkers, cutoff=self.cutoff,
+                             instrumentation_callback=self._record_stages)
+        weights, lower, upper, classification, _ = result.get_output(format="numpy")
+        return {"weights": weights,
+                "lower": lower,
+                "upper": upper,
+                "classification": classification.reshape(-1)}
+
+    def _record_stages(self, instrumentation):
+        for name, record in instrumentation.stages.items():
+            self.stats.add_latency("stage_" + name, record["seconds"])
+
+
+def _to_json(array):
+    """np.array to nested lists, NaN as null
+    """
+    array = np.asarray(array, dtype=float)
+    return np.where(np.isnan(array), None, array).tolist()
+
+
+class SigNetServer:
+
+    def __init__(self, signet, max_batch_size=256, max_latency_ms=5, cutoff=0.01, nworkers=1):
+        """Long-running HTTP/JSON service which keeps a SigNet instance warm
+
+        Endpoints:
+            POST /refit: body {"counts": [[96 counts], ...] (or a single [96 counts]),
+                               "mutation_types": optional column order (default: signet.mutation_types),
+                               "names": optional sample names}.
+                Returns {"names", "sig_names", "weights", "lower", "upper", "classification"}, NaN as null.
+            GET /stats: queue depth, batch sizes and per-stage latency (see ServerStats). stage_<name>
+                latencies are the SigNet stages of each batch (see utilities.instrumentation)
+            GET /health
+
+        Args:
+            signet (SigNet): Loaded SigNet
+            max_batch_size, max_latency_ms, cutoff, nworkers: see MicroBatcher
+        """
+        self.signet = signet
+        self.stats = ServerStats()
+        self.batcher = MicroBatcher(signet,
+                                    max_batch_size=max_batch_size,
+                                    max_latency=max_latency_ms/1000.,
+                                    cutoff=cutoff,
+                                    nworkers=nworkers,
+                                    stats=self.stats)
+        self._server = None
+        self._connections = set()
+
+    async def start(self, host="127.0.0.1", port=8000, unix_socket=None):
+        """Start listening on host:port, or on a Unix socket if unix_socket is given
+
+        Returns:
+            asyncio.Server (port=0 binds a free port, see server.sockets[0].getsockname())
+        """
+        self.batcher.start()
+        if unix_socket is not None:
+            if os.path.exists(unix_socket):
+                os.remove(unix_socket)
+            self._server = await asyncio.start_unix_server(self._handle, path=unix_socket)
+            logging.info("SigNet server listening on %s" % unix_socket)
+        else:
+            self._server = await asyncio.start_server(self._handle, host=host, port=port)
+            logging.info("SigNet server listening on http://%s:%i" % self._server.sockets[0].getsockname()[:2])
+        return self._server
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            for task in list(self._connections):   # Idle keep-alive connections
+                task.cancel()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+        await self.batcher.stop()
+
+    async def serve_forever(self, host="127.0.0.1", port=8000, unix_socket=None):
+        server = await self.start(host=host, port=port, unix_socket=unix_socket)
+        try:
+            await server.serve_forever()
+        finally:
+            await self.stop()
+
+    async def _handle(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target = request_line.decode("latin-1").split()[:2]
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, value = line.decode("latin-1").split(":", 1)
+                    headers[key.strip().lower()] = value.strip()
+                if "chunked" in headers.get("transfer-encoding", "").lower():
+                    # Bodies must come with a Content-Length. The chunked body is not read, so close the connection
+                    await self._respond(writer, HTTPStatus.LENGTH_REQUIRED,
+                                        {"error": "Chunked requests are not supported, send a Content-Length"})
+                    break
+                expect = headers.get("expect", "").lower()
+                if expect == "100-continue":
+                    writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+                    await writer.drain()
+                elif expect:
+                    await self._respond(writer, HTTPStatus.EXPECTATION_FAILED,
+                                        {"error": "Unsupported Expect: %s" % expect})
+                    break
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                status, payload = await self._route(method, target.split("?")[0], body)
+                await self._respond(writer, status, payload)
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError, asyncio.CancelledError):
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    async def _respond(self, writer, status, payload):
+        data = json.dumps(payload).encode()
+        writer.write(b"HTTP/1.1 %i %s\r\nContent-Type: application/json\r\nContent-Length: %i\r\n\r\n" %
+                     (status.value, status.phrase.encode(), len(data)) + data)
+        await writer.drain()
+
+    async def _route(self, method, path, body):
+        if method == "GET" and path == "/health":
+            return HTTPStatus.OK, {"status": "ok"}
+        if method == "GET" and path == "/stats":
+            return HTTPStatus.OK, self.stats.summary()
+        if method == "POST" and path == "/refit":
+            try:
+                return HTTPStatus.OK, await self._refit(json.loads(body))
+            except (ValueError, KeyError, AssertionError) as e:
+                self.stats.errors += 1
+                return HTTPStatus.BAD_REQUEST, {"error": str(e)}
+            except Exception:
+                self.stats.errors += 1
+                logging.exception("Error processing /refit request")
+                return HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "Internal server error"}
+        return HTTPStatus.NOT_FOUND, {"error": "Unknown endpoint %s %s" % (method, path)}
+
+    async def _refit(self, request):
+        start = time.perf_counter()
+        counts = np.atleast_2d(np.asarray(request["counts"], dtype=np.float32))
+        mutation_types = request.get("mutation_types", self.signet.mutation_types)
+        assert counts.shape[1] == len(self.signet.mutation_types) == len(mutation_types), \
+            "Each sample must have %i mutation counts" % len(self.signet.mutation_types)
+        if mutation_types != self.signet.mutation_types:
+            counts = pd.DataFrame(counts, columns=mutation_types)[self.signet.mutation_types].values
+        names = request.get("names", list(range(counts.shape[0])))
+        assert len(names) == counts.shape[0], "names and counts must have the same length"
+
+        self.stats.requests += 1
+        self.stats.samples += counts.shape[0]
+        outputs = await self.batcher.submit(counts)
+
+        encode_start = time.perf_counter()
+        response = {"names": names,
+                    "sig_names": self.signet.sig_names + ["Unknown"],
+                    "weights": _to_json(outputs["weights"]),
+                    "lower": _to_json(outputs["lower"]),
+                    "upper": _to_json(outputs["upper"]),
+                    "classification": _to_json(outputs["classification"])}
+        end = time.perf_counter()
+        self.stats.add_latency("encode", end - encode_start)
+        self.stats.add_latency("total", end - start)
+        return response
+
+
+def serve(signet, host="127.0.0.1", port=8000, unix_socket=None, **kwargs):
+    """Run a SigNetServer until interrupted. See SigNetServer for the kwargs.
+    """
+    server = SigNetServer(signet, **kwargs)
+    try:
+        asyncio.run(server.serve_forever(host=host, port=port, unix_socket=unix_socket))
+    except KeyboardInterrupt:
+        logging.info("SigNet server stopped")
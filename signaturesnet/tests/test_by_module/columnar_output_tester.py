@@ -0,0 +1,34 @@
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from signaturesnet import DATA
+from signaturesnet.modules.signet_module import SigNet
+from signaturesnet.utilities.io import read_signet_results
+
+# Writes SigNetResults (refit and only_NNLS) to Parquet and Arrow files, reads them back with read_signet_results
+# and checks that the outputs have the same values and shapes as SigNetResult.get_output.
+
+# Load data
+example = pd.read_csv(DATA + "/datasets/example_input.csv", header=0, index_col=0)
+print("data loaded")
+
+folder = tempfile.mkdtemp()
+signet = SigNet()
+for only_NNLS in [False, True]:
+    result = signet(example, only_NNLS=only_NNLS)
+    expected = result.get_output(format="numpy")
+    for format in ["parquet", "arrow"]:
+        path = os.path.join(folder, "nnls" if only_NNLS else "refit")
+        result.save(path, format=format)
+        *outputs, sample_names = read_signet_results(os.path.join(path, "signet_results.%s" % format),
+                                                     format="numpy", return_sample_names=True)
+        for expected_output, output in zip(expected, outputs):
+            assert expected_output.shape == output.shape, (expected_output.shape, output.shape)
+            np.testing.assert_allclose(output, expected_output.astype(np.float32), rtol=0, atol=0)
+        assert sample_names == list(example.index)
+        print("%s%s: outputs and shapes match (classification %s)" %
+              ("NNLS " if only_NNLS else "", format, outputs[3].shape))
+signet.close()
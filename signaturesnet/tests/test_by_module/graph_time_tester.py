@@ -0,0 +1,47 @@
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+
+from signaturesnet import DATA
+from signaturesnet.modules.signet_module import SigNet
+
+# Compares the eager and TorchScript inference engines of SigNet (CPU).
+# NNLS is computed once and reused so that only the neural part of the pipeline is timed.
+
+n_samples = 5000
+replicates = 5
+num_muts = [25, 100, 1000, 10000, 100000]
+torch.set_num_threads(1)
+
+# Load data
+example = pd.read_csv(DATA + "/datasets/example_input.csv", header=0, index_col=0)
+profiles = example.values/example.values.sum(axis=1, keepdims=True)
+rng = np.random.default_rng(0)
+num_mut = torch.tensor([num_muts[i % len(num_muts)] for i in range(n_samples)], dtype=torch.float).reshape(-1, 1)
+inputs = np.stack([rng.multinomial(int(num_mut[i]), profiles[i % len(profiles)])
+                   for i in range(n_samples)]).astype(np.float32)
+inputs = torch.tensor(inputs/inputs.sum(axis=1, keepdims=True), dtype=torch.float)
+print("data loaded")
+
+signets = {engine: SigNet(inference_engine=engine) for engine in ["eager", "torchscript"]}
+baseline_guess = signets["eager"].baseline.get_weights_batch(inputs, n_workers=8)
+
+outputs = {}
+for engine, signet in signets.items():
+    times = []
+    with torch.no_grad():
+        for k in range(replicates + 1):   # First run is warm-up (TorchScript profiling)
+            st = time.time()
+            outputs[engine] = signet.finetuner_errorfinder(mutation_dist=inputs,
+                                                           baseline_guess=baseline_guess,
+                                                           num_mut=num_mut,
+                                                           cutoff=0.01)
+            times.append(time.time() - st)
+    times = np.array(times[1:])
+    print("%s: %.3fs +- %.3fs (%.0f samples/s)" % (engine, times.mean(), times.std(), n_samples/times.mean()))
+
+for key in ["finetuner_guess", "error_upper", "error_lower", "classification"]:
+    diff = torch.nan_to_num(outputs["eager"][key] - outputs["torchscript"][key])
+    print("Max abs difference %s: %.2e" % (key, torch.max(torch.abs(diff)).item()))
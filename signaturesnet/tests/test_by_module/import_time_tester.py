@@ -0,0 +1,26 @@
+import subprocess
+import sys
+import time
+
+# Guards the start-up time of the inference entry points: importing them must not pull
+# plotting, logging or training dependencies, which are only imported on first use.
+
+ENTRY_POINTS = [
+    "signaturesnet.modules.signet_module",
+    "signaturesnet.models",
+    "signaturesnet.utilities.io",
+]
+FORBIDDEN_MODULES = ["matplotlib", "seaborn", "sklearn", "wandb", "tensorboard", "yaml", "openpyxl", "genomepy"]
+replicates = 5
+
+for entry_point in ENTRY_POINTS:
+    code = ("import sys; import %s; "
+            "print(','.join(m for m in %s if m in sys.modules))" % (entry_point, FORBIDDEN_MODULES))
+    times = []
+    for _ in range(replicates):
+        st = time.time()
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+        times.append(time.time() - st)
+    loaded = [m for m in out.stdout.strip().split(",") if m]
+    print("%s: %.2fs (min of %i cold starts)" % (entry_point, min(times), replicates))
+    assert not loaded, "%s imports %s at start-up" % (entry_point, loaded)
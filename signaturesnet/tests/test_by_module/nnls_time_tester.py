@@ -0,0 +1,61 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+
+from signaturesnet import DATA
+from signaturesnet.models.baseline import Baseline
+from signaturesnet.utilities.io import read_signatures
+
+# Compares throughput and results of the NNLS engines of Baseline.
+# Inputs are multinomial resamplings of the example PCAWG profiles at different numbers of mutations.
+
+n_samples = 5000
+n_workers = 8
+num_muts = [25, 100, 1000, 10000, 100000]
+
+# Load data
+signatures = read_signatures(file=os.path.join(DATA, "data.xlsx"),
+                             mutation_type_order=os.path.join(DATA, "mutation_type_order.xlsx"))
+example = pd.read_csv(os.path.join(DATA, "datasets/example_input.csv"), header=0, index_col=0)
+profiles = example.values/example.values.sum(axis=1, keepdims=True)
+
+rng = np.random.default_rng(0)
+inputs = np.stack([rng.multinomial(num_muts[i % len(num_muts)], profiles[i % len(profiles)])
+                   for i in range(n_samples)]).astype(np.float32)
+inputs = torch.tensor(inputs/inputs.sum(axis=1, keepdims=True), dtype=torch.float)
+print("data loaded")
+
+guesses = {}
+for engine in Baseline.ENGINES:
+    baseline = Baseline(signatures, engine=engine)
+    st = time.time()
+    guesses[engine] = baseline.get_weights_batch(input_batch=inputs, n_workers=n_workers)
+    et = time.time()
+    print("%s: %.2fs (%.0f samples/s)" % (engine, et - st, n_samples/(et - st)))
+
+max_diff = torch.max(torch.abs(guesses["scipy"] - guesses["batched"])).item()
+print("Max abs difference between engines: %.2e" % max_diff)
+
+# Warm start: re-run on a slightly updated cohort (new mutation draws of the same profiles)
+catalog = Baseline(signatures, engine="batched").catalog
+updated = np.stack([rng.multinomial(num_muts[i % len(num_muts)], profiles[i % len(profiles)])
+                    for i in range(n_samples)]).astype(np.float32)
+updated = updated/updated.sum(axis=1, keepdims=True)
+cold, cold_iterations = catalog.solve(updated, return_iterations=True)
+warm, warm_iterations = catalog.solve(updated, init=guesses["batched"].numpy(), return_iterations=True)
+print("Cold start: %.1f iterations/sample, warm start: %.1f iterations/sample (max abs difference %.2e)" %
+      (cold_iterations.mean(), warm_iterations.mean(), np.max(np.abs(cold - warm))))
+
+# Repeated small batches (per-patient requests) reusing the persistent worker pool
+n_calls = 50
+with Baseline(signatures, engine="scipy") as baseline:
+    st = time.time()
+    baseline.get_weights_batch(input_batch=inputs[:5], n_workers=n_workers)
+    print("First small batch (pool start-up): %.3fs" % (time.time() - st))
+    st = time.time()
+    for i in range(n_calls):
+        baseline.get_weights_batch(input_batch=inputs[5*i:5*(i + 1)], n_workers=n_workers)
+    print("Next small batches: %.4fs/call" % ((time.time() - st)/n_calls))
@@ -0,0 +1,46 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+from signaturesnet import DATA
+from signaturesnet.modules.signet_module import SigNet
+
+# End-to-end throughput of SigNet with and without pipelining (pipeline_chunk_size), which overlaps the NNLS
+# of each chunk (worker pool) with the networks of the previous one. Run it on a multi-core machine:
+# the NNLS pool uses n_workers cores and torch the num_threads left.
+# Inputs are multinomial resamplings of the example PCAWG profiles at different numbers of mutations.
+
+n_samples = 50000
+n_workers = 6
+num_threads = 2
+replicates = 3
+chunk_sizes = [None, 1000, 2500, 5000, 10000]
+num_muts = [25, 100, 1000, 10000, 100000]
+
+# Load data
+example = pd.read_csv(DATA + "/datasets/example_input.csv", header=0, index_col=0)
+profiles = example.values/example.values.sum(axis=1, keepdims=True)
+rng = np.random.default_rng(0)
+counts = np.stack([rng.multinomial(num_muts[i % len(num_muts)], profiles[i % len(profiles)])
+                   for i in range(n_samples)])
+mutation_dataset = pd.DataFrame(counts, columns=example.columns, index=["sample_%i" % i for i in range(n_samples)])
+print("data loaded")
+
+with SigNet() as signet:
+    signet(mutation_dataset.iloc[:1000], nworkers=n_workers)   # Start the NNLS pool
+    outputs = {}
+    for chunk_size in chunk_sizes:
+        times = []
+        for k in range(replicates):
+            st = time.time()
+            result = signet(mutation_dataset, nworkers=n_workers, num_threads=num_threads,
+                            pipeline_chunk_size=chunk_size)
+            times.append(time.time() - st)
+        outputs[chunk_size] = result.get_output()
+        print("pipeline_chunk_size %s: %.2fs (%.0f samples/s)" % (chunk_size, np.median(times),
+                                                                  n_samples/np.median(times)))
+
+for chunk_size in chunk_sizes[1:]:
+    max_diff = max(np.nanmax(np.abs(a - b)) for a, b in zip(outputs[None][:4], outputs[chunk_size][:4]))
+    print("pipeline_chunk_size %s: max abs difference %.2e" % (chunk_size, max_diff))
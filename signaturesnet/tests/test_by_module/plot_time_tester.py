@@ -0,0 +1,40 @@
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+from signaturesnet import DATA
+from signaturesnet.modules.signet_module import SigNet
+from signaturesnet.utilities.plotting import plot_weights
+
+# Plots per second of SigNetResult.plot_results (headless, reused figures) vs one pyplot figure per sample
+# (utilities.plotting.plot_weights), for different numbers of rendering processes and file formats.
+
+n_workers_list = [1, 2, 4, 8]
+formats = ["png", "pdf"]
+
+# Load data & refit
+mutation_dataset = pd.read_csv(DATA + "/datasets/example_input.csv", header=0, index_col=0)
+signet = SigNet()
+results = signet(mutation_dataset, nworkers=8)
+weights, lower, upper, _, _ = results.get_output(format="numpy")
+n_samples = weights.shape[0]
+print("data loaded: %i samples" % n_samples)
+
+with tempfile.TemporaryDirectory() as path:
+    st = time.time()
+    for i in range(n_samples):
+        plot_weights(guessed_labels=weights[i, :72],
+                     pred_upper=upper[i, :],
+                     pred_lower=lower[i, :],
+                     sigs_names=results.sig_names,
+                     save=True,
+                     plot_path=os.path.join(path, "old_%i.png" % i))
+    print("pyplot (one figure per sample), png: %.1f plots/s" % (n_samples/(time.time() - st)))
+
+    for format in formats:
+        for n_workers in n_workers_list:
+            throughput = results.plot_results(save=True, path=path, format=format, n_workers=n_workers)
+            print("plot_results, %s, %i workers: %.1f plots/s" % (format, n_workers, throughput))
+signet.close()
@@ -0,0 +1,74 @@
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+
+from signaturesnet import DATA, TRAINED_MODELS
+from signaturesnet.modules.signet_module import SigNet
+from signaturesnet.utilities.io import csv_to_tensor
+
+# Accuracy and throughput of SigNet(precision="int8") vs fp32 on the shipped realistic test sets
+# (DATA/realistic_nummuts_data/test_{low,large}_*.csv).
+# Reports, per range of number of mutations: weight MAE wrt the labels, interval coverage (label inside
+# [lower, upper]), classification agreement and samples/s on a single core.
+# NNLS is computed once and shared by both precisions so that only the networks are timed.
+# The labels are signature counts: their sum is the mean number of mutations the inputs were sampled with.
+
+data_path = DATA + "/realistic_nummuts_data/"
+num_mut_bins = [0, 100, 1000, 10000, 100000, np.inf]
+replicates = 5
+torch.set_num_threads(1)
+
+# Load data
+inputs = torch.cat([csv_to_tensor(data_path + "test_%s_input.csv" % source, device='cpu') for source in ["low", "large"]])
+labels = torch.cat([csv_to_tensor(data_path + "test_%s_label.csv" % source, device='cpu') for source in ["low", "large"]])
+num_mut = labels.sum(dim=1, keepdim=True)
+weights_true = labels/num_mut
+num_mut_range = pd.cut(num_mut.view(-1).numpy(), num_mut_bins)
+print("data loaded")
+
+signets = {precision: SigNet(classifier=TRAINED_MODELS + "/detector",
+                             finetuner_realistic_low=TRAINED_MODELS + "/finetuner_low",
+                             finetuner_realistic_large=TRAINED_MODELS + "/finetuner_large",
+                             errorfinder=TRAINED_MODELS + "/errorfinder",
+                             precision=precision)
+           for precision in ["fp32", "int8"]}
+baseline_guess = signets["fp32"].baseline.get_weights_batch(inputs, n_workers=8)
+
+rows = []
+outputs = {}
+for precision, signet in signets.items():
+    times = []
+    with torch.no_grad():
+        for k in range(replicates + 1):   # First run is warm-up
+            st = time.time()
+            outputs[precision] = signet.finetuner_errorfinder(mutation_dist=inputs,
+                                                              baseline_guess=baseline_guess,
+                                                              num_mut=num_mut,
+                                                              cutoff=0.01)
+            times.append(time.time() - st)
+    print("%s: %.0f samples/s/core" % (precision, inputs.size(0)/np.mean(times[1:])))
+
+    output = outputs[precision]
+    weights = output["finetuner_guess"][:, :-1]
+    inside = (weights_true >= output["error_lower"]) & (weights_true <= output["error_upper"])
+    realistic = ~torch.isnan(output["error_lower"][:, 0])
+    for mut_range in num_mut_range.categories:
+        ind = torch.from_numpy(np.asarray(num_mut_range == mut_range))
+        if not ind.any():
+            continue
+        rows.append({"precision": precision,
+                     "max_num_mut": mut_range.right,
+                     "mae": torch.mean(torch.abs(weights[ind] - weights_true[ind])).item(),
+                     "coverage": inside[ind & realistic].float().mean().item(),
+                     "classification_agreement": torch.mean(
+                         ((outputs["fp32"]["classification"][ind] > 0.5) ==
+                          (output["classification"][ind] > 0.5)).float()).item()})
+
+report = pd.DataFrame(rows).pivot(index="max_num_mut", columns="precision")
+for metric in ["mae", "coverage"]:
+    report[(metric, "delta")] = report[(metric, "int8")] - report[(metric, "fp32")]
+report = report.sort_index(axis=1)
+print(report.to_string(float_format="%.4f"))
+report.to_csv("quantization_report.csv")
@@ -0,0 +1,54 @@
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from signaturesnet import DATA
+from signaturesnet.modules.signet_module import SigNet
+from signaturesnet.utilities.result_cache import ResultCache
+
+# Refits the same input twice with an in-memory and with a SQLite result cache and checks that the outputs match
+# an uncached refit (up to float32 rounding, bit-exact with only_NNLS) and that the second call is only cache hits.
+# The SQLite cache is also reopened by a new SigNet, so that its hits come from the on-disk tier.
+
+# Load data (duplicated rows are refitted once and found in the cache by the other copies)
+example = pd.read_csv(DATA + "/datasets/example_input.csv", header=0, index_col=0)
+mutation_dataset = pd.concat([example, example.iloc[:5].rename(lambda name: name + "_copy")])
+print("data loaded")
+
+path = os.path.join(tempfile.mkdtemp(), "signet_cache.sqlite")
+caches = {"memory": lambda: ResultCache(max_entries=1000),
+          "sqlite": lambda: ResultCache(max_entries=1000, path=path)}
+
+expected = {only_NNLS: SigNet()(mutation_dataset, only_NNLS=only_NNLS).get_output(format="numpy")
+            for only_NNLS in [False, True]}
+
+def check(result, only_NNLS, hit_rate):
+    assert result.instrumentation.cache_hit_rate == hit_rate, (result.instrumentation.cache_hit_rate, hit_rate)
+    for expected_output, output in zip(expected[only_NNLS], result.get_output(format="numpy")):
+        if only_NNLS:
+            assert np.array_equal(output, expected_output, equal_nan=True)
+        else:
+            np.testing.assert_allclose(output, expected_output, rtol=0, atol=1e-6)
+
+for name, make_cache in caches.items():
+    for only_NNLS in [False, True]:
+        signet = SigNet(result_cache=make_cache())
+        first = signet(mutation_dataset, only_NNLS=only_NNLS, instrument=True)
+        repeat = signet(mutation_dataset, only_NNLS=only_NNLS, instrument=True)
+        check(first, only_NNLS, hit_rate=0.)
+        check(repeat, only_NNLS, hit_rate=1.)
+        routes = first.instrumentation.routes
+        print("%s%s: first call %i misses, repeat %s" % ("NNLS " if only_NNLS else "", name,
+                                                          routes["cache_misses"], dict(repeat.instrumentation.routes)))
+        signet.result_cache.close()
+
+for only_NNLS in [False, True]:
+    signet = SigNet(result_cache=caches["sqlite"]())
+    result = signet(mutation_dataset, only_NNLS=only_NNLS, instrument=True)
+    check(result, only_NNLS, hit_rate=1.)
+    assert result.instrumentation.routes["cache_disk_hits"] == mutation_dataset.shape[0]
+    print("%sreopened sqlite: %s" % ("NNLS " if only_NNLS else "", dict(result.instrumentation.routes)))
+    signet.result_cache.close()
+print("Cached outputs match")
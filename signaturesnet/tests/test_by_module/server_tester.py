@@ -0,0 +1,75 @@
+import asyncio
+import http.client
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from signaturesnet import DATA
+from signaturesnet.modules.signet_module import SigNet
+from signaturesnet.modules.signet_server import SigNetServer
+
+# Starts a SigNetServer on localhost, sends it many small concurrent requests and checks
+# that the micro-batched answers match running SigNet directly on each request.
+
+n_requests = 400
+n_clients = 32
+max_batch_size = 256
+max_latency_ms = 5
+
+# Load data
+example = pd.read_csv(DATA + "/datasets/example_input.csv", header=0, index_col=0)
+rng = np.random.default_rng(0)
+requests = [example.iloc[rng.choice(len(example), size=rng.integers(1, 5))] for _ in range(n_requests)]
+print("data loaded")
+
+signet = SigNet()
+requests = [request[signet.mutation_types] for request in requests]
+
+# Run the server in a background thread, on a free port
+server = SigNetServer(signet, max_batch_size=max_batch_size, max_latency_ms=max_latency_ms)
+loop = asyncio.new_event_loop()
+port = loop.run_until_complete(server.start(host="127.0.0.1", port=0)).sockets[0].getsockname()[1]
+threading.Thread(target=loop.run_forever, daemon=True).start()
+
+local = threading.local()
+def query(method, path, payload=None):
+    if not hasattr(local, "connection"):
+        local.connection = http.client.HTTPConnection("127.0.0.1", port)
+    body = json.dumps(payload) if payload is not None else None
+    local.connection.request(method, path, body=body, headers={"Content-Type": "application/json"})
+    response = local.connection.getresponse()
+    return response.status, json.loads(response.read())
+
+def refit(request):
+    status, response = query("POST", "/refit", {"counts": request.values.tolist(), "names": list(request.index)})
+    assert status == 200, response
+    return response
+
+st = time.time()
+with ThreadPoolExecutor(max_workers=n_clients) as clients:
+    responses = list(clients.map(refit, requests))
+et = time.time()
+n_samples = sum(len(request) for request in requests)
+print("%i requests (%i samples) from %i clients: %.2fs (%.0f requests/s)" %
+      (n_requests, n_samples, n_clients, et - st, n_requests/(et - st)))
+
+# Compare with direct (unbatched) SigNet calls
+max_diff = 0
+for request, response in zip(requests[:50], responses[:50]):
+    weights, lower, upper, classification, _ = signet(request).get_output()
+    served = np.array(response["weights"], dtype=float)
+    max_diff = max(max_diff, np.nanmax(np.abs(served - weights)))
+    assert (np.isnan(served) == np.isnan(weights)).all()
+    assert (np.isnan(np.array(response["lower"], dtype=float)) == np.isnan(lower)).all()
+print("Max abs difference wrt direct SigNet calls: %.2e" % max_diff)
+
+status, stats = query("GET", "/stats")
+print(json.dumps(stats, indent=2))
+
+asyncio.run_coroutine_threadsafe(server.stop(), loop).result()
+loop.call_soon_threadsafe(loop.stop)
+signet.close()
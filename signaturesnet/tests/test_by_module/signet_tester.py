@@ -38,11 +38,12 @@ result = signet(input_df, numpy=False)
 print("forwarded")
 
 finetuner_guess, lower_bound, upper_bound, classification, normalized_input = result.get_output(format="tensor")
+baseline_guess = signet(input_df, numpy=False, only_NNLS=True).get_output(format="tensor")[0]
 
 list_of_methods = ["decompTumor2Sig", "MutationalPatterns", "mutSignatures", "SignatureEstimationQP","YAPSA"]
 list_of_guesses, label = read_methods_guesses('cpu', "exp_all", list_of_methods, data_folder="../../../data/")
 list_of_methods += ['NNLS', 'Finetuner']
-list_of_guesses += [signet.baseline_guess, finetuner_guess[:,:-1]]
+list_of_guesses += [baseline_guess, finetuner_guess[:,:-1]]
 
 labels = torch.tensor(labels.values, dtype=torch.float)
 final_plot_all_metrics_vs_mutations(list_of_methods=list_of_methods,
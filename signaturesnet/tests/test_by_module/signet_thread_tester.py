@@ -0,0 +1,51 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from signaturesnet import DATA
+from signaturesnet.modules.signet_module import SigNet
+
+# Stress test of the SigNet threading contract: many threads call the same instance at once
+# (mixing lazy/eager NNLS, in-process/pool NNLS and batch sizes) and every result must match
+# running the same calls serially.
+
+n_calls = 200
+n_threads = 16
+
+# Load data
+example = pd.read_csv(DATA + "/datasets/example_input.csv", header=0, index_col=0)
+rng = np.random.default_rng(0)
+calls = []
+for i in range(n_calls):
+    batch = example.iloc[rng.choice(len(example), size=rng.integers(1, 50))]
+    counts = np.stack([rng.multinomial(rng.choice([50, 500, 5000, 50000]), row/row.sum()) for row in batch.values])
+    calls.append((pd.DataFrame(counts, columns=example.columns),
+                  {"lazy_nnls": bool(i % 2), "nworkers": 1 + 2*(i % 3 == 0), "num_threads": 1}))
+print("data loaded")
+
+signet = SigNet()
+
+def run(call):
+    mutation_dataset, kwargs = call
+    return signet(mutation_dataset, **kwargs).get_output()
+
+st = time.time()
+serial = [run(call) for call in calls]
+print("Serial: %.2fs" % (time.time() - st))
+
+st = time.time()
+with ThreadPoolExecutor(max_workers=n_threads) as executor:
+    concurrent = list(executor.map(run, calls))
+print("%i threads: %.2fs" % (n_threads, time.time() - st))
+
+max_diff = 0
+for serial_outputs, concurrent_outputs in zip(serial, concurrent):
+    for serial_output, concurrent_output in zip(serial_outputs, concurrent_outputs):
+        assert serial_output.shape == concurrent_output.shape
+        assert (np.isnan(serial_output) == np.isnan(concurrent_output)).all()
+        max_diff = max(max_diff, np.nanmax(np.abs(serial_output - concurrent_output), initial=0))
+print("Max abs difference between serial and concurrent calls: %.2e" % max_diff)
+assert max_diff == 0, "Concurrent calls do not match serial execution"
+signet.close()
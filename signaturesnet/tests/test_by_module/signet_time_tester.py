@@ -1,147 +1,185 @@
+import json
 import os
-
-import torch
+import platform
+import sys
 import time
+from argparse import ArgumentParser
+
 import numpy as np
 import pandas as pd
+import torch
 
-from signaturesnet import DATA, TRAINED_MODELS
-from signaturesnet.models.baseline import Baseline
-from signaturesnet.modules.combined_finetuner import CombinedFinetuner
-from signaturesnet.utilities.io import csv_to_tensor, read_model, read_signatures
-
-# Read data
-
-# Load data
-data_path = "../../../data/exp_all/"
-inputs = csv_to_tensor(data_path + "test_input.csv", device='cpu')
-labels = csv_to_tensor(data_path + "test_label.csv", device='cpu')
-num_mut = labels[:, -1].unique()
-print("data loaded")
-
-# Paths
-signatures_path = os.path.join(DATA, "data.xlsx")
-mutation_type_order = os.path.join(DATA, "mutation_type_order.xlsx")
-finetuner_realistic_low = os.path.join(TRAINED_MODELS, "finetuner_low")
-finetuner_realistic_large = os.path.join(TRAINED_MODELS, "finetuner_large")
-classifier = os.path.join(TRAINED_MODELS, "detector")
-errorfinder = os.path.join(TRAINED_MODELS, "errorfinder")
-
-# Load models
-signatures = read_signatures(file=signatures_path,
-                             mutation_type_order=mutation_type_order)
-baseline = Baseline(signatures)
-finetuner = CombinedFinetuner(low_mum_mut_dir=finetuner_realistic_low,
-                                      large_mum_mut_dir=finetuner_realistic_large)
-classifier = read_model(classifier)
-errorfinder = read_model(errorfinder)
-
-list_of_inputs = []
-for mut in num_mut:
-    list_of_inputs.append(inputs[labels[:, -1] == mut, :])
-
-# Functions
-def join_and_sort(low, large, ind_order):
-        joined = torch.cat((low, large), dim=0)
-        joined = torch.cat((joined, ind_order), dim=1)
-        joined = joined[joined[:, -1].sort()[1]]
-        return joined[:, :-1]
-
-def apply_cutoff(comb, cutoff):
-        mask = (comb > cutoff).type(torch.int).float()
-        comb = comb*mask
-        comb = torch.cat((comb, torch.ones_like(torch.sum(
-        comb, axis=1).reshape((-1, 1)))-torch.sum(
-        comb, axis=1).reshape((-1, 1))), axis=1)
-        return comb
-
-def separate_classification(classification, mutation_dist, baseline_guess, num_mut):
-    classification_cutoff = 0.5
-    ind = torch.tensor(range(classification.size()[0]))
-    ind_order = torch.tensor(np.concatenate((ind[classification <= classification_cutoff], ind[classification > classification_cutoff]))).reshape(-1, 1).to(torch.float).to('cpu')
-    
-    input_batch_random = mutation_dist[classification <= classification_cutoff, ]
-    input_batch_realistic = mutation_dist[classification > classification_cutoff, ]
-    num_mut_realistic = num_mut[classification > classification_cutoff, ]
-    classification_realistic = classification[classification > classification_cutoff, ]
-
-    baseline_guess_random = baseline_guess[classification <= classification_cutoff, ]
-    baseline_guess_realistic = baseline_guess[classification > classification_cutoff, ]
-
-    baseline_guess_random = baseline_guess_random/torch.sum(baseline_guess_random, dim=1).reshape(-1,1)
-    
-    return input_batch_realistic, input_batch_random, baseline_guess_random, baseline_guess_realistic, num_mut_realistic, classification_realistic, ind_order
-
-
-replicates = 5
-times_baseline = np.zeros((replicates, len(num_mut)))
-times_classifier = np.zeros((replicates, len(num_mut)))
-times_finetuner = np.zeros((replicates, len(num_mut)))
-times_errorfinder = np.zeros((replicates, len(num_mut)))
-times_total = np.zeros((replicates, len(num_mut)))
-for i,input in enumerate(list_of_inputs):
-    for k in range(replicates):
-        st_total = time.time()
-        st = time.time()
-        baseline_guess = baseline.get_weights_batch(input_batch=input, 
-                                                    n_workers=1)
-        et = time.time()
-        times_baseline[k, i] = (et-st)/baseline_guess.size(dim=0)                                                                
-        
-        st = time.time()
-        num_muts_i = num_mut[i].repeat(input.size(dim=0),1)
-        classification = classifier(mutation_dist=input,
-                                    num_mut=num_muts_i).view(-1)
-        et = time.time()
-        times_classifier[k, i] = (et-st)/classification.size(dim=0)     
-
-        mutation_dist_realistic, mutation_dist_random, baseline_guess_random, baseline_guess_realistic, num_mut_realistic, classification_realistic, ind_order = separate_classification(classification, input, baseline_guess, num_muts_i)
-
-        st = time.time()
-        finetuner_guess_realistic = finetuner(mutation_dist=mutation_dist_realistic,
-                                         baseline_guess = baseline_guess_realistic,
-                                         num_mut=num_mut_realistic)
-
-        baseline_guess_random = apply_cutoff(baseline_guess_random, 0.01)
-        finetuner_guess = join_and_sort(finetuner_guess_realistic, baseline_guess_random, ind_order)
-        et = time.time()
-        times_finetuner[k, i] = (et-st)/finetuner_guess.size(dim=0) 
-
-        st = time.time()
-        upper, lower = errorfinder(weights=finetuner_guess_realistic[:,:-1],
-                                           num_mutations=num_mut_realistic,
-                                           classification=classification_realistic.reshape(-1, 1))
-
-        upper = join_and_sort(upper, torch.full_like(baseline_guess_random[:,:-1], float('nan')), ind_order)
-        lower = join_and_sort(lower, torch.full_like(baseline_guess_random[:,:-1], float('nan')), ind_order)
-        et = time.time()
-        times_errorfinder[k, i] = (et-st)/lower.size(dim=0)  
-
-        et_total = time.time()
-        times_total[k, i] = (et_total-st_total)/input.size(dim=0) 
-
-
-times_df = pd.DataFrame(times_baseline)
-times_df.columns = num_mut.tolist()
-times_df.loc['mean'] = times_df.mean()
-times_df.to_csv('baseline_times.txt', index=False)
-
-times_df = pd.DataFrame(times_classifier)
-times_df.columns = num_mut.tolist()
-times_df.loc['mean'] = times_df.mean()
-times_df.to_csv('classifier_times.txt', index=False)
-
-times_df = pd.DataFrame(times_finetuner)
-times_df.columns = num_mut.tolist()
-times_df.loc['mean'] = times_df.mean()
-times_df.to_csv('finetuner_times.txt', index=False)
-
-times_df = pd.DataFrame(times_errorfinder)
-times_df.columns = num_mut.tolist()
-times_df.loc['mean'] = times_df.mean()
-times_df.to_csv('errorfinder_times.txt', index=False)
-
-times_df = pd.DataFrame(times_total)
-times_df.columns = num_mut.tolist()
-times_df.loc['mean'] = times_df.mean()
-times_df.to_csv('total_times.txt', index=False)
+import signaturesnet
+from signaturesnet.modules.signet_module import SigNet
+from signaturesnet.utilities.data_generator import DataGenerator
+
+# Benchmark suite of the SigNet refitter.
+# Synthetic inputs are sampled with DataGenerator at each number of mutations (+-10%, see DataGenerator.make_input)
+# and refitted through the public SigNet API with batches of each size. Per-stage times come from
+# SigNet(..., instrument=True). Results are written to a json file, which can be used as --baseline of a later
+# run: the script then reports the ratio of times wrt the baseline and exits with status 1 on regressions.
+#
+#   python signet_time_tester.py --output before.json
+#   (change the code)
+#   python signet_time_tester.py --output after.json --baseline before.json
+
+
+def parse_args():
+    parser = ArgumentParser()
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 32, 1024, 8192],
+                        help='Num of samples per SigNet call')
+    parser.add_argument('--num_muts', type=int, nargs='+', default=[25, 100, 1000, 10000, 100000],
+                        help='Num of mutations of each bin. A "mixed" bin with all of them is also run')
+    parser.add_argument('--pool_size', type=int, default=1024,
+                        help='Num of samples generated per bin (larger batches resample them)')
+    parser.add_argument('--replicates', type=int, default=5, help='Min num of timed calls per configuration')
+    parser.add_argument('--min_time', type=float, default=0.5,
+                        help='Keep timing calls of a configuration until they add up to this many seconds')
+    parser.add_argument('--warmup', type=int, default=1, help='Untimed calls per configuration')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--generator', type=str, default=None,
+                        help='Trained generator to sample realistic labels from. Default: random signature combinations')
+    parser.add_argument('--bundle', type=str, default=None, help='SigNet bundle to load the models from')
+    parser.add_argument('--inference_engine', type=str, default="eager")
+    parser.add_argument('--precision', type=str, default="fp32")
+    parser.add_argument('--nnls_engine', type=str, default="scipy")
+    parser.add_argument('--nworkers', type=int, default=1)
+    parser.add_argument('--num_threads', type=int, default=1, help='Torch intra-op threads')
+    parser.add_argument('--output', type=str, default="signet_benchmark.json")
+    parser.add_argument('--baseline', type=str, default=None, help='Results json of a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Relative slowdown wrt the baseline reported as a regression')
+    return parser.parse_args()
+
+
+def random_labels(num_samples, num_sigs, max_n_signatures=10, min_weight=0.1):
+    """Random combinations of 1 to max_n_signatures signatures (as in DataGenerator.make_random_set)
+    """
+    labels = torch.zeros((num_samples, num_sigs))
+    for i in range(num_samples):
+        signature_ids = torch.randperm(num_sigs)[:np.random.randint(1, max_n_signatures + 1)]
+        weights = torch.rand(size=(signature_ids.size(0),))
+        weights = weights/torch.sum(weights)
+        weights[weights < min_weight] = 0
+        labels[i, signature_ids] = weights/torch.sum(weights)
+    return labels
+
+
+def make_inputs(signet, num_muts, pool_size, seed, generator=None):
+    """Mutation counts of pool_size synthetic samples around each number of mutations
+
+    Returns:
+        dict num_mut -> pd.DataFrame(pool_size, 96) with signet.mutation_types columns
+    """
+    data_generator = DataGenerator(signet.signatures, seed=seed)
+    inputs = {}
+    for num_mut in num_muts:
+        if generator is not None:
+            from signaturesnet.utilities.io import read_model
+            labels = read_model(generator, device="cpu").generate(pool_size, std=1.0)
+        else:
+            labels = random_labels(pool_size, signet.signatures.shape[1])
+        mutation_dist, labels = data_generator.make_input(labels, split="test", large_low="low",
+                                                          nummuts=torch.full((pool_size,), float(num_mut)))
+        counts = torch.round(mutation_dist*labels[:, -1:]).numpy()
+        inputs[num_mut] = pd.DataFrame(counts, columns=signet.mutation_types,
+                                       index=["%i_%i" % (num_mut, i) for i in range(pool_size)])
+    inputs["mixed"] = pd.concat([inputs[num_mut] for num_mut in num_muts])
+    return inputs
+
+
+def run_benchmark(signet, inputs, batch_sizes, replicates, warmup, seed, min_time=0., **kwargs):
+    """Time SigNet on batches of each size drawn from each bin of inputs (at least replicates calls and
+    min_time seconds per configuration, after warmup calls)
+
+    Returns:
+        list of dicts (one per bin and batch size) with the median seconds of the call and of each stage,
+        the samples/s and the samples of each route
+    """
+    rng = np.random.default_rng(seed)
+    results = []
+    for num_mut, pool in inputs.items():
+        for batch_size in batch_sizes:
+            times, stages = [], []
+            k = 0
+            while k < warmup + replicates or sum(times) < min_time:
+                batch = pool.iloc[rng.choice(pool.shape[0], size=batch_size, replace=batch_size > pool.shape[0])]
+                st = time.perf_counter()
+                result = signet(batch, instrument=True, **kwargs)
+                et = time.perf_counter()
+                if k >= warmup:
+                    times.append(et - st)
+                    stages.append({name: record["seconds"] for name, record in result.instrumentation.stages.items()})
+                k += 1
+            seconds = {"total": float(np.median(times))}
+            seconds.update({name: float(np.median([s.get(name, 0.) for s in stages])) for name in stages[-1]})
+            results.append({"num_mut": str(num_mut),
+                            "batch_size": batch_size,
+                            "samples_per_s": batch_size/seconds["total"],
+                            "calls": len(times),
+                            "seconds": seconds,
+                            "routes": dict(result.instrumentation.routes)})
+            print("num_mut %s, batch %i: %.1f samples/s" % (num_mut, batch_size, results[-1]["samples_per_s"]))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Ratio of the median call (and stage) times wrt the baseline for each configuration in both
+
+    Returns:
+        pd.DataFrame, one row per bin and batch size, with a regression column (total ratio > 1 + tolerance)
+    """
+    baseline = {(r["num_mut"], r["batch_size"]): r for r in baseline["results"]}
+    rows = []
+    for r in results:
+        key = (r["num_mut"], r["batch_size"])
+        if key not in baseline:
+            continue
+        row = {"num_mut": key[0], "batch_size": key[1]}
+        for name, seconds in r["seconds"].items():
+            base = baseline[key]["seconds"].get(name)
+            if base:
+                row[name] = seconds/base
+        row["regression"] = row["total"] > 1 + tolerance
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    torch.set_num_threads(args.num_threads)
+    if args.bundle is not None:
+        signet = SigNet.from_bundle(args.bundle, nnls_engine=args.nnls_engine,
+                                    inference_engine=args.inference_engine, precision=args.precision)
+    else:
+        signet = SigNet(nnls_engine=args.nnls_engine, inference_engine=args.inference_engine, precision=args.precision)
+
+    inputs = make_inputs(signet, args.num_muts, args.pool_size, args.seed, generator=args.generator)
+    print("data generated")
+    with signet:
+        results = run_benchmark(signet, inputs, args.batch_sizes, args.replicates, args.warmup, args.seed,
+                                min_time=args.min_time, nworkers=args.nworkers)
+
+    benchmark = {"metadata": {"signaturesnet": signaturesnet.__version__,
+                              "torch": torch.__version__,
+                              "python": platform.python_version(),
+                              "machine": platform.machine(),
+                              "processor": platform.processor(),
+                              "cpu_count": os.cpu_count(),
+                              "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                              "config": vars(args)},
+                 "results": results}
+    with open(args.output, "w") as f:
+        json.dump(benchmark, f, indent=2)
+    print("Results written to %s" % args.output)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report = compare(results, baseline, args.tolerance)
+        print("Time ratio wrt %s (> 1 is slower):" % args.baseline)
+        print(report.to_string(index=False, float_format="%.2f"))
+        if report["regression"].any():
+            print("REGRESSION: %i configurations are more than %i%% slower" %
+                  (report["regression"].sum(), 100*args.tolerance))
+            sys.exit(1)
@@ -0,0 +1,39 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+from signaturesnet import DATA
+from signaturesnet.modules.signet_module import SigNet
+
+# Memory of dense vs sparse SigNetResults (and check that both give the same outputs).
+# Inputs are multinomial resamplings of the example PCAWG profiles at different numbers of mutations.
+
+n_samples = 20000
+num_muts = [25, 100, 1000, 10000, 100000]
+
+# Load data
+example = pd.read_csv(DATA + "/datasets/example_input.csv", header=0, index_col=0)
+profiles = example.values/example.values.sum(axis=1, keepdims=True)
+rng = np.random.default_rng(0)
+counts = np.stack([rng.multinomial(num_muts[i % len(num_muts)], profiles[i % len(profiles)])
+                   for i in range(n_samples)])
+mutation_dataset = pd.DataFrame(counts, columns=example.columns, index=["sample_%i" % i for i in range(n_samples)])
+print("data loaded")
+print("Input counts: %.1f MB" % (mutation_dataset.memory_usage(index=False).sum()/1e6))
+
+signet = SigNet()
+for only_NNLS in [False, True]:
+    results = {}
+    for sparse in [False, True]:
+        st = time.time()
+        results[sparse] = signet(mutation_dataset, nworkers=8, only_NNLS=only_NNLS, sparse=sparse)
+        print("%s%s: %.1f MB (%.2fs)" % ("NNLS " if only_NNLS else "", "sparse" if sparse else "dense",
+                                       results[sparse].memory_usage()/1e6, time.time() - st))
+
+    weights = results[True].get_output(format="sparse")[0]
+    print("Non-zero weights per sample: %.1f / %i" % (weights.nnz/weights.shape[0], weights.shape[1]))
+    for dense_output, sparse_output in zip(results[False].get_output(), results[True].get_output()):
+        assert np.array_equal(dense_output, sparse_output, equal_nan=True)
+    print("Dense and sparse outputs match")
+signet.close()
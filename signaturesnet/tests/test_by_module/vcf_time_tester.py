@@ -0,0 +1,112 @@
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import pysam
+
+from signaturesnet.utilities.VCF_to_counts import VCF_to_counts
+
+# Time of VCF ingestion (VCF_to_counts) fetching the reference once per variant or once per chromosome
+# (batched, optionally by windows), of a folder of per-sample VCFs read by pools of different sizes and of
+# a single bgzipped and indexed VCF split into regions read by pools of different sizes, and of a multi-sample
+# VCF counted per sample (per_sample=True).
+# Data is synthetic: a random reference and VCFs with SNVs at random positions, written to a temporary folder.
+
+chrom_lengths = {"chr1": 5000000, "chr2": 3000000, "chr3": 1000000}
+n_variants = 200000
+window_sizes = [None, 1000000, 100000]
+n_files = 500
+n_workers = [1, 2, 4, 8]
+region_size = 1000000
+n_samples = 200
+n_cohort_variants = 20000
+replicates = 3
+
+rng = np.random.default_rng(0)
+folder = tempfile.mkdtemp()
+reference = os.path.join(folder, "reference.fa")
+with open(reference, "w") as f:
+    for chrom, length in chrom_lengths.items():
+        seq = np.array(list("ACGT"))[rng.integers(0, 4, size=length)]
+        f.write(">%s\n%s\n" % (chrom, "\n".join("".join(seq[i:i + 60]) for i in range(0, length, 60))))
+pysam.faidx(reference)
+
+genome = pysam.FastaFile(reference)
+
+
+def write_vcf(path, n_variants):
+    with open(path, "w") as f:
+        f.write("##fileformat=VCFv4.2\n")
+        for chrom, length in chrom_lengths.items():
+            f.write("##contig=<ID=%s,length=%i>\n" % (chrom, length))
+        f.write("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n")
+        for chrom, length in chrom_lengths.items():
+            n = n_variants*length//sum(chrom_lengths.values())
+            for pos in np.sort(rng.choice(np.arange(2, length), size=n, replace=False)):
+                ref = genome.fetch(chrom, pos - 1, pos)
+                alt = "ACGT"[("ACGT".index(ref) + rng.integers(1, 4)) % 4]
+                f.write("%s\t%i\t.\t%s\t%s\t.\tPASS\t.\n" % (chrom, pos, ref, alt))
+
+
+vcf = os.path.join(folder, "sample.vcf")
+write_vcf(vcf, n_variants)
+indexed_vcf = pysam.tabix_index(vcf, preset="vcf", keep_original=True)
+vcf_folder = os.path.join(folder, "samples")
+os.makedirs(vcf_folder)
+for i in range(n_files):
+    write_vcf(os.path.join(vcf_folder, "sample_%i.vcf" % i), n_variants//n_files)
+cohort_vcf = os.path.join(folder, "cohort.vcf")
+with open(cohort_vcf, "w") as f:
+    f.write("##fileformat=VCFv4.2\n")
+    f.write('##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n')
+    for chrom, length in chrom_lengths.items():
+        f.write("##contig=<ID=%s,length=%i>\n" % (chrom, length))
+    f.write("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t%s\n" %
+            "\t".join("sample_%i" % j for j in range(n_samples)))
+    for chrom, length in chrom_lengths.items():
+        n = n_cohort_variants*length//sum(chrom_lengths.values())
+        for pos in np.sort(rng.choice(np.arange(2, length), size=n, replace=False)):
+            ref = genome.fetch(chrom, pos - 1, pos)
+            alt = "ACGT"[("ACGT".index(ref) + rng.integers(1, 4)) % 4]
+            genotypes = rng.choice(["0/0", "0/1", "1/1", "./."], size=n_samples, p=[0.9, 0.06, 0.02, 0.02])
+            f.write("%s\t%i\t.\t%s\t%s\t.\tPASS\t.\tGT\t%s\n" % (chrom, pos, ref, alt, "\t".join(genotypes)))
+indexed_cohort_vcf = pysam.tabix_index(cohort_vcf, preset="vcf", keep_original=True)
+print("data generated in %s" % folder)
+
+
+def run(path, **kwargs):
+    times = []
+    for k in range(replicates):
+        st = time.time()
+        counts = VCF_to_counts(path, reference, **kwargs)
+        times.append(time.time() - st)
+    return counts, np.median(times)
+
+expected, seconds = run(vcf, batched=False)
+print("per variant: %.2fs (%.0f variants/s)" % (seconds, n_variants/seconds))
+for window_size in window_sizes:
+    counts, seconds = run(vcf, batched=True, window_size=window_size)
+    pd.testing.assert_frame_equal(counts, expected)
+    print("batched, window_size %s: %.2fs (%.0f variants/s)" % (window_size, seconds, n_variants/seconds))
+
+expected, _ = run(vcf_folder, n_workers=1)
+for workers in n_workers:
+    counts, seconds = run(vcf_folder, n_workers=workers)
+    pd.testing.assert_frame_equal(counts, expected)
+    print("%i files, n_workers %i: %.2fs (%.0f files/s)" % (n_files, workers, seconds, n_files/seconds))
+
+expected, _ = run(indexed_vcf, n_workers=1)
+for workers in n_workers[1:]:
+    counts, seconds = run(indexed_vcf, n_workers=workers, region_size=region_size)
+    pd.testing.assert_frame_equal(counts, expected)
+    print("indexed VCF, n_workers %i: %.2fs (%.0f variants/s)" % (workers, seconds, n_variants/seconds))
+
+expected, seconds = run(cohort_vcf, per_sample=True)
+print("%i samples VCF, per_sample: %.2fs (%.0f variants/s)" % (n_samples, seconds, n_cohort_variants/seconds))
+for workers in n_workers[1:]:
+    counts, seconds = run(indexed_cohort_vcf, per_sample=True, n_workers=workers, region_size=region_size)
+    pd.testing.assert_frame_equal(counts, expected)
+    print("%i samples indexed VCF, per_sample, n_workers %i: %.2fs (%.0f variants/s)" %
+          (n_samples, workers, seconds, n_cohort_variants/seconds))
@@ -1,11 +1,15 @@
+import functools
+import logging
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
 import pandas as pd
 from pathlib import Path
 import pysam
-from collections import Counter
-import genomepy
 
 from signaturesnet import DATA
+from signaturesnet.utilities.catalog import load_catalog
 
 
 def complement(base):
@@ -18,44 +22,197 @@ def complement(base):
     if base == "T":
         return "A"
 
-# https://www.biostars.org/p/334253/
-def VCF_to_counts(vcf_path, reference_genome):
+# Integer code of each base (upper or lower case), 4 for anything else
+_BASE_CODES = np.full(256, 4, dtype=np.int64)
+for _code, _bases in enumerate(["Aa", "Cc", "Gg", "Tt"]):
+    for _base in _bases:
+        _BASE_CODES[ord(_base)] = _code
+_COMPLEMENT_CODES = np.array([3, 2, 1, 0])
 
-    isFile = os.path.isfile(vcf_path)
+# Consecutive positions further apart than this are fetched separately: skipping the gap is cheaper than reading it
+_MAX_FETCH_GAP = 10000
 
-    if isFile == True:
-        list_of_files = [vcf_path]
-    else:
-        list_of_files = os.listdir(vcf_path)
-        list_of_files = [vcf_path + '/' + file for file in list_of_files]
-    # open fasta file
+_worker_genome = None
+
+
+def mutation_type_lookup(mutation_types):
+    """Lookup table from the code of a (5' base, REF, ALT, 3' base) context to its mutation type index,
+    where both strands of a type (e.g. A[C>T]G and C[G>A]T) map to the same index
+
+    Args:
+        mutation_types (list): Mutation types X[Y>Z]W
+
+    Returns:
+        np.array(625): Index in mutation_types of each context code (see _context_codes), -1 if none
+    """
+    lookup = np.full(5**4, -1, dtype=np.int64)
+    for i, mutation_type in enumerate(mutation_types):
+        bases = _BASE_CODES[[ord(mutation_type[j]) for j in (0, 2, 4, 6)]]
+        reverse = _COMPLEMENT_CODES[bases[[3, 1, 2, 0]]]   # W'[Y'>Z']X'
+        for left, ref, alt, right in (bases, reverse):
+            lookup[((left*5 + ref)*5 + alt)*5 + right] = i
+    return lookup
+
+
+@functools.lru_cache(maxsize=8)
+def _cached_mutation_type_lookup(mutation_types):
+    return mutation_type_lookup(mutation_types)
+
+
+def _context_codes(contexts):
+    """Code of each context of a byte string made of 4-letter contexts (5' base, REF, ALT, 3' base)
+    (or of an np.array(n, 4) of their ASCII codes)
+    """
+    if not isinstance(contexts, np.ndarray):
+        contexts = np.frombuffer(contexts, dtype=np.uint8)
+    bases = _BASE_CODES[contexts].reshape(-1, 4)
+    return ((bases[:, 0]*5 + bases[:, 1])*5 + bases[:, 2])*5 + bases[:, 3]
+
+
+def count_mutation_types(contexts, mutation_types):
+    """Count the SNVs of each mutation type (strand collapsed)
+
+    Args:
+        contexts (bytes): Concatenated 4-letter contexts (5' base, REF, ALT, 3' base), any case
+            (flank of 1 base), or np.array(n, 4) of their ASCII codes (see snv_contexts).
+            Contexts with other letters (e.g. N) are not counted.
+        mutation_types (list): Mutation types X[Y>Z]W
+
+    Returns:
+        np.array(len(mutation_types)) of int64
+    """
+    indices = mutation_type_indices(contexts, mutation_types)
+    return np.bincount(indices[indices >= 0], minlength=len(mutation_types))
+
+
+def mutation_type_indices(contexts, mutation_types):
+    """Index in mutation_types of each context (see count_mutation_types), -1 for the ones not counted
+    """
+    return _cached_mutation_type_lookup(tuple(mutation_types))[_context_codes(contexts)]
+
+
+def reference_name(chrom):
+    # We need to check that 'chr' is contained in the chromosome, otherwise it doesn't work.
+    chrom = str(chrom)
+    return chrom if 'chr' in chrom else 'chr' + chrom
+
+
+def flanking_bases(genome, chroms, positions, window_size=None):
+    """5' and 3' bases of each position, reading the reference once per chromosome (or per window of it)
+    instead of once per variant
+
+    Positions are sorted within each chromosome and the reference spanning each run of them (split where
+    two positions are more than _MAX_FETCH_GAP bases apart) is fetched at once, then the flanks of all the
+    positions are taken from it by indexing.
+
+    Args:
+        genome (pysam.FastaFile): Reference genome
+        chroms (list): Reference name of each position (see reference_name)
+        positions (list): 0-based positions
+        window_size (int, optional): Max num of bases read at a time (bounds the memory on large
+            chromosomes). Windows without positions are not read. Default: whole chromosome
+
+    Returns:
+        np.array(n, 2) of uint8: ASCII codes of the 5' and 3' bases. N for the positions on the first
+            or last base of the chromosome (or beyond), which have no trinucleotide context
+    """
+    chroms = np.asarray(chroms, dtype=object)
+    positions = np.asarray(positions, dtype=np.int64)
+    flanks = np.full((len(positions), 2), ord('N'), dtype=np.uint8)
+    for chrom in pd.unique(chroms):
+        rows = np.flatnonzero(chroms == chrom)
+        rows = rows[np.argsort(positions[rows], kind='stable')]
+        length = genome.get_reference_length(chrom)
+        rows = rows[(positions[rows] >= 1) & (positions[rows] + 1 < length)]
+        if len(rows) == 0:
+            continue
+        pos = positions[rows]
+        window = window_size if window_size is not None else length
+        breaks = (np.diff(pos//window) != 0) | (np.diff(pos) > _MAX_FETCH_GAP)
+        starts = np.concatenate(([0], np.flatnonzero(breaks) + 1, [len(pos)]))
+        for first, last in zip(starts[:-1], starts[1:]):
+            start, end = pos[first] - 1, pos[last - 1] + 2
+            seq = np.frombuffer(genome.fetch(chrom, start, end).encode('ascii', 'replace'), dtype=np.uint8)
+            flanks[rows[first:last], 0] = seq[pos[first:last] - 1 - start]
+            flanks[rows[first:last], 1] = seq[pos[first:last] + 1 - start]
+    return flanks
+
+
+def snv_contexts(genome, chroms, positions, refs, alts, window_size=None):
+    """Contexts (5' base, REF, ALT, 3' base) of SNVs, see flanking_bases and count_mutation_types
+
+    Args:
+        refs, alts (list): Single-base REF and ALT of each SNV
+
+    Returns:
+        np.array(n, 4) of uint8
+    """
+    contexts = np.empty((len(positions), 4), dtype=np.uint8)
+    contexts[:, [0, 3]] = flanking_bases(genome, chroms, positions, window_size=window_size)
+    contexts[:, 1] = np.frombuffer(''.join(refs).encode('ascii', 'replace'), dtype=np.uint8)
+    contexts[:, 2] = np.frombuffer(''.join(alts).encode('ascii', 'replace'), dtype=np.uint8)
+    return contexts
+
+
+def reference_path(reference_genome):
+    """Path of the reference genome FASTA, which can also be the name of a genome in DATA/genomes (it is
+    downloaded from UCSC with genomepy if it is not there yet)
+    """
     if reference_genome == None:
         print("ERROR: You should provide a name or path to the reference genome of your data!")
         exit()
-    else:
+    for path in [reference_genome, DATA+'/genomes/'+reference_genome+'/'+reference_genome+'.fa']:
         try:
-            genome = pysam.FastaFile(reference_genome)
+            pysam.FastaFile(path).close()
+            return path
         except:
-            try:
-                genome = pysam.FastaFile(DATA+'/genomes/'+reference_genome+'/'+reference_genome+'.fa')
-            except:
-                genomepy.install_genome(reference_genome,provider='UCSC',genomes_dir=DATA+'/genomes')
-                genome = pysam.FastaFile(DATA+'/genomes/'+reference_genome+'/'+reference_genome+'.fa')
-    mutation_type_order=os.path.join(DATA, "mutation_type_order.xlsx")
-    mutation_order = pd.read_excel(mutation_type_order)
-    final_df = pd.DataFrame(columns=mutation_order['Type'])
-    for file in list_of_files:
-        # open vcf file
-        save = pysam.set_verbosity(0)
-        vcf = pysam.VariantFile(file)
-        pysam.set_verbosity(save)
-        file_name = Path(file).stem
-        # define by how many bases the variant should be flanked
-        flank = 1
-        # iterate over each variant
-        list_of_mutations = []
-        record_count = 0
-        for record in vcf:
+            pass
+    import genomepy
+    genomepy.install_genome(reference_genome,provider='UCSC',genomes_dir=DATA+'/genomes')
+    return DATA+'/genomes/'+reference_genome+'/'+reference_genome+'.fa'
+
+
+# https://www.biostars.org/p/334253/
+def vcf_file_counts(file, genome, mutation_types, batched=True, window_size=None, region=None):
+    """Mutation counts of a VCF file (see VCF_to_counts)
+
+    Args:
+        file (str): VCF file
+        genome (pysam.FastaFile): Reference genome
+        mutation_types (list): Mutation types X[Y>Z]W, in the order of the counts
+        region (tuple, optional): (contig, start, end), 0-based and end excluded (None for the end of the
+            contig). Only count the variants starting in it, read through the index of the VCF (see vcf_regions)
+
+    Returns:
+        np.array(len(mutation_types)) of int64
+    """
+    # open vcf file
+    save = pysam.set_verbosity(0)
+    vcf = pysam.VariantFile(file)
+    pysam.set_verbosity(save)
+    records = vcf
+    if region is not None:
+        # fetch() also returns the variants overlapping the start of the region, which belong to the previous one
+        records = (record for record in vcf.fetch(*region) if record.start >= region[1])
+    # define by how many bases the variant should be flanked
+    flank = 1
+    # iterate over each variant
+    if batched:
+        chroms, positions, refs, alts = [], [], [], []
+        for record in records:
+            # Keep the SNVs, the rest don't have a mutation type. pos is 1-based
+            alt = record.alts[0]
+            if len(record.ref) == 1 and len(alt) == 1:
+                chroms.append(record.chrom)
+                positions.append(record.pos - 1)
+                refs.append(record.ref)
+                alts.append(alt)
+        names = {chrom: reference_name(chrom) for chrom in set(chroms)}
+        contexts = snv_contexts(genome, [names[chrom] for chrom in chroms], positions, refs, alts,
+                                window_size=window_size)
+    else:
+        contexts = []
+        for record in records:
             # extract sequence
             #
             # The start position is calculated by subtract the number of bases
@@ -66,7 +223,7 @@ def VCF_to_counts(vcf_path, reference_genome):
             # The end position is calculated by adding the number of bases
             # given by 'flank' to the variant position. We also need to add the length
             # of the REF value and subtract again 1 due to the 0-based/1-based thing.
-            # 
+            #
             # We need to check that 'chr' is contained in the chromosome, otherwise it doesn't work.
             if 'chr' not in record.chrom:
                 chr = 'chr' + record.chrom
@@ -75,23 +232,248 @@ def VCF_to_counts(vcf_path, reference_genome):
             # Now we have the complete sequence like this:
             # [number of bases given by flank]+REF+[number of bases given by flank]
             seq = genome.fetch(chr, record.pos-1-flank, record.pos-1+len(record.ref)+flank)
-            # print out tab seperated columns:
-            # CRHOM, POS, REF, ALT, flanking sequencing with variant given in the format '[REF/ALT]'
-            mutation = '{}[{}>{}]{}'.format(seq[:flank].upper(), record.ref.upper(), record.alts[0].upper(), seq[flank+len(record.ref):].upper())
-            list_of_mutations.append(mutation)
-        # Now we count the number of times each mutation type is present in the list
-        counts = Counter(list_of_mutations)
-        # Filter and sort based on the mutation categories. 
-        muts_sorted = []
-        for mutation_type in mutation_order['Type']:
-            mutation_type_rev = complement(mutation_type[6])+'['+complement(mutation_type[2])+'>'+complement(mutation_type[4])+']'+complement(mutation_type[0])
-            muts_sorted.append(counts[mutation_type]+counts[mutation_type_rev])
-        file_dict = {mutation_order.loc[i, 'Type']: [muts_sorted[i]] for i in range(len(mutation_order))}
-        file_df = pd.DataFrame(file_dict, index = [file_name])
-        final_df = pd.concat((final_df, file_df))
-    return final_df
-
-def bed_to_counts(bed_path, reference_genome_path):
+            # Keep the context (5' base, REF, ALT, 3' base) of SNVs, the rest don't have a mutation type
+            alt = record.alts[0]
+            if len(record.ref) == 1 and len(alt) == 1 and len(seq) == 3:
+                contexts.append(seq[0] + record.ref + alt + seq[2])
+        contexts = ''.join(contexts).encode('ascii', 'replace')
+    vcf.close()
+    # Count the number of times each mutation type (or its reverse complement) is present,
+    # sorted based on the mutation categories
+    return count_mutation_types(contexts, mutation_types)
+
+
+def _add_sample_counts(counts, genome, mutation_types, snvs, carrier_snvs, carrier_samples, window_size):
+    chroms, positions, refs, alts = snvs
+    names = {chrom: reference_name(chrom) for chrom in set(chroms)}
+    contexts = snv_contexts(genome, [names[chrom] for chrom in chroms], positions, refs, alts, window_size=window_size)
+    types = mutation_type_indices(contexts, mutation_types)[np.asarray(carrier_snvs, dtype=np.int64)]
+    samples = np.asarray(carrier_samples, dtype=np.int64)[types >= 0]
+    counts += np.bincount(samples*counts.shape[1] + types[types >= 0], minlength=counts.size).reshape(counts.shape)
+
+
+def vcf_sample_counts(file, genome, mutation_types, window_size=None, region=None, chunk_size=100000):
+    """Mutation counts of each sample of a multi-sample VCF file, read in a single pass
+    (see VCF_to_counts(per_sample=True))
+
+    A sample carries an ALT allele when its genotype (GT) has it, missing alleles don't count. Each SNV ALT
+    of a multiallelic variant counts for its own carriers.
+
+    Args:
+        file (str): VCF file with genotypes
+        genome (pysam.FastaFile): Reference genome
+        mutation_types (list): Mutation types X[Y>Z]W, in the order of the counts
+        window_size, region: see vcf_file_counts
+        chunk_size (int): Num of SNV alleles whose contexts are looked up at a time (bounds the memory)
+
+    Returns:
+        list of sample names, np.array(n_samples, len(mutation_types)) of int64
+    """
+    save = pysam.set_verbosity(0)
+    vcf = pysam.VariantFile(file)
+    pysam.set_verbosity(save)
+    samples = list(vcf.header.samples)
+    assert len(samples) > 0 and 'GT' in vcf.header.formats, "%s has no genotypes (GT) of samples" % file
+    counts = np.zeros((len(samples), len(mutation_types)), dtype=np.int64)
+    records = vcf
+    if region is not None:
+        # fetch() also returns the variants overlapping the start of the region, which belong to the previous one
+        records = (record for record in vcf.fetch(*region) if record.start >= region[1])
+    snvs, carrier_snvs, carrier_samples = ([], [], [], []), [], []
+    for record in records:
+        if len(record.ref) != 1:
+            continue
+        genotypes = None
+        for allele, alt in enumerate(record.alts or (), 1):
+            if len(alt) != 1:
+                continue
+            if genotypes is None:
+                genotypes = [sample.allele_indices for sample in record.samples.values()]
+            carriers = [j for j, genotype in enumerate(genotypes) if allele in genotype]
+            if carriers:
+                carrier_snvs += [len(snvs[0])]*len(carriers)
+                carrier_samples += carriers
+                for values, value in zip(snvs, (record.chrom, record.pos - 1, record.ref, alt)):
+                    values.append(value)
+        if len(snvs[0]) >= chunk_size:
+            _add_sample_counts(counts, genome, mutation_types, snvs, carrier_snvs, carrier_samples, window_size)
+            snvs, carrier_snvs, carrier_samples = ([], [], [], []), [], []
+    _add_sample_counts(counts, genome, mutation_types, snvs, carrier_snvs, carrier_samples, window_size)
+    vcf.close()
+    return samples, counts
+
+
+def _is_indexed(file):
+    save = pysam.set_verbosity(0)
+    try:
+        with pysam.VariantFile(file) as vcf:
+            return vcf.index is not None
+    except (OSError, ValueError):
+        return False
+    finally:
+        pysam.set_verbosity(save)
+
+
+def vcf_regions(file, region_size):
+    """Split the contigs with variants of an indexed (bgzipped and tabix or csi) VCF into regions
+
+    Args:
+        file (str): VCF file
+        region_size (int): Max num of bases of each region
+
+    Returns:
+        list of (contig, start, end), see vcf_file_counts. Contigs without a length in the header are a single region
+    """
+    with pysam.VariantFile(file) as vcf:
+        assert vcf.index is not None, "%s has no index, create it with: tabix -p vcf %s" % (file, file)
+        regions = []
+        for contig in vcf.index:
+            length = vcf.header.contigs[contig].length if contig in vcf.header.contigs else None
+            if length is None:
+                regions.append((contig, 0, None))
+            else:
+                regions += [(contig, start, min(start + region_size, length)) for start in range(0, length, region_size)]
+    return regions
+
+
+def _init_vcf_worker(reference):
+    global _worker_genome
+    _worker_genome = pysam.FastaFile(reference)
+
+
+def _count_vcf_file(i, file, mutation_types, batched, window_size, region=None, per_sample=False):
+    # Errors are returned instead of raised, so a bad file doesn't stop the others
+    try:
+        if per_sample:
+            return i, vcf_sample_counts(file, _worker_genome, mutation_types, window_size=window_size,
+                                        region=region), None
+        return i, vcf_file_counts(file, _worker_genome, mutation_types, batched=batched, window_size=window_size,
+                                  region=region), None
+    except Exception as e:
+        return i, None, "%s: %s" % (type(e).__name__, e)
+
+
+def _run_vcf_tasks(tasks, names, store, reference, n_workers, what="files"):
+    """Run _count_vcf_file on each task (in-process if n_workers <= 1, else on a pool), calling
+    store(i, counts) with the counts of the i-th task as they finish and logging the progress
+
+    Returns:
+        dict: Error of each failed task, by name
+    """
+    global _worker_genome
+    if n_workers <= 1:
+        _init_vcf_worker(reference)
+        try:
+            return _collect_vcf_counts((_count_vcf_file(*task) for task in tasks), names, store, what)
+        finally:
+            _worker_genome.close()
+            _worker_genome = None
+    with ProcessPoolExecutor(max_workers=n_workers,
+                             initializer=_init_vcf_worker,
+                             initargs=(reference,)) as executor:
+        futures = [executor.submit(_count_vcf_file, *task) for task in tasks]
+        return _collect_vcf_counts((future.result() for future in as_completed(futures)), names, store, what)
+
+
+def _collect_vcf_counts(results, names, store, what):
+    failed = {}
+    start = time.time()
+    report_every = max(1, len(names)//20)
+    for k, (i, task_counts, error) in enumerate(results):
+        if error is None:
+            store(i, task_counts)
+        else:
+            failed[names[i]] = error
+            logging.warning("Could not read %s: %s" % (names[i], error))
+        if (k + 1) % report_every == 0 or k + 1 == len(names):
+            logging.info("VCF %s: %i/%i read (%.1f %s/s), %i failed" %
+                         (what, k + 1, len(names), (k + 1)/(time.time() - start), what, len(failed)))
+    return failed
+
+
+def VCF_to_counts(vcf_path, reference_genome, batched=True, window_size=None, n_workers=1, skip_failed=False,
+                  region_size=10000000, per_sample=False):
+    """Mutation counts of each VCF file
+
+    Args:
+        vcf_path (str): VCF file or folder of VCF files (one sample each)
+        reference_genome (str): Name or path of the reference genome
+        batched (bool): Read the flanks of the SNVs of each chromosome at once (see flanking_bases) instead
+            of fetching the reference once per variant. Default: True
+        window_size (int, optional): With batched, max num of reference bases read at a time. Default: whole chromosome
+        n_workers (int): Num of processes reading files in parallel, each with its own handle of the reference.
+            A single indexed VCF (bgzipped and tabix or csi) is split into regions instead (see vcf_regions),
+            which are read in parallel and summed. Reads in-process when <= 1. Default: 1
+        skip_failed (bool): Leave out the files which can't be read (they are logged) instead of raising
+            a RuntimeError listing them once all the files are read. Default: False
+        region_size (int): Num of bases of each region when a single VCF is split. Default: 10000000
+        per_sample (bool): Count each sample of multi-sample VCFs from its genotypes, reading each file once
+            (see vcf_sample_counts), instead of counting all the variants of each file. Always batched. Files
+            without genotypes (GT) fail, which aborts the whole run unless skip_failed. Default: False
+
+    Returns:
+        pd.DataFrame(n_files, 96) of int64, one row per file named after it
+            (with per_sample, one row per sample of each file, named after the sample, or <file>:<sample>
+            when vcf_path is a folder, so that samples in several files keep distinct names)
+    """
+
+    isFile = os.path.isfile(vcf_path)
+
+    if isFile == True:
+        list_of_files = [vcf_path]
+    else:
+        list_of_files = os.listdir(vcf_path)
+        list_of_files = [vcf_path + '/' + file for file in list_of_files]
+    # open fasta file
+    reference = reference_path(reference_genome)
+    mutation_types = load_catalog().mutation_types
+    # Counts of each file (per_sample: sample names and counts of each file)
+    counts = {} if per_sample else np.zeros((len(list_of_files), len(mutation_types)), dtype=np.int64)
+    if len(list_of_files) == 1 and n_workers > 1 and _is_indexed(list_of_files[0]):
+        # Split the file in regions, and fail as a whole if any of them fails
+        file = list_of_files[0]
+        regions = vcf_regions(file, region_size)
+        tasks = [(i, file, mutation_types, batched, window_size, region, per_sample) for i, region in enumerate(regions)]
+        names = ["%s:%s:%s-%s" % ((file,) + region) for region in regions]
+        if per_sample:
+            with pysam.VariantFile(file) as vcf:
+                samples = list(vcf.header.samples)
+            total = np.zeros((len(samples), len(mutation_types)), dtype=np.int64)
+            failed = _run_vcf_tasks(tasks, names, lambda i, result: np.add(total, result[1], out=total),
+                                    reference, n_workers, what="regions")
+            counts[0] = (samples, total)
+        else:
+            failed = _run_vcf_tasks(tasks, names, lambda i, result: np.add(counts[0], result, out=counts[0]),
+                                    reference, n_workers, what="regions")
+        failed = {file: "; ".join("%s: %s" % item for item in failed.items())} if failed else {}
+    else:
+        tasks = [(i, file, mutation_types, batched, window_size, None, per_sample) for i, file in enumerate(list_of_files)]
+        failed = _run_vcf_tasks(tasks, list_of_files, counts.__setitem__, reference, n_workers)
+    if failed and not skip_failed:
+        raise RuntimeError("Could not read %i VCF files:\n%s" %
+                           (len(failed), "\n".join("%s: %s" % (file, error) for file, error in failed.items())))
+    read = [i for i, file in enumerate(list_of_files) if file not in failed]
+    if per_sample:
+        if isFile:
+            names = [sample for i in read for sample in counts[i][0]]
+        else:
+            names = ["%s:%s" % (Path(list_of_files[i]).stem, sample) for i in read for sample in counts[i][0]]
+        return pd.DataFrame(np.concatenate([counts[i][1] for i in read] + [np.zeros((0, len(mutation_types)), dtype=np.int64)]),
+                            index=names, columns=mutation_types)
+    return pd.DataFrame(counts[read], index=[Path(list_of_files[i]).stem for i in read], columns=mutation_types)
+
+
+def bed_to_counts(bed_path, reference_genome_path, batched=True, window_size=None):
+    """Mutation counts of each sample of a bed file (columns: sample, chr, start, ref, alt)
+
+    Args:
+        bed_path (str): Path to the bed file
+        reference_genome_path (str): Path to the reference genome
+        batched, window_size: see VCF_to_counts. The SNVs of all the samples are batched together
+
+    Returns:
+        pd.DataFrame(n_samples, 96) of int64
+    """
     # open vcf file
     bed = pd.read_csv(bed_path, header=0, sep='\t', index_col=False)
     # open fasta file
@@ -100,48 +482,48 @@ def bed_to_counts(bed_path, reference_genome_path):
         exit()
     else:
         genome = pysam.FastaFile(reference_genome_path)
-    # define by how many bases the variant should be flanked
-    flank = 1
-    mutation_type_order=os.path.join(DATA, "mutation_type_order.xlsx")
-    mutation_order = pd.read_excel(mutation_type_order)
-    final_df = pd.DataFrame(columns=mutation_order['Type'])
+    mutation_types = load_catalog().mutation_types
     list_of_samples = bed['sample'].unique()
-    for sample in list_of_samples:
-        bed_sample = bed[bed['sample']==sample]
-        # iterate over each variant
-        list_of_mutations = []
-        for index, row in bed_sample.iterrows():
-            # extract sequence
-            #
-            # The start position is calculated by subtract the number of bases
-            # given by 'flank' from the variant position. The position in the bed file
-            # is 0-based. pysam's fetch() expected 0-base coordinate. 
-            #
-            # The end position is calculated by adding the number of bases
-            # given by 'flank' to the variant position. We also need to add the length
-            # of the REF value.
-            # 
-            # We need to check that 'chr' is contained in the chromosome, otherwise it doesn't work.
-            if 'chr' not in row['chr']:
-                chr = 'chr' + row['chr']
-            else:
-                chr = row['chr']
-            # Now we have the complete sequence like this:
-            # [number of bases given by flank]+REF+[number of bases given by flank]
-            seq = genome.fetch(chr, row['start']-flank, row['start']+len(row['ref'])+flank)
-            # print out tab seperated columns:
-            # CRHOM, POS, REF, ALT, flanking sequencing with variant given in the format '[REF/ALT]'
-            mutation = '{}[{}>{}]{}'.format(seq[:flank].upper(), row['ref'].upper(), row['alt'][0].upper(), seq[flank+len(row['ref']):].upper())
-            list_of_mutations.append(mutation)
-        # Now we count the number of times each mutation type is present in the list
-        counts = Counter(list_of_mutations)
-        # Filter and sort based on the mutation categories. 
-        muts_sorted = []
-        for mutation_type in mutation_order['Type']:
-            mutation_type_rev = complement(mutation_type[6])+'['+complement(mutation_type[2])+'>'+complement(mutation_type[4])+']'+complement(mutation_type[0])
-            muts_sorted.append(counts[mutation_type]+counts[mutation_type_rev])
-        sample_dict = {mutation_order.loc[i, 'Type']: [muts_sorted[i]] for i in range(len(mutation_order))}
-        sample_df = pd.DataFrame(sample_dict, index = [sample])
-        final_df = pd.concat((final_df, sample_df))
-    final_df = final_df.rename_axis(None, axis=1)
-    return final_df
+    counts = np.zeros((len(list_of_samples), len(mutation_types)), dtype=np.int64)
+    if batched:
+        # Keep the SNVs, the rest don't have a mutation type. start is 0-based
+        snvs = bed[bed['ref'].str.len() == 1]
+        snv_contexts_all = snv_contexts(genome, snvs['chr'].map(reference_name).tolist(), snvs['start'].tolist(),
+                                        snvs['ref'].tolist(), snvs['alt'].str[0].tolist(), window_size=window_size)
+        snv_rows = snvs.reset_index(drop=True).groupby('sample').indices
+    for k, sample in enumerate(list_of_samples):
+        if batched:
+            contexts = snv_contexts_all[snv_rows.get(sample, np.array([], dtype=np.int64))]
+        else:
+            bed_sample = bed[bed['sample']==sample]
+            # define by how many bases the variant should be flanked
+            flank = 1
+            # iterate over each variant
+            contexts = []
+            for index, row in bed_sample.iterrows():
+                # extract sequence
+                #
+                # The start position is calculated by subtract the number of bases
+                # given by 'flank' from the variant position. The position in the bed file
+                # is 0-based. pysam's fetch() expected 0-base coordinate.
+                #
+                # The end position is calculated by adding the number of bases
+                # given by 'flank' to the variant position. We also need to add the length
+                # of the REF value.
+                #
+                # We need to check that 'chr' is contained in the chromosome, otherwise it doesn't work.
+                if 'chr' not in row['chr']:
+                    chr = 'chr' + row['chr']
+                else:
+                    chr = row['chr']
+                # Now we have the complete sequence like this:
+                # [number of bases given by flank]+REF+[number of bases given by flank]
+                seq = genome.fetch(chr, row['start']-flank, row['start']+len(row['ref'])+flank)
+                # Keep the context (5' base, REF, ALT, 3' base) of SNVs, the rest don't have a mutation type
+                if len(row['ref']) == 1 and len(seq) == 3:
+                    contexts.append(seq[0] + row['ref'] + row['alt'][0] + seq[2])
+            contexts = ''.join(contexts).encode('ascii', 'replace')
+        # Count the number of times each mutation type (or its reverse complement) is present,
+        # sorted based on the mutation categories
+        counts[k] = count_mutation_types(contexts, mutation_types)
+    return pd.DataFrame(counts, index=list_of_samples, columns=mutation_types)
@@ -0,0 +1,103 @@
+import hashlib
+import logging
+import os
+import pathlib
+
+import numpy as np
+import pandas as pd
+import torch
+
+from signaturesnet import DATA
+
+CATALOG_FORMAT_VERSION = 1
+CATALOG_CACHE_DIR = os.environ.get("SIGNET_CACHE_DIR",
+                                   os.path.join(os.path.expanduser("~"), ".cache", "signaturesnet"))
+
+_CATALOGS = {}
+
+
+class SignatureCatalog:
+
+    def __init__(self, signatures, sig_names, mutation_types):
+        """Signature matrix sorted by mutation type, with its signature names and mutation type order
+
+        Args:
+            signatures (np.array(96, num_sigs)): Signatures, rows in mutation_types order
+            sig_names (list): Name of each signature (column)
+            mutation_types (list): Mutation types X[Y>Z]W in the order used by SigNet
+        """
+        self.signatures = torch.from_numpy(np.asarray(signatures, dtype=np.float32))
+        self.sig_names = list(sig_names)
+        self.mutation_types = list(mutation_types)
+
+
+def _file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def compile_catalog(file, mutation_type_order):
+    """Parse the signatures excel file, sorted according to the mutation type order file
+    """
+    signatures_data = pd.read_excel(file)
+    mutation_order = pd.read_excel(mutation_type_order)
+
+    sig_names = list(signatures_data.columns)[1:]
+    signatures_data.rename(columns = {list(signatures_data)[0]:'Type'}, inplace=True)
+    signatures_data = signatures_data.set_index('Type')
+    signatures_data = signatures_data.reindex(index=mutation_order['Type'])
+    return SignatureCatalog(signatures=signatures_data.values.astype(np.float32),
+                            sig_names=sig_names,
+                            mutation_types=mutation_order['Type'])
+
+
+def load_catalog(file=os.path.join(DATA, "data.xlsx"),
+                 mutation_type_order=os.path.join(DATA, "mutation_type_order.xlsx"),
+                 cache_dir=CATALOG_CACHE_DIR):
+    """Get the signature catalog of the given excel files
+
+    The catalog is parsed from excel only once: it is kept in memory for the rest of the process
+    and stored as an .npz bundle in cache_dir, keyed by the hash of both source files.
+
+    Args:
+        file (str): Excel with a first column of mutation types and one column per signature
+        mutation_type_order (str): Excel whose 'Type' column gives the mutation types order
+        cache_dir (str): Folder of the compiled catalogs. None to disable the disk cache.
+            Defaults to $SIGNET_CACHE_DIR or ~/.cache/signaturesnet.
+
+    Returns:
+        SignatureCatalog
+    """
+    memory_key = tuple((os.path.abspath(path), os.stat(path).st_mtime_ns, os.stat(path).st_size)
+                       for path in (file, mutation_type_order))
+    if memory_key in _CATALOGS:
+        return _CATALOGS[memory_key]
+
+    catalog_file = None
+    if cache_dir is not None:
+        key = hashlib.sha256(("%s-%s-%s" % (CATALOG_FORMAT_VERSION, _file_hash(file),
+                                             _file_hash(mutation_type_order))).encode()).hexdigest()
+        catalog_file = os.path.join(cache_dir, "catalog_%s.npz" % key)
+
+    if catalog_file is not None and os.path.isfile(catalog_file):
+        with np.load(catalog_file, allow_pickle=False) as bundle:
+            catalog = SignatureCatalog(signatures=bundle["signatures"],
+                                       sig_names=bundle["sig_names"].tolist(),
+                                       mutation_types=bundle["mutation_types"].tolist())
+    else:
+        logging.info("Compiling signature catalog %s..." % file)
+        catalog = compile_catalog(file, mutation_type_order)
+        if catalog_file is not None:
+            try:
+                pathlib.Path(cache_dir).mkdir(parents=True, exist_ok=True)
+                tmp_file = catalog_file + ".%i.tmp.npz" % os.getpid()
+                np.savez(tmp_file,
+                         signatures=catalog.signatures.numpy(),
+                         sig_names=np.array(catalog.sig_names, dtype=str),
+                         mutation_types=np.array(catalog.mutation_types, dtype=str))
+                os.replace(tmp_file, catalog_file)
+            except OSError as e:
+                logging.warning("Could not cache the signature catalog in %s: %s" % (cache_dir, e))
+
+    _CATALOGS[memory_key] = catalog
+    return catalog
@@ -0,0 +1,205 @@
+import collections
+import contextlib
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:   # Windows
+    resource = None
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss():
+    """Resident set size of this process in bytes (None if it can't be read on this platform)
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1])*_PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def peak_rss():
+    """High-water mark of the resident set size of this process in bytes (None if unknown). It is the peak
+    since the last reset_peak_rss() where the kernel supports it, else since the start of the process
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])*1024
+    except (OSError, IndexError, ValueError):
+        pass
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss*1024   # Linux reports KB
+
+
+def reset_peak_rss():
+    """Reset the high-water mark of peak_rss() to the current RSS (Linux >= 4.0)
+
+    Returns:
+        bool: Whether it could be reset
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+class _PeakTracker:
+    """Peak RSS of each open stage (of every Instrumentation of the process, as the high-water mark is shared)
+
+    The high-water mark is reset whenever a stage starts, so it only covers the time since the last stage
+    started, which is within every stage still open. Before each reset (and when a stage ends) it is folded
+    into the peaks of the open stages.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._peaks = {}
+        self._supported = None
+
+    def start(self):
+        """Returns: key to pass to stop(), None if peaks per stage are not supported here
+        """
+        with self._lock:
+            if self._supported is False:
+                return None
+            self._fold()
+            self._supported = reset_peak_rss()
+            if not self._supported:
+                return None
+            key = object()
+            self._peaks[key] = current_rss() or 0
+            return key
+
+    def stop(self, key):
+        """Returns: peak RSS in bytes since start(key) (None if not supported)
+        """
+        if key is None:
+            return None
+        with self._lock:
+            self._fold()
+            return self._peaks.pop(key)
+
+    def _fold(self):
+        if not self._peaks:
+            return
+        # The kernel updates the high-water mark lazily, so the current RSS may be above it
+        peak = max(peak_rss() or 0, current_rss() or 0)
+        for key in self._peaks:
+            self._peaks[key] = max(self._peaks[key], peak)
+
+
+_peak_tracker = _PeakTracker()
+
+
+class Instrumentation:
+
+    def __init__(self):
+        """Per-stage timings, memory and routing counts of a SigNet call (see SigNet.__call__(instrument=True))
+
+        Each stage records:
+            seconds, cpu_seconds: Wall and (process) CPU time
+            samples: Num of samples it processed
+            rss_mb: Resident memory of the process at the end of the stage
+            rss_delta_mb: Change of resident memory during the stage
+            peak_rss_mb: Highest resident memory of the process during the stage (max over its entries). None
+                where the kernel high-water mark can't be reset (see reset_peak_rss), e.g. outside Linux.
+        Memory is measured for the whole process, so it includes other threads running at the same time.
+        wall_seconds is the wall time of the whole call (set by finish()), while total_seconds adds up the
+        stages, which can be larger when stages overlap (e.g. pipelined NNLS).
+        routes counts the samples sent to each branch (realistic, random, finetuner_low, finetuner_large, nnls)
+        and, with a result cache, the samples found in it (cache_memory_hits, cache_disk_hits, cache_misses).
+        """
+        self.stages = collections.OrderedDict()
+        self.routes = collections.OrderedDict()
+        self._lock = threading.Lock()   # Stages may run on several threads (e.g. pipelined NNLS)
+        self._start = time.perf_counter()
+        self.wall_seconds = None
+
+    def finish(self):
+        """Set wall_seconds to the time since the Instrumentation was created
+        """
+        self.wall_seconds = time.perf_counter() - self._start
+
+    @contextlib.contextmanager
+    def stage(self, name, samples=None):
+        """Measure the block as stage name (time and samples accumulate if the stage is entered again)
+        """
+        rss_start = current_rss()
+        peak_key = _peak_tracker.start()
+        start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            seconds, cpu_seconds = time.perf_counter() - start, time.process_time() - cpu_start
+            rss_end, peak = current_rss(), _peak_tracker.stop(peak_key)
+            with self._lock:
+                self._record(name, samples, seconds, cpu_seconds, rss_start, rss_end, peak)
+
+    def _record(self, name, samples, seconds, cpu_seconds, rss_start, rss_end, peak):
+        record = self.stages.setdefault(name, {"seconds": 0., "cpu_seconds": 0., "samples": 0, "rss_delta_mb": 0.})
+        record["seconds"] += seconds
+        record["cpu_seconds"] += cpu_seconds
+        record["samples"] += int(samples) if samples is not None else 0
+        record["rss_mb"] = rss_end/1e6 if rss_end is not None else None
+        if rss_end is not None and rss_start is not None:
+            record["rss_delta_mb"] += (rss_end - rss_start)/1e6
+        if peak is not None:
+            peak = max(peak/1e6, record.get("peak_rss_mb") or 0.)
+        record["peak_rss_mb"] = peak
+
+    def count(self, route, samples):
+        with self._lock:
+            self.routes[route] = self.routes.get(route, 0) + int(samples)
+
+    @property
+    def total_seconds(self):
+        """Sum of the stage times (see wall_seconds for the time of the call)
+        """
+        return sum(record["seconds"] for record in self.stages.values())
+
+    @property
+    def cache_hit_rate(self):
+        """Fraction of the samples found in the result cache (None if there was no cache)
+        """
+        hits = self.routes.get("cache_memory_hits", 0) + self.routes.get("cache_disk_hits", 0)
+        lookups = hits + self.routes.get("cache_misses", 0)
+        return hits/lookups if lookups > 0 else None
+
+    def as_dict(self):
+        """Plain dict (e.g. to send to a metrics system or to json.dumps)
+        """
+        return {"stages": {name: dict(record) for name, record in self.stages.items()},
+                "routes": dict(self.routes),
+                "wall_seconds": self.wall_seconds,
+                "total_seconds": self.total_seconds,
+                "cache_hit_rate": self.cache_hit_rate}
+
+    def to_dataframe(self):
+        """One row per stage
+        """
+        import pandas as pd
+        return pd.DataFrame.from_dict(self.stages, orient="index")
+
+    def __repr__(self):
+        stages = ", ".join("%s: %.3fs" % (name, record["seconds"]) for name, record in self.stages.items())
+        wall = "; wall: %.3fs" % self.wall_seconds if self.wall_seconds is not None else ""
+        return "Instrumentation(%s%s; routes: %s)" % (stages, wall, dict(self.routes))
+
+
+def stage(instrumentation, name, samples=None):
+    """instrumentation.stage(name, samples), or a context which does nothing if instrumentation is None
+    """
+    if instrumentation is None:
+        return contextlib.nullcontext()
+    return instrumentation.stage(name, samples)
@@ -1,33 +1,27 @@
 import logging
 import os
 import pathlib
-from sklearn import preprocessing
 import sys
-import yaml
 
 import json
+import numpy as np
 import pandas as pd
 import torch
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from signaturesnet import DATA, TRAINED_MODELS
-from signaturesnet.utilities.data_partitions import DataPartitions
-from signaturesnet.utilities.generator_data import GeneratorData
+from signaturesnet.utilities.catalog import load_catalog
+
+# NOTE: Training-only dependencies (sklearn, yaml, datasets) are imported where used
+# to keep the inference import path light
 
 def read_signatures(file,
                     mutation_type_order=os.path.join(DATA, "mutation_type_order.xlsx")):
     """
     File must contain first column with mutations types X[Y>Z]W and the rest of the columns must be the set of signatures
+    The parsed (and sorted according to cosmic mutation types order) matrix is cached, see utilities.catalog
     """
-    # Sort according to cosmic mutation types order
-    signatures_data = sort_signatures(file,
-                                      mutation_type_order=mutation_type_order)
-
-    num_sigs = len(signatures_data.columns) - 1
-    signatures = [torch.tensor(signatures_data.iloc[:, i]).type(torch.float32)
-                  for i in range(1, num_sigs + 1)][:num_sigs]
-    signatures = torch.stack(signatures).t()
-    return signatures
+    return load_catalog(file, mutation_type_order=mutation_type_order).signatures.clone()
 
 def sort_signatures(file,
                     output_file=None,
@@ -55,6 +49,7 @@ def csv_to_pandas(file,
     df.index = df.index.map(lambda x: x.split("..")[-1])
 
     if type_df is not None:
+        from sklearn import preprocessing
         cancer_type_df = pd.read_csv(type_df, header=0)[["Cancer Types", "Sample Names"]]
         df = df.merge(cancer_type_df, left_index=True, right_on="Sample Names").set_index("Sample Names")
         le = preprocessing.LabelEncoder()
@@ -71,6 +66,7 @@ def csv_to_tensor(file,
     df = pd.read_csv(file, header=header, index_col=index_col)
 
     if type_df is not None:
+        from sklearn import preprocessing
         df.index = df.index.map(lambda x: x.split("..")[-1])
         cancer_type_df = pd.read_csv(type_df, header=0)[["Cancer Types", "Sample Names"]]
         df = df.merge(cancer_type_df, left_index=True, right_on="Sample Names").set_index("Sample Names")
@@ -104,6 +100,8 @@ def read_data(device,
         source (string): Type of generated data: random or realistic
         data_folder (str, optional): Relative path of data folder. Defaults to DATA.
     """
+    from signaturesnet.utilities.data_partitions import DataPartitions
+
     # assert(source in ["random", "realistic", "perturbed"])
     path = os.path.join(data_folder, experiment_id)
 
@@ -140,6 +138,8 @@ def read_data_classifier(device,
         source (string): Type of generated data: random or realistic
         data_folder (str, optional): Relative path of data folder. Defaults to "DATA".
     """
+    from signaturesnet.utilities.data_partitions import DataPartitions
+
     path = os.path.join(data_folder, experiment_id)
 
     train_input = csv_to_tensor(path + "/train_input.csv", device)
@@ -186,6 +186,8 @@ def read_data_generator(device,
     '''
     type should be: 'real', 'perturbed' or 'augmented_real'.
     '''
+    from signaturesnet.utilities.generator_data import GeneratorData
+
     data_folder = data_folder + data_id
     if type == 'real':
         if cosmic_version == 'v3':
@@ -300,12 +302,35 @@ def read_model(directory, device="cpu"):
     Args:
         directory (String): Folder containing state_dict and init_args.json of the model
     """
-    from signaturesnet.models import Generator, Classifier, FineTunerLowNumMut, FineTunerLargeNumMut, ErrorFinder, NumMutNet
+    init_args, state_dict = read_model_files(directory, device=device)
+    return build_model(init_args, state_dict, device=device)
 
-    # Load init_args
+def read_model_files(directory, device="cpu"):
+    """Read the init_args.json and state_dict (or state_dict.zip) of a stored model
+    """
     init_args_file = os.path.join(directory, 'init_args.json')
     with open(init_args_file, 'r') as fp:
         init_args = json.load(fp)
+
+    state_dict_file = os.path.join(directory, "state_dict")
+    if not os.path.isfile(state_dict_file):
+        state_dict_file = state_dict_file + ".zip"
+    state_dict = torch.load(f=state_dict_file,
+                            map_location=torch.device(device))
+    return init_args, state_dict
+
+def build_model(init_args, state_dict, device="cpu", assign=False):
+    """Instantiate a model of type init_args["model_type"] with the given weights, in eval mode
+
+    Args:
+        init_args (dict): Arguments of the model constructor and its model_type
+        state_dict (dict): Model weights
+        assign (bool): Use the state_dict tensors as parameters instead of copying them
+            (keeps memory-mapped weights shared). Defaults to False.
+    """
+    from signaturesnet.models import Generator, Classifier, FineTunerLowNumMut, FineTunerLargeNumMut, ErrorFinder, NumMutNet
+
+    init_args = dict(init_args)
     model_type = init_args["model_type"]
     init_args.pop("model_type")
     # print("Reading model of type:", model_type)
@@ -329,19 +354,63 @@ def read_model(directory, device="cpu"):
         model = NumMutNet(**init_args)
     
     # Load model weights
-    state_dict_file = os.path.join(directory, "state_dict")
-    try:
-        state_dict = torch.load(f=state_dict_file,
-                                map_location=torch.device(device))
-    except:
-        state_dict = torch.load(f=state_dict_file + ".zip",
-                                map_location=torch.device(device))
-
-    model.load_state_dict(state_dict)
+    model.load_state_dict(state_dict, assign=assign)
     model.eval()
     model.to(device)
     return model
 
+SIGNET_BUNDLE_VERSION = 1
+SIGNET_BUNDLE_MODELS = ["detector", "finetuner_low", "finetuner_large", "errorfinder"]
+
+def save_signet_bundle(path,
+                       model_dirs=None,
+                       signatures_path=os.path.join(DATA, "data.xlsx"),
+                       mutation_type_order=os.path.join(DATA, "mutation_type_order.xlsx")):
+    """Pack the 4 SigNet Refitter models and the signature catalog into a single file
+
+    Args:
+        path (str): Output file
+        model_dirs (dict, optional): Folder of each model in SIGNET_BUNDLE_MODELS. Defaults to the trained_models ones.
+        signatures_path (str): Signatures excel file
+        mutation_type_order (str): Mutation types order excel file
+    """
+    dirs = {name: os.path.join(TRAINED_MODELS, name) for name in SIGNET_BUNDLE_MODELS}
+    dirs.update(model_dirs if model_dirs is not None else {})
+
+    models = {}
+    for name in SIGNET_BUNDLE_MODELS:
+        init_args, state_dict = read_model_files(dirs[name])
+        models[name] = {"init_args": init_args, "state_dict": state_dict}
+    catalog = load_catalog(signatures_path, mutation_type_order=mutation_type_order)
+    bundle = {"version": SIGNET_BUNDLE_VERSION,
+              "models": models,
+              "catalog": {"signatures": catalog.signatures,
+                          "sig_names": catalog.sig_names,
+                          "mutation_types": catalog.mutation_types}}
+    create_dir(path)
+    torch.save(bundle, path)
+
+def read_signet_bundle(path, device="cpu", mmap=True):
+    """Load a bundle written by save_signet_bundle
+
+    With mmap the weights are not read into memory but mapped from the file, so all processes
+    of a node loading the same bundle share the same physical pages.
+
+    Returns:
+        models (dict): Model of each name in SIGNET_BUNDLE_MODELS, in eval mode
+        catalog (SignatureCatalog): Signature catalog
+    """
+    from signaturesnet.utilities.catalog import SignatureCatalog
+
+    bundle = torch.load(f=path, map_location=torch.device(device), mmap=mmap, weights_only=True)
+    assert bundle["version"] == SIGNET_BUNDLE_VERSION, "Unsupported bundle version: %s"%bundle["version"]
+    models = {name: build_model(entry["init_args"], entry["state_dict"], device=device, assign=mmap)
+              for name, entry in bundle["models"].items()}
+    catalog = SignatureCatalog(signatures=bundle["catalog"]["signatures"],
+                               sig_names=bundle["catalog"]["sig_names"],
+                               mutation_types=bundle["catalog"]["mutation_types"])
+    return models, catalog
+
 def save_model(model, directory):
     """Store a pytorch model. The arguments are splitted into 2 files:
     A init_args.json needed to instantiate the class, and the model state_dict
@@ -372,6 +441,7 @@ def update_dict(config, args):
     return config
 
 def read_config(path):
+    import yaml
     with open(path, 'r') as stream:
         data = yaml.safe_load(stream)
     return data["config"]
@@ -387,6 +457,50 @@ def write_result(result, filepath):
     fout.write(str(result))
     fout.close()
 
+def _to_numpy(values):
+    if isinstance(values, torch.Tensor):
+        return values.detach().cpu().numpy()
+    return np.asarray(values)
+
+
+def _weight_names(weights, sig_names):
+    """Weights have an extra 'Unknown' column except for NNLS-only results
+    """
+    return sig_names + ['Unknown'] if weights.shape[1] == len(sig_names) + 1 else sig_names
+
+
+def write_result_csvs(weights,
+                      lower_bound,
+                      upper_bound,
+                      classification,
+                      sample_names,
+                      output_path,
+                      sig_names=None,
+                      suffix='',
+                      append=False):
+    """Write SigNet outputs as one csv per output (weight_guesses, lower_bound_guesses, upper_bound_guesses
+    and classification_guesses), samples as rows
+
+    Args:
+        suffix (str): Added to the file names, e.g. weight_guesses<suffix>.csv
+        append (bool): Add the rows at the end of existing files (without header) instead of overwriting them
+    """
+    pathlib.Path(output_path).mkdir(parents=True, exist_ok=True)
+    sig_names = load_catalog().sig_names if sig_names is None else list(sig_names)
+    mode, header = ("a", False) if append else ("w", True)
+
+    def write(values, name, columns):
+        path = os.path.join(output_path, "%s%s.csv"%(name, suffix))
+        logging.info("Writting results: %s"%path)
+        df = pd.DataFrame(_to_numpy(values).reshape(len(sample_names), -1), columns=columns, index=sample_names)
+        df.to_csv(path, header=header, index=True, mode=mode)
+
+    write(weights, "weight_guesses", _weight_names(weights, sig_names))
+    write(lower_bound, "lower_bound_guesses", sig_names)
+    write(upper_bound, "upper_bound_guesses", sig_names)
+    write(classification, "classification_guesses", ['Classification'])
+
+
 def write_final_outputs(weights,
                         lower_bound,
                         upper_bound,
@@ -394,32 +508,175 @@ def write_final_outputs(weights,
                         sample_names, 
                         output_path,
                         name=''):
-    pathlib.Path(output_path).mkdir(parents=True, exist_ok=True)
-    sig_names = list(pd.read_excel(os.path.join(DATA, "data.xlsx")).columns)[1:]
+    write_result_csvs(weights=weights,
+                      lower_bound=lower_bound,
+                      upper_bound=upper_bound,
+                      classification=classification,
+                      sample_names=sample_names,
+                      output_path=output_path,
+                      suffix="-%s"%name)
 
-    def write(values, path, sig_names, output_type = 'error'):
-        logging.info("Writting results: %s"%path)
-        try:
-            df = pd.DataFrame(values.detach().numpy())
-        except:
-            df = pd.DataFrame(values)
-        if output_type == 'weight':
-            sig_names = sig_names + ['Unknown']
-        if output_type == 'classification':
-            sig_names = ['Classification']
-        df.columns = sig_names
-        df.index = sample_names
-        df.to_csv(path, header=True, index=True)
 
-    # Write results weight guesses
-    write(values=weights, path=output_path + "/weight_guesses-%s.csv"%name, sig_names=sig_names, output_type='weight')
-    write(values=lower_bound, path=output_path + "/lower_bound_guesses-%s.csv"%name, sig_names=sig_names)
-    write(values=upper_bound, path=output_path + "/upper_bound_guesses-%s.csv"%name, sig_names=sig_names)
-    write(values=classification, path=output_path + "/classification_guesses-%s.csv"%name, sig_names=sig_names, output_type='classification')
+SIGNET_RESULT_FORMATS = ["csv", "parquet", "arrow"]
+SIGNET_TABLE_VERSION = 1
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("Parquet/Arrow SigNet outputs need pyarrow (pip install pyarrow)")
+    return pyarrow
+
+
+def signet_result_table(weights,
+                        lower_bound,
+                        upper_bound,
+                        classification,
+                        normalized_input,
+                        sample_names,
+                        sig_names,
+                        mutation_types):
+    """SigNet outputs as a single pyarrow.Table
+
+    One row per sample: a "sample" column, float32 columns weight_<sig> (plus weight_Unknown), lower_<sig>,
+    upper_<sig>, classification and input_<mutation type> (normalized input). The signature names,
+    mutation types, table version, whether sample names are integers and the ndim of classification are
+    stored as JSON in the schema metadata (key b"signaturesnet").
+    """
+    pa = _import_pyarrow()
+    sig_names, mutation_types = list(sig_names), list(mutation_types)
+    weight_names = _weight_names(weights, sig_names)
+    groups = [("weight", weight_names, weights),
+              ("lower", sig_names, lower_bound),
+              ("upper", sig_names, upper_bound),
+              ("input", mutation_types, normalized_input)]
+    names, arrays = ["sample"], [pa.array([str(sample) for sample in sample_names], type=pa.string())]
+    for prefix, columns, values in groups:
+        values = np.asfortranarray(_to_numpy(values), dtype=np.float32)
+        names += ["%s_%s"%(prefix, column) for column in columns]
+        arrays += [pa.array(values[:, i]) for i in range(len(columns))]
+    names.append("classification")
+    arrays.append(pa.array(_to_numpy(classification).reshape(-1).astype(np.float32)))
+
+    metadata = {"version": SIGNET_TABLE_VERSION,
+                "sig_names": sig_names,
+                "weight_names": weight_names,
+                "mutation_types": mutation_types,
+                "integer_samples": bool(np.issubdtype(np.asarray(sample_names).dtype, np.integer)),
+                "classification_ndim": _to_numpy(classification).ndim}
+    return pa.Table.from_arrays(arrays, names=names, metadata={b"signaturesnet": json.dumps(metadata)})
+
+
+class SigNetResultWriter:
+
+    def __init__(self, path, format="parquet"):
+        """Write SigNetResults into a single columnar file (see signet_result_table), one chunk at a time
+
+        The file is opened on the first write() and completed on close() (or when leaving the with block).
+
+        Args:
+            path (str): Output file
+            format (str): "parquet" (one row group per write) or "arrow" (Arrow IPC file, one record batch per write)
+        """
+        assert format in ["parquet", "arrow"], "Columnar format must be parquet or arrow. You provided %s"%format
+        self.path = path
+        self.format = format
+        self.n_samples = 0
+        self._writer = None
+
+    def write(self, result):
+        """Append a SigNetResult (sparse results are written in dense blocks, see SigNetResult.blocks)
+        """
+        if getattr(result, "sparse", False):
+            for block in result.blocks():
+                self.write(block)
+            return
+        table = signet_result_table(weights=result.weights,
+                                    lower_bound=result.lower,
+                                    upper_bound=result.upper,
+                                    classification=result.classification,
+                                    normalized_input=result.normalized_input,
+                                    sample_names=result.mutation_dataset.index,
+                                    sig_names=result.sig_names,
+                                    mutation_types=result.mutation_dataset.columns)
+        if self._writer is None:
+            pa = _import_pyarrow()
+            pathlib.Path(os.path.dirname(os.path.abspath(self.path))).mkdir(parents=True, exist_ok=True)
+            if self.format == "parquet":
+                import pyarrow.parquet as pq
+                self._writer = pq.ParquetWriter(self.path, table.schema)
+            else:
+                self._writer = pa.ipc.new_file(self.path, table.schema)
+        self._writer.write_table(table)
+        self.n_samples += table.num_rows
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            logging.info("Writting results: %s (%i samples)... DONE"%(self.path, self.n_samples))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_signet_results(path, format="numpy", return_sample_names=False):
+    """Read a file written by SigNetResultWriter (or SigNetResult.save with a columnar format)
+
+    Args:
+        path (str): Parquet or Arrow IPC file
+        format (str): One of "numpy", "pandas", "tensor", as in SigNetResult.get_output
+
+    Returns:
+        weights, lower bound, upper bound, classification, normalized_input in the given format, with the
+        shapes of the written SigNetResult (classification is (n,) for refits and (n, 1) for only_NNLS results)
+        (and the list of sample names if return_sample_names: ints if the written names were integers,
+        strings otherwise)
+    """
+    assert format in ["numpy", "pandas", "tensor"]
+    pa = _import_pyarrow()
+    with open(path, "rb") as f:
+        magic = f.read(6)
+    if magic == b"ARROW1":
+        with pa.memory_map(path) as source:
+            table = pa.ipc.open_file(source).read_all()
+    else:
+        import pyarrow.parquet as pq
+        table = pq.read_table(path)
+    metadata = json.loads(table.schema.metadata[b"signaturesnet"])
+
+    def read(prefix, columns):
+        values = np.empty((table.num_rows, len(columns)), dtype=np.float32)
+        for i, column in enumerate(columns):
+            values[:, i] = table.column("%s_%s"%(prefix, column)).to_numpy()
+        return values
+
+    classification = table.column("classification").to_numpy().astype(np.float32)
+    if metadata.get("classification_ndim", 1) == 2:     # (n, 1) as in only_NNLS results
+        classification = classification.reshape(-1, 1)
+    outputs = [read("weight", metadata["weight_names"]),
+               read("lower", metadata["sig_names"]),
+               read("upper", metadata["sig_names"]),
+               classification,
+               read("input", metadata["mutation_types"])]
+    if format == "pandas":
+        outputs = [pd.DataFrame(values) for values in outputs]
+    if format == "tensor":
+        outputs = [torch.from_numpy(values) for values in outputs]
+    if return_sample_names:
+        sample_names = table.column("sample").to_pylist()
+        if metadata.get("integer_samples", False):
+            sample_names = [int(sample) for sample in sample_names]
+        return (*outputs, sample_names)
+    return tuple(outputs)
 
 
 def write_David_outputs(weights, lower_bound, upper_bound, output_path):
-    sig_names = list(pd.read_excel(os.path.join(DATA, "data.xlsx")).columns)[1:]
+    sig_names = load_catalog().sig_names
     
     # Write results weight guesses
     df = pd.DataFrame({'weight_guess': weights[0], 'upper_bound': upper_bound[0], 'lower_bound': lower_bound[0],})
@@ -0,0 +1,173 @@
+import hashlib
+
+import numpy as np
+
+
+_CATALOG_CACHE = {}
+
+
+class NNLSCatalog:
+
+    def __init__(self, signatures):
+        """Quantities of a signature matrix reused by every NNLS solve
+
+        Args:
+            signatures (np.array(96, num_sigs)): Signature matrix
+        """
+        self.signatures = np.ascontiguousarray(signatures, dtype=np.float64)
+        self.gram = self.signatures.T @ self.signatures
+        self.tol = 10*max(self.signatures.shape)*np.finfo(np.float64).eps*\
+            max(1., np.abs(self.signatures).sum(axis=0).max())
+
+    def solve(self, input_batch, maxiter=None, batch_size=2048, init=None, return_iterations=False):
+        """Solve argmin_x ||signatures @ x - b||_2 s.t. x >= 0 for every row b of input_batch
+
+        Vectorized Lawson-Hanson active-set method: every sample keeps its own passive set
+        but all of them are advanced in lock-step, solving the restricted normal equations
+        of the whole (sub)batch with a single batched LAPACK call per iteration.
+        On normalized mutation vectors the solutions match scipy.optimize.nnls up to an
+        absolute difference of ~1e-6 per weight.
+
+        Args:
+            input_batch (np.array(batch_size, 96)): Mutation vectors to decompose
+            maxiter (int, optional): Maximum number of iterations. Defaults to 3*num_sigs (as scipy).
+            batch_size (int, optional): Num of samples solved together, bounds memory usage
+                (each sample needs a num_sigs x num_sigs system). Defaults to 2048.
+            init (np.array(batch_size, num_sigs) or np.array(num_sigs), optional): Warm start.
+                Signatures with a positive value (e.g. the weights of a previous run of the
+                same sample, or a cohort-level prior) form the initial active set. Defaults to None.
+            return_iterations (bool, optional): Also return the num of iterations of each sample.
+
+        Returns:
+            np.array(batch_size, num_sigs): Non-negative weights
+
+        Raises:
+            ValueError: If input_batch contains NaN or inf (e.g. a normalized sample with no mutations), as scipy
+        """
+        input_batch = np.atleast_2d(np.asarray_chkfinite(input_batch, dtype=np.float64))
+        atb = input_batch @ self.signatures
+        if init is not None:
+            init = np.broadcast_to(np.asarray(init) > 0, atb.shape)
+
+        result = np.empty_like(atb)
+        iterations = np.empty(atb.shape[0], dtype=int)
+        for start in range(0, atb.shape[0], batch_size):
+            chunk = slice(start, start + batch_size)
+            result[chunk], iterations[chunk] = _nnls_gram(self.gram, atb[chunk],
+                                                          maxiter=maxiter,
+                                                          tol=self.tol,
+                                                          init=init[chunk] if init is not None else None)
+        if return_iterations:
+            return result, iterations
+        return result
+
+
+def get_nnls_catalog(signatures):
+    """Get the NNLSCatalog of a signature matrix, computed only once per distinct matrix
+    """
+    signatures = np.ascontiguousarray(signatures, dtype=np.float64)
+    key = (signatures.shape, hashlib.sha1(signatures.tobytes()).hexdigest())
+    if key not in _CATALOG_CACHE:
+        _CATALOG_CACHE[key] = NNLSCatalog(signatures)
+    return _CATALOG_CACHE[key]
+
+
+def batched_nnls(signatures, input_batch, **kwargs):
+    """Batched NNLS of input_batch against signatures. See NNLSCatalog.solve for the arguments.
+    """
+    return get_nnls_catalog(signatures).solve(input_batch, **kwargs)
+
+
+def _solve_passive(gram, atb, passive):
+    """Solve the normal equations restricted to each sample's passive set (0 elsewhere)
+
+    Passive variables are gathered to the front so only (n, p, p) systems are solved,
+    p being the largest passive set in the batch (padded with identity rows).
+    """
+    n_passive = passive.sum(axis=1)
+    p = max(int(n_passive.max()), 1)
+    order = np.argsort(~passive, axis=1, kind="stable")[:, :p]
+    valid = np.arange(p)[None, :] < n_passive[:, None]
+
+    lhs = gram[order[:, :, None], order[:, None, :]]
+    lhs = np.where(valid[:, :, None] & valid[:, None, :], lhs, 0.)
+    diag = np.arange(p)
+    lhs[:, diag, diag] += ~valid
+    rhs = np.where(valid, np.take_along_axis(atb, order, axis=1), 0.)
+    sub_solution = np.linalg.solve(lhs, rhs[..., None])[..., 0]
+
+    solution = np.zeros_like(atb)
+    np.put_along_axis(solution, order, np.where(valid, sub_solution, 0.), axis=1)
+    return solution
+
+
+def _warm_start(gram, atb, passive, tol):
+    """Shrink the initial passive sets until their LS solutions are feasible
+    """
+    passive = passive.copy()
+    iterations = np.zeros(atb.shape[0], dtype=int)
+    shrinking = np.ones(atb.shape[0], dtype=bool)
+    while True:
+        s = _solve_passive(gram, atb, passive)
+        infeasible = passive & (s <= tol)
+        iterations[shrinking] += 1
+        shrinking = infeasible.any(axis=1)
+        if not shrinking.any():
+            return s, passive, iterations
+        passive &= ~infeasible
+
+
+def _nnls_gram(gram, atb, maxiter, tol, init=None):
+    n, k = atb.shape
+    maxiter = 3*k if not maxiter else maxiter
+
+    x = np.zeros((n, k))
+    passive = np.zeros((n, k), dtype=bool)
+    iterations = np.zeros(n, dtype=int)
+    if init is not None and init.any():
+        x, passive, iterations = _warm_start(gram, atb, init, tol)
+    running = np.ones(n, dtype=bool)      # Samples which have not converged yet
+    optimal = np.ones(n, dtype=bool)      # x is the LS solution of its current passive set
+
+    while running.any():
+        # Outer loop: check KKT conditions and free the most violating variable
+        outer = running & optimal
+        if outer.any():
+            idx = np.flatnonzero(outer)
+            grad = atb[idx] - x[idx] @ gram
+            grad[passive[idx]] = -np.inf
+            best = np.argmax(grad, axis=1)
+            improvable = grad[np.arange(len(idx)), best] > tol
+            running[idx[~improvable]] = False
+            idx, best = idx[improvable], best[improvable]
+            passive[idx, best] = True
+            iterations[idx] += 1
+            if (iterations[idx] > maxiter).any():
+                raise RuntimeError("Maximum number of iterations reached.")
+
+        idx = np.flatnonzero(running)
+        if len(idx) == 0:
+            break
+
+        # Inner loop: solve on the passive set and step back if it becomes infeasible
+        s = _solve_passive(gram, atb[idx], passive[idx])
+        infeasible = passive[idx] & (s <= tol)
+        feasible = ~infeasible.any(axis=1)
+
+        done_idx = idx[feasible]
+        x[done_idx] = s[feasible]
+        optimal[done_idx] = True
+
+        step_idx = idx[~feasible]
+        if len(step_idx):
+            x_step, s_step = x[step_idx], s[~feasible]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                ratios = np.where(infeasible[~feasible], x_step/(x_step - s_step), np.inf)
+            alpha = ratios.min(axis=1, keepdims=True)
+            x_step = x_step + alpha*(s_step - x_step)
+            still_passive = passive[step_idx] & (x_step > tol)
+            x[step_idx] = np.where(still_passive, x_step, 0.)
+            passive[step_idx] = still_passive
+            optimal[step_idx] = False
+            iterations[step_idx] += 1
+    return x, iterations
@@ -0,0 +1,32 @@
+import logging
+import warnings
+
+import torch
+
+PRECISIONS = ["fp32", "int8"]
+
+
+def quantize_model(model, precision="int8"):
+    """Quantize the nn.Linear layers of a trained model for CPU inference
+
+    Weights are stored in int8 (per tensor) and activations are quantized on the fly for each
+    batch (dynamic quantization), so no calibration data is needed. The rest of layers stay in fp32.
+
+    Args:
+        model (nn.Module): Trained model (Classifier, FineTuner or ErrorFinder)
+        precision (str): One of PRECISIONS. "fp32" returns the model untouched. Default: "int8"
+
+    Returns:
+        nn.Module in eval mode
+    """
+    assert precision in PRECISIONS, f"Precision must be one of {PRECISIONS}. You provided {precision}"
+    if precision == "fp32":
+        return model
+    from torch.ao.quantization import quantize_dynamic
+    with warnings.catch_warnings():
+        # torch.ao.quantization is deprecated in favour of torchao, which is not a dependency of signaturesnet
+        warnings.simplefilter("ignore", category=DeprecationWarning)
+        warnings.simplefilter("ignore", category=UserWarning)
+        quantized = quantize_dynamic(model.eval(), {torch.nn.Linear}, dtype=torch.qint8)
+    logging.info("Quantized %s to %s" % (type(model).__name__, precision))
+    return quantized.eval()
@@ -0,0 +1,158 @@
+import collections
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+RESULT_CACHE_FORMAT_VERSION = 1
+
+
+def model_version(models, signatures, **settings):
+    """Fingerprint of a set of trained models: the hash of their parameters, the signatures and any other
+    settings which change their outputs (e.g. precision, inference engine)
+
+    Args:
+        models (list of nn.Module): Models before quantization
+        signatures (torch.Tensor): Signatures used by the NNLS
+        settings: Names and values of the other settings
+
+    Returns:
+        str: Hex digest
+    """
+    digest = hashlib.sha256()
+    digest.update(b"%i" % RESULT_CACHE_FORMAT_VERSION)
+    for model in models:
+        for name, tensor in sorted(model.state_dict().items()):
+            digest.update(name.encode())
+            digest.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    digest.update(signatures.detach().cpu().contiguous().numpy().tobytes())
+    for name, value in sorted(settings.items()):
+        digest.update(("%s=%r" % (name, value)).encode())
+    return digest.hexdigest()
+
+
+class ResultCache:
+
+    def __init__(self, max_entries=100000, path=None):
+        """Content-addressed cache of per-sample SigNet outputs (see SigNet(result_cache=...))
+
+        Entries are keyed by the hash of the normalized mutation vector, the num of mutations and a context
+        (model version, normalization, cutoff, ...), so identical samples are only refitted once, no matter
+        their name or the cohort they come in. Looked up entries are kept in an in-memory LRU tier of
+        max_entries samples (about 1KB each) backed, if path is given, by an on-disk SQLite tier which is kept
+        between runs and can be shared by several processes. The cache can be shared by several threads.
+
+        Args:
+            max_entries (int): Num of samples of the in-memory tier. Default: 100000
+            path (str, optional): SQLite file of the on-disk tier (created if missing). Default: memory only
+        """
+        self.max_entries = max_entries
+        self.path = path
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path is not None:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS results (key BLOB PRIMARY KEY, value BLOB)")
+            self._db.commit()
+            logging.info("Result cache: %s" % path)
+
+    @staticmethod
+    def keys(normalized_mutation_vec, num_mut, context):
+        """Key of each sample
+
+        Args:
+            normalized_mutation_vec (torch.Tensor(batch_size, 96)): Normalized mutation vectors
+            num_mut (torch.Tensor(batch_size)): Number of mutations of each sample
+            context (str): Everything else the outputs depend on (see SigNet)
+
+        Returns:
+            list of 16-byte keys
+        """
+        prefix = hashlib.blake2b(context.encode(), digest_size=16).digest()
+        vectors = np.ascontiguousarray(normalized_mutation_vec.detach().cpu().numpy(), dtype=np.float32)
+        num_mut = num_mut.detach().cpu().numpy().astype(np.float64).reshape(-1)
+        return [hashlib.blake2b(prefix + vectors[i].tobytes() + num_mut[i].tobytes(), digest_size=16).digest()
+                for i in range(vectors.shape[0])]
+
+    def get(self, keys):
+        """Look up the keys in the memory tier, then the disk tier
+
+        Returns:
+            found (np.array(batch_size) of bool), values (list of np.array, the ones found in keys order)
+        """
+        found = np.zeros(len(keys), dtype=bool)
+        values = [None]*len(keys)
+        with self._lock:
+            missing = []
+            for i, key in enumerate(keys):
+                value = self._memory.get(key)
+                if value is not None:
+                    self._memory.move_to_end(key)
+                    found[i], values[i] = True, value
+                else:
+                    missing.append(i)
+            self.memory_hits += len(keys) - len(missing)
+
+            if self._db is not None and missing:
+                stored = {}
+                for start in range(0, len(missing), 500):   # SQLite limits the num of query parameters
+                    batch = [keys[i] for i in missing[start:start + 500]]
+                    stored.update(self._db.execute("SELECT key, value FROM results WHERE key IN (%s)" %
+                                                   ",".join("?"*len(batch)), batch).fetchall())
+                for i in missing:
+                    value = stored.get(keys[i])
+                    if value is not None:
+                        found[i], values[i] = True, np.frombuffer(value, dtype=np.float32)
+                        self._remember(keys[i], values[i])
+                        self.disk_hits += 1
+            self.misses += len(keys) - int(found.sum())
+        return found, [value for value in values if value is not None]
+
+    def put(self, keys, values):
+        """Store the values (np.array(n, num_values) float32) of the keys in both tiers
+        """
+        values = np.asarray(values, dtype=np.float32)
+        with self._lock:
+            for key, value in zip(keys, values):
+                self._remember(key, value)
+            if self._db is not None:
+                self._db.executemany("INSERT OR REPLACE INTO results VALUES (?, ?)",
+                                     [(key, value.tobytes()) for key, value in zip(keys, values)])
+                self._db.commit()
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def hit_rate(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return (self.memory_hits + self.disk_hits)/lookups if lookups > 0 else None
+
+    def clear(self):
+        """Remove all entries of both tiers
+        """
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM results")
+                self._db.commit()
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def __len__(self):
+        return len(self._memory)
@@ -0,0 +1,115 @@
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Headless rendering of the per-sample signature decomposition plots of SigNetResult.plot_results.
+# Figures are drawn with the Agg canvas directly (no pyplot state) and reused between samples.
+
+PLOT_FORMATS = ["png", "pdf", "svg", "jpg"]
+
+_worker_figure = None
+
+
+class WeightsFigure:
+
+    def __init__(self, sig_names, dpi=100):
+        """Signature decomposition bar plot (same layout as utilities.plotting.plot_weights) whose bars and
+        error bars are updated in place for every sample
+
+        Args:
+            sig_names (list): Signature names (x axis)
+            dpi (int): Resolution of raster formats. Default: 100
+        """
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        self.num_classes = len(sig_names)
+        self.fig = Figure(figsize=(12, 8), dpi=dpi)
+        FigureCanvasAgg(self.fig)
+        ax = self.fig.add_subplot(111)
+        x = np.arange(self.num_classes)
+        zeros = np.zeros(self.num_classes)
+        self.bars = ax.bar(x, zeros, yerr=[zeros, zeros], align='center', alpha=0.5, ecolor='black', capsize=10)
+        _, self.caplines, self.barlinecols = self.bars.errorbar.lines
+        ax.spines['top'].set_visible(False)
+        ax.spines['right'].set_visible(False)
+        ax.yaxis.set_ticks_position('left')
+        ax.xaxis.set_ticks_position('bottom')
+        ax.set_ylabel('Weights')
+        ax.set_xticks(x)
+        ax.set_xticklabels(sig_names, rotation='vertical')
+        ax.set_title('Signature decomposition')
+        ax.set_ylim([0, 1])
+        self.fig.tight_layout()
+        self.x = x
+
+    def draw(self, weights, upper, lower, path, format="png"):
+        """Render one sample into path
+
+        Args:
+            weights, upper, lower (np.array(num_sigs)): Weights and error bounds (NaN bounds are not drawn)
+        """
+        for bar, height in zip(self.bars.patches, weights):
+            bar.set_height(height)
+        bottom = weights - np.abs(weights - lower)
+        top = weights + np.abs(upper - weights)
+        self.barlinecols[0].set_segments(np.stack([np.stack([self.x, bottom], axis=1),
+                                                   np.stack([self.x, top], axis=1)], axis=1))
+        self.caplines[0].set_ydata(bottom)
+        self.caplines[1].set_ydata(top)
+        self.fig.savefig(path, format=format)
+
+
+def _init_plot_worker(sig_names, dpi):
+    global _worker_figure
+    _worker_figure = WeightsFigure(sig_names, dpi=dpi)
+
+
+def _plot_chunk(weights, upper, lower, paths, format):
+    for i in range(len(paths)):
+        _worker_figure.draw(weights[i], upper[i], lower[i], paths[i], format=format)
+    return len(paths)
+
+
+def plot_weights_batch(weights, upper, lower, sample_names, sig_names, path,
+                       format="png", n_workers=1, chunk_size=16, dpi=100):
+    """Plot the signature decomposition of each sample into path/plot_<sample>.<format>
+
+    Args:
+        weights, upper, lower (np.array(n_samples, num_sigs)): Weights (without the unknown column) and error bounds
+        sample_names (list): Names used in the file names
+        sig_names (list): Signature names
+        format (str): One of PLOT_FORMATS. Default: "png"
+        n_workers (int): Num of processes rendering in parallel, each with its own reused figure.
+            Renders in-process when <= 1. Default: 1
+        chunk_size (int): Num of samples per pool task. Default: 16
+
+    Returns:
+        float: Plots per second
+    """
+    assert format in PLOT_FORMATS, f"Plot format must be one of {PLOT_FORMATS}. You provided {format}"
+    start = time.time()
+    paths = [os.path.join(path, "plot_%s.%s" % (sample, format)) for sample in sample_names]
+    chunks = [(np.asarray(weights[i:i + chunk_size], dtype=float),
+               np.asarray(upper[i:i + chunk_size], dtype=float),
+               np.asarray(lower[i:i + chunk_size], dtype=float),
+               paths[i:i + chunk_size],
+               format)
+              for i in range(0, len(paths), chunk_size)]
+
+    if n_workers <= 1:
+        _init_plot_worker(sig_names, dpi)
+        n_plots = sum(_plot_chunk(*chunk) for chunk in chunks)
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers,
+                                 initializer=_init_plot_worker,
+                                 initargs=(sig_names, dpi)) as executor:
+            n_plots = sum(executor.map(_plot_chunk, *zip(*chunks))) if chunks else 0
+
+    elapsed = time.time() - start
+    throughput = n_plots/elapsed if elapsed > 0 else float('inf')
+    logging.info("Plotted %i samples in %.1fs (%.1f plots/s, %i workers)" % (n_plots, elapsed, throughput, n_workers))
+    return throughput